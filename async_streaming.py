@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 Pascal Jürgens and Andreas Jungherr
+# See License.txt
+
+"""
+Many Streams in One Program
+---------------------------
+Connects to several of twitter's real-time streams at once using asyncio
+
+Requirements:
+    - depends on authentication module twitter_auth.py and streaming module streaming.py
+    - libraries aiohttp and oauthlib (installed along with requests-oauthlib)
+
+Why asyncio?
+============
+The stream function in streaming.py reads from a single connection and waits (blocks) until the next line arrives. To follow several tracking streams at once - for example with different keys and different keywords - you would have to start one python process for each of them. Most of the time, these processes do nothing but wait for twitter.
+
+Python's `asyncio`_ lets one program wait for many connections at the same time. Whenever a line arrives on any of them, the matching callbacks are called, and then the program goes back to waiting. The stream function in this module works just like streaming.stream and takes the same callbacks, but it is a *coroutine*: it has to be started with asyncio, for example through the run function below. Callbacks can be normal functions or coroutines (defined with async def), which is handy if they need to wait for something themselves, such as a web service.
+
+Just like in streaming.py, callbacks need to be quick. While a normal function is running, none of the streams is read.
+
+Example usage:
+    keys = twitter_auth.load_keys()
+    async_streaming.run(
+        async_streaming.stream(keys=keys[0], on_tweet=print_tweet, track=["election"]),
+        async_streaming.stream(keys=keys[1], on_tweet=print_tweet, track=["politics"]))
+
+For testing, the url parameter can point to a local server that imitates twitter. The test function below does exactly that: it starts a small aiohttp.web server that answers with a few lines of json (a tweet, a delete notice, a limit notice and a disconnect notice) and checks that every callback sees what it should. It needs neither keys nor network access:
+    python3 async_streaming.py
+
+.. _`asyncio`: https://docs.python.org/3/library/asyncio.html
+"""
+
+import asyncio
+import collections
+import inspect
+import logging
+import urllib.parse
+
+from oauthlib.oauth1 import Client
+
+import streaming
+import twitter_auth
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Twitter sends a blank line every 30 seconds. If nothing arrives
+# for 90 seconds, the connection has stalled and we reconnect.
+STALL_TIMEOUT = 90
+
+
+def oauth_headers(keys, url, body):
+    """
+    Sign a POST request with a set of keys as loaded by twitter_auth.load_keys.
+    A new signature is needed for every connection.
+
+    :param keys:
+    :type keys: dictionary with client_key, client_secret, resource_owner_key and resource_owner_secret
+    :param url:
+    :type url: str
+    :param body:
+    :type body: str, url-encoded parameters
+    :returns: dictionary of http headers
+    """
+    client = Client(keys["client_key"],
+                    client_secret=keys["client_secret"],
+                    resource_owner_key=keys["resource_owner_key"],
+                    resource_owner_secret=keys["resource_owner_secret"])
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    uri, headers, body = client.sign(url, http_method="POST", body=body, headers=headers)
+    return headers
+
+
+async def iter_lines(response):
+    """
+    Split the body of a streaming response into lines.
+    We do this ourselves, as aiohttp refuses lines longer than 64 kilobytes.
+
+    :returns: asynchronous generator yielding lines as bytes, without line endings
+    """
+    pending = b""
+    async for chunk in response.content.iter_any():
+        lines = (pending + chunk).split(b"\n")
+        # The last piece is the beginning of a line that is not complete yet
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+
+async def stream(keys=None, on_tweet=None, on_notification=None, track=None, follow=None,
+                 on_raw=None, on_delete=None, on_limit=None, url=None, session=None):
+    """
+    Connect to a stream and keep reading from it, reconnecting after errors.
+    Works like streaming.stream, but has to be run with asyncio (see run).
+    Callbacks can be functions or coroutines.
+
+    Example usage:
+        async def pt(tweet):
+            print(tweet["text"])
+        async_streaming.run(async_streaming.stream(on_tweet=pt, track=["#cdu", "#spd"]))
+
+    :param keys:
+    :type keys: dictionary of twitter API keys (see twitter_auth.load_keys).
+    If none are given, the first set of keys in keys.yaml is used.
+    :param on_tweet:
+    :type on_tweet: function or coroutine
+    :param on_notification:
+    :type on_notification: function or coroutine
+    :param track:
+    :type track: list of tracking strings
+    :param follow:
+    :type follow: list of user IDs to track
+    :param on_raw:
+    :type on_raw: function or coroutine receiving every non-blank line as bytes
+    :param on_delete:
+    :type on_delete: function or coroutine receiving (tweet ID, user ID, timestamp_ms) of delete notices
+    :param on_limit:
+    :type on_limit: function or coroutine receiving (undelivered tweets, timestamp_ms) of limit notices
+    :param url:
+    :type url: str, to connect somewhere else than twitter (for example a test server)
+    :param session:
+    :type session: aiohttp.ClientSession (optional), shared between streams
+    """
+    if aiohttp is None:
+        raise ImportError("async_streaming requires the aiohttp library: pip3 install aiohttp")
+    keys = keys or twitter_auth.load_keys()[0]
+    # Use default values (copied, so we don't change the defaults themselves)
+    parameters = dict(streaming.DEFAULT_PARAMETERS)
+    # Twitter expects lists as comma-separated values
+    if track:
+        parameters['track'] = ",".join(track)
+    elif follow:
+        parameters['follow'] = ",".join(str(user) for user in follow)
+    if not url:
+        url = streaming.FILTER_URL if (track or follow) else streaming.SAMPLE_URL
+    body = urllib.parse.urlencode(parameters)
+    own_session = session is None
+    if own_session:
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=STALL_TIMEOUT)
+        session = aiohttp.ClientSession(timeout=timeout)
+    # Errors on this connection are counted separately from other streams
+    delays = streaming.Backoff()
+    try:
+        while True:
+            try:
+                response = await session.post(url, data=body, headers=oauth_headers(keys, url, body))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.error("Error! Could not connect: {0}".format(e))
+                await asyncio.sleep(delays.delay())
+                continue
+            if response.status != 200:
+                response.close()
+                await asyncio.sleep(delays.delay(response.status))
+                continue
+            delays.connected()
+            disconnect_code = None
+            try:
+                async for line in iter_lines(response):
+                    # Keep-alive blank lines show that the connection is healthy, too
+                    delays.received()
+                    # Skip blank lines
+                    if not line:
+                        continue
+                    try:
+                        kind = await handle_line(line, on_tweet, on_notification, on_raw, on_delete, on_limit)
+                    except Exception as e:
+                        logging.error("Error! Encountered Exception {0} but continuing in order not to drop stream,".format(e))
+                        continue
+                    if kind == "disconnect":
+                        disconnect_code = streaming.parse_disconnect(line)
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.error("Error! Stream interrupted: {0}".format(e))
+            finally:
+                response.close()
+            # The stream ended, so we wait a moment before reconnecting
+            await asyncio.sleep(delays.delay(disconnect_code))
+    finally:
+        if own_session:
+            await session.close()
+
+
+async def handle_line(line, on_tweet=None, on_notification=None, on_raw=None, on_delete=None, on_limit=None):
+    """
+    Hand one line from the stream to the callbacks with streaming.handle_line,
+    waiting for the callbacks that are coroutines.
+
+    :returns: kind of message as in streaming.classify_line
+    """
+    kind, results = streaming.handle_line(line, on_tweet, on_notification, on_raw, on_delete, on_limit)
+    for result in results:
+        if inspect.isawaitable(result):
+            await result
+    return kind
+
+
+def run(*streams):
+    """
+    Run several streams at once until they are stopped (for example with ctrl-c).
+
+    :param streams:
+    :type streams: coroutines returned by stream()
+    """
+    async def main():
+        await asyncio.gather(*streams)
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        logging.error("User stopped program, exiting!")
+
+
+# Lines sent by the test server: everything after the disconnect notice
+# must never reach the callbacks
+TEST_LINES = [
+    b'{"created_at":"Thu Oct 15 12:00:00 +0000 2015","id":1,"text":"first tweet"}',
+    b'',
+    b'{"delete":{"status":{"id":2,"id_str":"2","user_id":3,"user_id_str":"3"},"timestamp_ms":"1444910400000"}}',
+    b'{"limit":{"track":16,"timestamp_ms":"1444910400000"}}',
+    b'{"disconnect":{"code":4,"stream_name":"test","reason":"test"}}',
+    b'{"created_at":"Thu Oct 15 12:00:01 +0000 2015","id":4,"text":"after the disconnect"}',
+]
+
+
+def test(connections=2, timeout=10):
+    """
+    Run a stream against a local server that imitates twitter's streaming API.
+    The server answers every connection with TEST_LINES. The stream has to
+    deliver the tweet, delete and limit notice, then reconnect after
+    the disconnect notice. Callbacks are a mix of functions and coroutines.
+
+    :param connections:
+    :type connections: int, number of connections to wait for
+    :param timeout:
+    :type timeout: seconds after which the test fails
+    :returns: True if the callbacks received exactly what they should
+    """
+    if aiohttp is None:
+        raise ImportError("async_streaming requires the aiohttp library: pip3 install aiohttp")
+    from aiohttp import web
+    received = collections.Counter()
+
+    async def handler(request):
+        received["connections"] += 1
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for line in TEST_LINES:
+            await response.write(line + b"\r\n")
+        await response.write_eof()
+        return response
+
+    def on_tweet(tweet):
+        received["tweets"] += 1
+        if tweet["id"] != 1:
+            received["unexpected"] += 1
+
+    async def on_delete(tweet_id, user_id, timestamp_ms):
+        received["deletes"] += 1
+
+    async def on_limit(track, timestamp_ms):
+        received["limited"] += track
+
+    def on_raw(line):
+        received["lines"] += 1
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/stream", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        keys = {"client_key": "test", "client_secret": "test",
+                "resource_owner_key": "test", "resource_owner_secret": "test"}
+        task = asyncio.ensure_future(stream(
+            keys=keys, on_tweet=on_tweet, on_raw=on_raw, on_delete=on_delete, on_limit=on_limit,
+            track=["test"], url="http://127.0.0.1:{0}/stream".format(port)))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # The stream reconnects after a disconnect notice, so the server sees several connections
+        while received["connections"] <= connections and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await runner.cleanup()
+
+    asyncio.run(main())
+    # The last connection may have been cancelled halfway, so we only count finished ones
+    expected = {"tweets": connections, "deletes": connections,
+                "limited": 16 * connections, "lines": 4 * connections}
+    passed = received["connections"] > connections and not received["unexpected"]
+    for name, count in expected.items():
+        if received[name] < count:
+            passed = False
+    logging.warning("Test {0}: {1}".format("passed" if passed else "FAILED", dict(received)))
+    return passed
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 Pascal Jürgens and Andreas Jungherr
+# See License.txt
+
+"""
+Measuring Query Speed
+---------------------
+Compares iterating over database objects with streaming plain rows
+
+Requirements:
+    - depends on database module database.py
+
+Why does this matter?
+=====================
+When you loop over a query such as database.hashtag_counts, peewee creates a python object for every row, and keeps all of them in memory in case you loop over the query again. For a few thousand rows, nobody notices. For millions of rows, building these objects takes much longer than the query itself and memory use grows with every row.
+
+The *_rows functions in database.py (and database.iter_rows for your own queries) skip this step: they select only the needed columns and stream them as light-weight named tuples, a few thousand at a time. This script runs both variants on your database and prints the time, the number of rows per second and the peak memory used by python for each of them.
+
+Example usage:
+    python3 benchmark.py
+or, from python:
+    benchmark.run(start_date, stop_date)
+"""
+
+import datetime
+import time
+import tracemalloc
+
+import database
+
+
+def measure(label, rows, fields):
+    """
+    Loop over rows, reading the given fields of each row,
+    and print how long that took and how much memory it needed.
+
+    :param label:
+    :type label: str, name of the measurement
+    :param rows:
+    :type rows: function returning an iterable of objects or named tuples
+    :param fields:
+    :type fields: list of attribute names to read from every row
+    :returns: tuple (number of rows, seconds, peak memory in bytes)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = 0
+    for row in rows():
+        for field in fields:
+            getattr(row, field)
+        count += 1
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("{0:<40} {1:>10} rows {2:>8.2f} s {3:>12.0f} rows/s {4:>8.1f} MB".format(
+        label, count, seconds, count / seconds if seconds else 0, peak / 1024 ** 2))
+    return count, seconds, peak
+
+
+def run(start_date=None, stop_date=None):
+    """
+    Compare objects and rows for the analytical helpers and for all tweets.
+    By default, the whole database is used.
+
+    :param start_date:
+    :type start_date: timezone-aware datetime
+    :param stop_date:
+    :type stop_date: timezone-aware datetime
+    """
+    start_date = start_date or database.utc.localize(datetime.datetime(1970, 1, 1))
+    stop_date = stop_date or database.utc.localize(datetime.datetime(2100, 1, 1))
+    comparisons = [
+        ("tweetcount_per_user",
+         lambda: database.tweetcount_per_user(),
+         lambda: database.tweetcount_per_user_rows(),
+         ["username", "count"]),
+        ("mention_counts",
+         lambda: database.mention_counts(start_date, stop_date),
+         lambda: database.mention_count_rows(start_date, stop_date),
+         ["username", "count"]),
+        ("hashtag_counts",
+         lambda: database.hashtag_counts(start_date, stop_date),
+         lambda: database.hashtag_count_rows(start_date, stop_date),
+         ["count"]),
+        ("url_counts",
+         lambda: database.url_counts(start_date, stop_date),
+         lambda: database.url_count_rows(start_date, stop_date),
+         ["count"]),
+        ("all tweets",
+         lambda: database.Tweet.select(),
+         lambda: database.iter_rows(database.Tweet.select(
+             database.Tweet.id, database.Tweet.date, database.Tweet.text)),
+         ["id", "date", "text"]),
+    ]
+    for name, objects, rows, fields in comparisons:
+        measure("{0} (objects)".format(name), objects, fields)
+        measure("{0} (rows)".format(name), rows, fields)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 Pascal Jürgens and Andreas Jungherr
+# See License.txt
+
+"""
+Capturing Raw Streams to Disk
+-----------------------------
+Writes lines from twitter's streams to compressed files, exactly as they were received
+
+Requirements:
+    - optionally uses the library zstandard (version 0.15 or newer) for zstd compression
+
+Why store raw lines?
+====================
+The simplest way of saving a stream is to decode every tweet and write it back to a file with json.dump. That means doing the expensive work of decoding and encoding json for every single tweet, only to end up with (almost) the same text we received in the first place. It is much cheaper to write the lines exactly as twitter sent them. As a bonus, the archive is guaranteed to contain the original data without any modifications.
+
+Tweets compress very well, usually to a fifth or less of their original size. Instead of writing one huge file, the SegmentWriter below starts a new file (a *segment*) once the current one has reached a certain size or age. A background thread checks the age regularly, so segments are also finished on time when the stream is quiet or disconnected. Finished segments can be moved, backed up or imported (see ingest.py, which reads compressed files directly) while the stream keeps running.
+
+For every finished segment, a line is added to an index file. It records the file name, the number of lines and tweets as well as the first and last tweet ID and timestamp. This way, finding the segment that covers a certain point in time does not require decompressing any files.
+
+Example usage:
+    writer = capture.SegmentWriter("captures", prefix="election")
+    streaming.stream(on_raw=writer, track=["election"])
+"""
+
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Finding the tweet ID and timestamp with regular expressions is much faster than
+# decoding the whole line. The first "id" in a tweet is the ID of the tweet itself.
+ID_PATTERN = re.compile(br'"id":(\d+)')
+TIMESTAMP_PATTERN = re.compile(br'"timestamp_ms":"(\d+)"')
+
+# Tweets (as opposed to notices such as deletes or limits) start with this key
+TWEET_PREFIX = b'{"created_at"'
+
+EXTENSIONS = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst", None: ".jsonl"}
+
+
+def open_segment(path, compression):
+    """
+    Open a new segment file for writing with the given compression.
+
+    :returns: tuple (file object to write to, underlying raw file object)
+    """
+    raw = open(path, "wb")
+    if compression == "gzip":
+        # Level 6 compresses almost as well as 9 and is considerably faster
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6), raw
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression requires the zstandard library: pip3 install zstandard")
+        # closefd=False: closing the writer ends the frame and frees the
+        # compression context, but leaves the file open for fsync
+        return zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=False), raw
+    return raw, raw
+
+
+class SegmentWriter(object):
+
+    """
+    Writes raw lines into a series of compressed files, starting a new file
+    once the current one exceeds max_bytes (uncompressed) or max_seconds.
+    The object can be called with a line, so it can be passed to
+    streaming.stream as on_raw callback directly.
+    """
+
+    def __init__(self, directory, prefix="stream", max_bytes=1024 ** 3, max_seconds=3600,
+                 compression="gzip", fsync="segment", check_every=10):
+        """
+        :param directory:
+        :type directory: str, where to put segments and the index (created if necessary)
+        :param prefix:
+        :type prefix: str, beginning of all file names
+        :param max_bytes:
+        :type max_bytes: int, uncompressed size after which a new segment is started
+        :param max_seconds:
+        :type max_seconds: int, age after which a new segment is started
+        :param compression:
+        :type compression: "gzip", "zstd" or None
+        :param fsync:
+        :type fsync: "segment" to force data to disk when a segment is finished,
+        "never" to leave this to the operating system or a number of seconds
+        between forced writes (at the cost of slightly worse compression)
+        :param check_every:
+        :type check_every: int, seconds between checks of the segment's age (and
+        periodic fsync) in the background, independent of incoming lines
+        """
+        if compression not in EXTENSIONS:
+            raise ValueError("Unknown compression {0}, use one of {1}".format(compression, list(EXTENSIONS)))
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compression = compression
+        self.fsync = fsync
+        self.index_path = os.path.join(directory, "{0}-index.jsonl".format(prefix))
+        os.makedirs(directory, exist_ok=True)
+        self.file = None
+        self.segment = None
+        # Lines are written by the stream, while the background thread
+        # finishes old segments, so both need to take turns
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._watcher = threading.Thread(target=self._watch, args=(check_every,), daemon=True)
+        self._watcher.start()
+
+    def _watch(self, check_every):
+        """
+        Background thread: check the current segment regularly until closed.
+        """
+        while not self._closed.wait(check_every):
+            try:
+                self.check()
+            except Exception as exc:
+                logging.error("Could not check segment: {0}".format(exc))
+
+    def check(self):
+        """
+        Finish the current segment if it is too old and force data to disk
+        if a periodic fsync is due. Called by write and the background thread.
+        """
+        with self._lock:
+            if self.file is None:
+                return
+            now = time.time()
+            if self.fsync not in ("segment", "never") and now - self.last_sync >= self.fsync:
+                self.sync()
+            if self.segment["bytes"] >= self.max_bytes or now - self.segment["started"] >= self.max_seconds:
+                self.finish_segment()
+
+    def start_segment(self):
+        """
+        Open a new segment file named after the current UTC time.
+        """
+        name = "{0}-{1}".format(self.prefix, time.strftime("%Y%m%d-%H%M%S", time.gmtime()))
+        extension = EXTENSIONS[self.compression]
+        path = os.path.join(self.directory, name + extension)
+        # Several segments within one second get a counter attached
+        counter = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, "{0}-{1}{2}".format(name, counter, extension))
+            counter += 1
+        self.file, self.raw = open_segment(path, self.compression)
+        self.segment = {
+            "file": os.path.basename(path),
+            "started": time.time(),
+            "lines": 0,
+            "tweets": 0,
+            "bytes": 0,
+            "first_id": None,
+            "last_id": None,
+            "first_timestamp_ms": None,
+            "last_timestamp_ms": None,
+        }
+        self.last_sync = time.time()
+
+    def write(self, line):
+        """
+        Write one line (as bytes, without newline) to the current segment.
+        """
+        with self._lock:
+            if self.file is None:
+                self.start_segment()
+            self.file.write(line + b"\n")
+            segment = self.segment
+            segment["lines"] += 1
+            segment["bytes"] += len(line) + 1
+            if line.startswith(TWEET_PREFIX):
+                segment["tweets"] += 1
+                match = ID_PATTERN.search(line)
+                if match:
+                    segment["last_id"] = int(match.group(1))
+                    if segment["first_id"] is None:
+                        segment["first_id"] = segment["last_id"]
+                # The timestamp sits at the very end of a tweet, so we only search there
+                match = TIMESTAMP_PATTERN.search(line, max(0, len(line) - 100))
+                if match:
+                    segment["last_timestamp_ms"] = int(match.group(1))
+                    if segment["first_timestamp_ms"] is None:
+                        segment["first_timestamp_ms"] = segment["last_timestamp_ms"]
+            self.check()
+
+    __call__ = write
+
+    def sync(self):
+        """
+        Force everything written so far onto the disk.
+        """
+        with self._lock:
+            self.file.flush()
+            self.raw.flush()
+            os.fsync(self.raw.fileno())
+            self.last_sync = time.time()
+
+    def finish_segment(self):
+        """
+        Close the current segment and add it to the index.
+        """
+        with self._lock:
+            if self.file is None:
+                return
+            # Write the remaining compressed data. Neither gzip nor zstd
+            # writers close the file itself, so it can still be synced.
+            if self.file is not self.raw:
+                self.file.close()
+            self.raw.flush()
+            if self.fsync != "never":
+                os.fsync(self.raw.fileno())
+            self.raw.close()
+            self.segment["finished"] = time.time()
+            with open(self.index_path, "a") as index:
+                index.write(json.dumps(self.segment) + "\n")
+            logging.info("Finished segment {0} with {1} lines".format(
+                self.segment["file"], self.segment["lines"]))
+            self.file = None
+            self.segment = None
+
+    def close(self):
+        """
+        Finish the current segment and stop the background thread.
+        Call this before your program exits!
+        """
+        self._closed.set()
+        self.finish_segment()
+
+
+def read_index(directory, prefix="stream"):
+    """
+    Read the index of finished segments.
+
+    :returns: list of dictionaries, one per segment
+    """
+    path = os.path.join(directory, "{0}-index.jsonl".format(prefix))
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 Pascal Jürgens and Andreas Jungherr
+# See License.txt
+
+"""
+Exporting the Database to Parquet Files
+---------------------------------------
+Writes tweets, users and their links into columnar files for fast analysis
+
+Requirements:
+    - depends on database module database.py
+    - library pyarrow (pip3 install pyarrow)
+
+Why another file format?
+========================
+The database is great for storing tweets and for looking up specific ones, but analysing *all* tweets through it can be slow: every row is turned into a python object before we get to work with it. CSV files, on the other hand, need to be parsed again (and their data types guessed) every time R or python reads them.
+
+`Parquet`_ files store data column by column, compressed and with proper data types. Libraries such as pandas, R's arrow package, duckdb or spark read them very quickly, and they only need to read the columns (and days) that an analysis actually uses.
+
+The function export_corpus writes one set of files per table:
+
+- tweets: one row per tweet (id, user_id, text, date, language, reply_to_user_id, reply_to_tweet, retweet_id and the retweet, reply and mention counts)
+- users: one row per user (id, username)
+- tweet_hashtags, tweet_urls, tweet_mentions: one row per link between a tweet and a hashtag, URL or mentioned user
+
+Tweets and links are split into one directory per day (for example tweets/day=2015-10-27/), a layout that most tools understand as a *partitioned dataset*: reading a few days only touches their files. Rows are read from the database with a plain cursor in batches, so memory use stays constant no matter how large the database is.
+
+Example usage:
+    columnar.export_corpus("corpus")
+    tweets = columnar.read_table("corpus", "tweets", start_day="2015-10-28").to_pandas()
+
+In R:
+    library(arrow)
+    tweets <- open_dataset("corpus/tweets")
+
+.. _`Parquet`: https://parquet.apache.org/
+"""
+
+import itertools
+import logging
+import os
+import shutil
+
+import database
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def table_definitions():
+    """
+    Describe the exported tables: the query producing their rows,
+    the names and types of their columns and whether they are split by day.
+    Queries of tables split by day return the day as last column and are
+    ordered by it.
+
+    :returns: dictionary table name -> (SQL query, list of (column name, type), split by day)
+    """
+    tweet = database.Tweet._meta.db_table
+    links = [
+        ("tweet_hashtags", database.Tweet.tags.get_through_model(), "hashtag_id", "hashtag", pyarrow.string()),
+        ("tweet_urls", database.Tweet.urls.get_through_model(), "url_id", "url", pyarrow.string()),
+        ("tweet_mentions", database.Tweet.mentions.get_through_model(), "user_id", "user_id", pyarrow.int64()),
+    ]
+    tables = {
+        "tweets": (
+            'SELECT t."id", t."user_id", t."text", t."date", t."language_id", t."reply_to_user_id", '
+            't."reply_to_tweet", t."retweet_id", t."retweet_count", t."reply_count", t."mention_count", '
+            'SUBSTR(t."date", 1, 10) FROM "{0}" AS t ORDER BY t."date"'.format(tweet),
+            [("id", pyarrow.int64()), ("user_id", pyarrow.int64()), ("text", pyarrow.string()),
+             ("date", pyarrow.timestamp("s", tz="UTC")), ("language", pyarrow.string()),
+             ("reply_to_user_id", pyarrow.int64()), ("reply_to_tweet", pyarrow.int64()),
+             ("retweet_id", pyarrow.int64()), ("retweet_count", pyarrow.int32()),
+             ("reply_count", pyarrow.int32()), ("mention_count", pyarrow.int32())],
+            True),
+        "users": (
+            'SELECT "id", "username" FROM "{0}" ORDER BY "id"'.format(database.User._meta.db_table),
+            [("id", pyarrow.int64()), ("username", pyarrow.string())],
+            False),
+    }
+    for name, through, column, label, kind in links:
+        # Links are ordered by the date of their tweet, which the index on dates provides
+        tables[name] = (
+            'SELECT x."tweet_id", x."{0}", SUBSTR(t."date", 1, 10) FROM "{1}" AS t '
+            'JOIN "{2}" AS x ON x."tweet_id" = t."id" ORDER BY t."date"'.format(
+                column, tweet, through._meta.db_table),
+            [("tweet_id", pyarrow.int64()), (label, kind)],
+            True)
+    return tables
+
+
+def to_record_batch(rows, columns):
+    """
+    Turn rows from the database into an arrow record batch.
+
+    :param rows:
+    :type rows: list of tuples
+    :param columns:
+    :type columns: list of (column name, arrow type)
+    """
+    arrays = []
+    for position, (name, kind) in enumerate(columns):
+        values = [row[position] for row in rows]
+        if pyarrow.types.is_timestamp(kind):
+            # Dates are stored as text in the database
+            array = pyarrow.compute.strptime(pyarrow.array(values, pyarrow.string()),
+                                             format="%Y-%m-%d %H:%M:%S", unit="s")
+            array = array.cast(kind)
+        else:
+            array = pyarrow.array(values, kind)
+        arrays.append(array)
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=pyarrow.schema(columns))
+
+
+def export_table(directory, name, batch_size=100000, compression="zstd"):
+    """
+    Export one table (see table_definitions) into Parquet files.
+    Files from an earlier export of the table are deleted first, so that
+    days which are no longer in the database do not linger.
+
+    :param directory:
+    :type directory: str, the table is written into a subdirectory with its name
+    :param name:
+    :type name: str, name of the table
+    :param batch_size:
+    :type batch_size: int, number of rows fetched from the database at a time
+    :param compression:
+    :type compression: str, "zstd", "snappy", "gzip" or "none"
+    :returns: number of exported rows
+    """
+    if pyarrow is None:
+        raise ImportError("Exporting to Parquet requires the pyarrow library: pip3 install pyarrow")
+    sql, columns, by_day = table_definitions()[name]
+    schema = pyarrow.schema(columns)
+    path = os.path.join(directory, name)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    cursor = database.db.execute_sql(sql)
+    writer = None
+    current_day = None
+    exported = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            exported += len(rows)
+            if not by_day:
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(
+                        os.path.join(path, "part-0.parquet"), schema, compression=compression)
+                writer.write_batch(to_record_batch(rows, columns))
+                continue
+            # Rows are ordered by day, so we only need one file open at a time
+            for day, group in itertools.groupby(rows, key=lambda row: row[-1]):
+                if day != current_day:
+                    if writer is not None:
+                        writer.close()
+                    day_path = os.path.join(path, "day={0}".format(day))
+                    os.makedirs(day_path, exist_ok=True)
+                    writer = pyarrow.parquet.ParquetWriter(
+                        os.path.join(day_path, "part-0.parquet"), schema, compression=compression)
+                    current_day = day
+                writer.write_batch(to_record_batch(list(group), columns))
+    finally:
+        if writer is not None:
+            writer.close()
+    logging.info("Exported {0} rows of {1}".format(exported, name))
+    return exported
+
+
+def export_corpus(directory, tables=None, batch_size=100000, compression="zstd"):
+    """
+    Export the database into Parquet files, one subdirectory per table.
+    Existing subdirectories of the exported tables are replaced.
+
+    :param directory:
+    :type directory: str
+    :param tables:
+    :type tables: list of table names (defaults to all, see table_definitions)
+    :returns: dictionary table name -> number of exported rows
+    """
+    if pyarrow is None:
+        raise ImportError("Exporting to Parquet requires the pyarrow library: pip3 install pyarrow")
+    tables = tables or list(table_definitions())
+    return {name: export_table(directory, name, batch_size, compression) for name in tables}
+
+
+def read_table(directory, name, start_day=None, stop_day=None, columns=None):
+    """
+    Read an exported table. Days outside start_day and stop_day are not read at all.
+
+    Example usage:
+        links = columnar.read_table("corpus", "tweet_hashtags", "2015-10-28", "2015-10-30")
+        print(links.to_pandas()["hashtag"].value_counts())
+
+    :param directory:
+    :type directory: str, as passed to export_corpus
+    :param name:
+    :type name: str, name of the table
+    :param start_day:
+    :type start_day: str such as "2015-10-28" (UTC), first day to read
+    :param stop_day:
+    :type stop_day: str, first day not to read
+    :param columns:
+    :type columns: list of column names to read (defaults to all)
+    :returns: pyarrow Table (use .to_pandas() to get a DataFrame)
+    """
+    if pyarrow is None:
+        raise ImportError("Reading Parquet files requires the pyarrow library: pip3 install pyarrow")
+    by_day = table_definitions()[name][2]
+    partitioning = None
+    if by_day:
+        partitioning = pyarrow.dataset.partitioning(
+            pyarrow.schema([("day", pyarrow.string())]), flavor="hive")
+    dataset = pyarrow.dataset.dataset(
+        os.path.join(directory, name), format="parquet", partitioning=partitioning)
+    condition = None
+    if by_day:
+        day = pyarrow.dataset.field("day")
+        if start_day:
+            condition = day >= start_day
+        if stop_day:
+            condition = day < stop_day if condition is None else condition & (day < stop_day)
+    return dataset.to_table(columns=columns, filter=condition)
@@ -85,8 +85,15 @@ The major disadvantage of this format is that for each iteration of your analysi
 
 """
 
+import re
 import logging
 import datetime
+import threading
+import unicodedata
+import contextlib
+from array import array
+import collections
+from collections import OrderedDict
 from dateutil import parser
 from pytz import utc, timezone
 
@@ -123,6 +130,7 @@ class Hashtag(BaseModel):
 
     """
     Hashtag model.
+    Hashtags are stored in lower case (see find_hashtags).
     """
     tag = peewee.CharField(unique=True, primary_key=True)
 
@@ -148,9 +156,12 @@ class User(BaseModel):
     """
     Twitter user model.
     Stores the user's unique ID as a primary key along with the username.
+    The username is also stored in lower case, so that it can be looked
+    up ignoring case with the help of an index (see find_users).
     """
     id = peewee.BigIntegerField(unique=True, primary_key=True)
     username = peewee.CharField(null=True)
+    username_lower = peewee.CharField(null=True, index=True)
 
     def last_tweet(self):
         return Tweet.select().where(Tweet.user == self).order_by(Tweet.id.desc())[0]
@@ -164,6 +175,9 @@ class Tweet(BaseModel):
     """
     Tweet model.
     Stores the tweet's unique ID as a primary key along with the user, text and date.
+    The numbers of retweets and replies (within the database) and of mentioned users
+    are kept up to date while storing tweets, so that finding the most retweeted
+    tweets does not require counting them first.
     """
     id = peewee.BigIntegerField(unique=True, primary_key=True)
     user = peewee.ForeignKeyField(User, related_name='tweets', index=True)
@@ -178,6 +192,87 @@ class Tweet(BaseModel):
     reply_to_tweet = peewee.BigIntegerField(null=True, index=True)
     retweet = peewee.ForeignKeyField(
         'self', null=True, index=True, related_name='retweets')
+    retweet_count = peewee.IntegerField(default=0, index=True)
+    reply_count = peewee.IntegerField(default=0)
+    mention_count = peewee.IntegerField(default=0)
+
+
+class HydrationPage(BaseModel):
+
+    """
+    Checkpoint model for hydrating lists of tweet IDs.
+    Stores one entry per page of (up to 100) IDs requested from twitter.
+    """
+    first_id = peewee.BigIntegerField(index=True)
+    last_id = peewee.BigIntegerField()
+    requested = peewee.IntegerField()
+    returned = peewee.IntegerField()
+    date = peewee.DateTimeField(default=datetime.datetime.utcnow)
+
+
+class MissingTweet(BaseModel):
+
+    """
+    Tweet IDs that twitter did not return during hydration,
+    usually because the tweets were deleted or made private.
+    """
+    id = peewee.BigIntegerField(unique=True, primary_key=True)
+    page = peewee.ForeignKeyField(HydrationPage, related_name='missing_tweets')
+
+
+class StreamMinute(BaseModel):
+
+    """
+    Coverage statistics of a stream, one entry per stream name and minute (UTC):
+    the number of delivered tweets, tweets withheld by twitter's
+    rate limit (from limit notices) and delete notices.
+    """
+    stream = peewee.CharField()
+    minute = peewee.DateTimeField(index=True)
+    delivered = peewee.IntegerField()
+    limited = peewee.IntegerField()
+    deleted = peewee.IntegerField()
+
+    class Meta:
+        indexes = (
+            (('stream', 'minute'), True),
+        )
+
+
+class DeletedTweet(BaseModel):
+
+    """
+    Tweets that twitter announced as deleted through delete notices.
+    """
+    id = peewee.BigIntegerField(unique=True, primary_key=True)
+    user_id = peewee.BigIntegerField(null=True)
+    date = peewee.DateTimeField(null=True)
+
+
+class Rollup(BaseModel):
+
+    """
+    Pre-computed counts of tweets per time bucket (UTC), kept up to date while
+    storing tweets. Each entry counts one kind of thing for one key:
+    - kind "tweets": all tweets, key is empty
+    - kind "user": tweets by the user with the ID in key
+    - kind "mention": tweets mentioning the user with the ID in key
+    - kind "hashtag": tweets containing the (lower case) hashtag in key
+    - kind "retweeted": retweets of tweets by the user with the ID in key
+    - kind "version": a single row whose count is the ROLLUP_VERSION of the table
+    interval is the size of the bucket ("minute", "hour" or "day") and
+    bucket its beginning.
+    """
+    interval = peewee.CharField()
+    bucket = peewee.DateTimeField()
+    kind = peewee.CharField()
+    key = peewee.CharField()
+    count = peewee.IntegerField()
+
+    class Meta:
+        indexes = (
+            (('kind', 'interval', 'key', 'bucket'), True),
+        )
 
 
 #
@@ -185,19 +280,182 @@ class Tweet(BaseModel):
 #
 
 
+class KeyCache(object):
+
+    """
+    Bounded cache of primary keys that are known to exist in the database.
+    The same hashtags, languages and prolific users appear over and over again,
+    so remembering which of them we already stored saves most lookups.
+    Once the cache is full, the least recently used key is dropped.
+    Hits and misses are counted in the attributes of the same name.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._keys = OrderedDict()
+        # Streaming callbacks may run in several threads at once
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._keys:
+                # Mark the key as recently used
+                self._keys.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        with self._lock:
+            self._keys[key] = True
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.size:
+                self._keys.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+# Number of keys remembered per cache. Change it with set_cache_size.
+CACHE_SIZE = 100000
+
+key_caches = {
+    "users": KeyCache(CACHE_SIZE),
+    "hashtags": KeyCache(CACHE_SIZE),
+    "urls": KeyCache(CACHE_SIZE),
+    "languages": KeyCache(CACHE_SIZE),
+}
+
+
+# Keys stored within a transaction must not be cached before it has been
+# committed: after a rollback, the cache would claim that rows exist which
+# were never written. atomic() below collects them here, separately per thread.
+pending_keys = threading.local()
+
+
+def remember_keys(name, keys):
+    """
+    Add keys that were just stored to a cache (see atomic).
+    Outside of any transaction, the keys are committed already and cached
+    right away. Within a transaction started by database.atomic(), they are
+    cached once it has been committed. Within a transaction started any
+    other way, they are not cached at all, since we cannot tell whether
+    it will be committed.
+
+    :param name:
+    :type name: str, name of the cache in key_caches
+    :param keys:
+    :type keys: iterable of primary keys
+    """
+    pending = getattr(pending_keys, "keys", None)
+    if pending is not None:
+        pending.append((name, list(keys)))
+    elif db.transaction_depth() == 0:
+        for key in keys:
+            key_caches[name].add(key)
+
+
+@contextlib.contextmanager
+def atomic():
+    """
+    Works like db.atomic(), but also keeps the key caches consistent:
+    keys stored by the loading functions are only cached once the
+    outermost transaction has been committed, and forgotten if it is
+    rolled back. Use it instead of db.atomic() when loading data.
+
+    Example usage:
+        with database.atomic():
+            database.bulk_ingest(tweets)
+            HydrationPage.create(...)
+    """
+    pending = getattr(pending_keys, "keys", None)
+    if pending is not None:
+        # Nested in another atomic(): only drop the keys of this block on errors
+        mark = len(pending)
+        try:
+            with db.atomic():
+                yield
+        except Exception:
+            del pending[mark:]
+            raise
+        return
+    if db.transaction_depth() > 0:
+        # Nested in a transaction we do not control, see remember_keys
+        with db.atomic():
+            yield
+        return
+    pending_keys.keys = []
+    try:
+        with db.atomic():
+            yield
+        for name, keys in pending_keys.keys:
+            for key in keys:
+                key_caches[name].add(key)
+    finally:
+        pending_keys.keys = None
+
+
+def set_cache_size(size):
+    """
+    Change the number of keys each cache remembers.
+    Setting the size to 0 effectively disables caching.
+    """
+    for cache in key_caches.values():
+        cache.size = size
+        cache.clear()
+
+
+def clear_caches():
+    """
+    Forget all cached keys. Necessary if you delete objects from the database.
+    """
+    for cache in key_caches.values():
+        cache.clear()
+
+
+def cache_stats():
+    """
+    Report how well the caches work.
+
+    :returns: dictionary with hits, misses and current size for every cache
+    """
+    return {name: {"hits": cache.hits, "misses": cache.misses, "size": len(cache)}
+            for name, cache in key_caches.items()}
+
+
+def deduplicate(l):
+    """
+    Helper function that removes empty entries and
+    deduplicates the list by converting it into a set and back to a list
+    """
+    valid = list(filter(None, l))
+    if len(l) != len(valid):
+        logging.warning("The input file had {0} empty lines, skipping those. Please verify that it is complete and valid.".format(
+            len(l) - len(valid)))
+    return list(set(valid))
+
+
 def deduplicate_lowercase(l):
     """
     Helper function that performs two things:
     - Converts everything in the list to lower case
     - Deduplicates the list by converting it into a set and back to a list
     """
-    valid = list(filter(None, l))
-    lowercase = [e.lower() for e in valid]
-    if len(valid) != len(lowercase):
-        logging.warning("The input file had {0} empty lines, skipping those. Please verify that it is complete and valid.".format(
-            len(lowercase) - len(valid)))
-    deduplicated = list(set(valid))
-    return deduplicated
+    return deduplicate([e.lower() if e else e for e in l])
+
+
+def lowercase_name(name):
+    """
+    Helper function for usernames, which may be missing (None).
+    """
+    return name.lower() if name else None
 
 
 def create_user_from_tweet(tweet):
@@ -209,10 +467,18 @@ def create_user_from_tweet(tweet):
     :type tweet: dictionary from a parsed tweet
     :returns: database user object
     """
+    user_id = tweet['user']['id']
+    if user_id in key_caches["users"]:
+        # The user is already stored, so we can skip the database lookup.
+        # Note that the username is the one from this tweet, which may
+        # differ from the stored one if the user was renamed.
+        return User(id=user_id, username=tweet['user']['screen_name'])
     user, created = User.get_or_create(
-        id=tweet['user']['id'],
-        defaults={'username': tweet['user']['screen_name']},
+        id=user_id,
+        defaults={'username': tweet['user']['screen_name'],
+                  'username_lower': lowercase_name(tweet['user']['screen_name'])},
     )
+    remember_keys("users", [user_id])
     return user
 
 
@@ -231,21 +497,33 @@ def create_hashtags_from_entities(entities):
     tags = deduplicate_lowercase(tags)
     db_tags = []
     for h in tags:
+        if h in key_caches["hashtags"]:
+            db_tags.append(Hashtag(tag=h))
+            continue
         tag, created = Hashtag.get_or_create(tag=h)
+        remember_keys("hashtags", [h])
         db_tags.append(tag)
     return db_tags
 
 
 def create_language_from_tweet(tweet):
     """
+    Function for creating a database entry for
+    the language of a tweet
+
+    :param tweet:
+    :type tweet: dictionary from a parsed tweet
+    :returns: database language object
     """
+    if tweet["lang"] in key_caches["languages"]:
+        return Language(language=tweet["lang"])
     language, created = Language.get_or_create(language=tweet["lang"])
+    remember_keys("languages", [tweet["lang"]])
     return language
 
 
 def create_urls_from_entities(entities):
     """
-    Attention: Casts urls into lower case!
     Function for creating database entries for
     urls using the information contained within entities
 
@@ -254,10 +532,15 @@ def create_urls_from_entities(entities):
     :returns: list of database url objects
     """
     urls = [u["expanded_url"] for u in entities["urls"]]
-    urls = deduplicate_lowercase(urls)
+    # Unlike hashtags, URLs are case sensitive, so we keep them as they are
+    urls = deduplicate(urls)
     db_urls = []
     for u in urls:
+        if u in key_caches["urls"]:
+            db_urls.append(URL(url=u))
+            continue
         url, created = URL.get_or_create(url=u)
+        remember_keys("urls", [u])
         db_urls.append(url)
     return db_urls
 
@@ -275,10 +558,14 @@ def create_users_from_entities(entities):
     users = list(set(users))
     db_users = []
     for id, name in users:
+        if id in key_caches["users"]:
+            db_users.append(User(id=id, username=name))
+            continue
         user, created = User.get_or_create(
             id=id,
-            defaults={'username': name},
+            defaults={'username': name, 'username_lower': lowercase_name(name)},
         )
+        remember_keys("users", [id])
         db_users.append(user)
     return db_users
 
@@ -333,15 +620,1060 @@ def create_tweet_from_dict(tweet, user=None):
             reply_to_user = create_user_from_tweet(reply_to_user_dict)
             t.reply_to_user = reply_to_user
             t.reply_to_tweet = tweet['in_reply_to_status_id']
+        retweet = None
         if 'retweeted_status' in tweet:
             retweet = create_tweet_from_dict(tweet['retweeted_status'])
             t.retweet = retweet
+        if created:
+            t.mention_count = len(mentions)
+            # Replies may arrive before the tweet they reply to
+            t.reply_count = Tweet.select().where(Tweet.reply_to_tweet == t.id).count()
         t.save()
+        if created:
+            if retweet:
+                Tweet.update(retweet_count=Tweet.retweet_count + 1).where(
+                    Tweet.id == retweet.id).execute()
+            if t.reply_to_tweet:
+                Tweet.update(reply_count=Tweet.reply_count + 1).where(
+                    Tweet.id == t.reply_to_tweet).execute()
+            counts = {}
+            add_to_rollup(counts, t.date, t.user.id, [h.tag for h in tags],
+                          [u.id for u in mentions],
+                          tweet['retweeted_status']['user']['id'] if retweet else None)
+            update_rollup(counts)
         return t
     except peewee.IntegrityError as exc:
         logging.error(exc)
         return False
 
+#
+# Helper functions for loading large amounts of data into the database
+#
+
+# The functions above are easy to read, but they talk to the database for every
+# single user, hashtag, URL and mention of every tweet. When importing millions
+# of tweets, this chatter dominates the runtime. The functions below instead
+# collect a batch of tweets in memory, remove duplicates and then write the
+# whole batch with a handful of statements in one transaction.
+
+# SQLite refuses statements with more than 999 parameters,
+# so multi-row inserts have to be split into several statements.
+SQLITE_MAX_VARIABLES = 999
+
+# Order of the values in the rows that bulk loading stores for each tweet
+TWEET_FIELDS = ("id", "user", "text", "date", "language",
+                "reply_to_user", "reply_to_tweet", "retweet",
+                "retweet_count", "reply_count", "mention_count")
+
+
+def insert_or_ignore(model, fields, rows):
+    """
+    Insert many rows into the table of a model using multi-row
+    INSERT OR IGNORE statements. Rows that are already present
+    (i.e. that would violate a unique constraint) are silently skipped.
+
+    :param model:
+    :type model: database model
+    :param fields:
+    :type fields: list of field names in the order of the values in each row
+    :param rows:
+    :type rows: iterable of tuples
+    :returns: number of rows passed to the database
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    columns = ", ".join('"{0}"'.format(model._meta.fields[f].db_column)
+                        for f in fields)
+    placeholder = "({0})".format(", ".join(["?"] * len(fields)))
+    rows_per_statement = SQLITE_MAX_VARIABLES // len(fields)
+    for start in range(0, len(rows), rows_per_statement):
+        chunk = rows[start:start + rows_per_statement]
+        sql = 'INSERT OR IGNORE INTO "{0}" ({1}) VALUES {2}'.format(
+            model._meta.db_table, columns, ", ".join([placeholder] * len(chunk)))
+        db.execute_sql(sql, [value for row in chunk for value in row])
+    return len(rows)
+
+
+def existing_tweet_ids(ids):
+    """
+    Find out which of the given tweet IDs are already stored in the database.
+
+    :param ids:
+    :type ids: iterable of tweet IDs as int
+    :returns: set of IDs that are present
+    """
+    ids = list(ids)
+    existing = set()
+    for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+        chunk = ids[start:start + SQLITE_MAX_VARIABLES]
+        query = Tweet.select(Tweet.id).where(Tweet.id << chunk).tuples()
+        existing.update(row[0] for row in query)
+    return existing
+
+
+def new_batch():
+    """
+    Create an empty container for collecting tweets before bulk loading them.
+    All entries are deduplicated in memory through dictionaries and sets.
+
+    :returns: dictionary of (empty) containers
+    """
+    return {
+        # user id -> username
+        "users": {},
+        "hashtags": set(),
+        "urls": set(),
+        "languages": set(),
+        # tweet id -> tuple of values in the order of TWEET_FIELDS
+        "tweets": {},
+        # (tweet id, hashtag) pairs
+        "tags": set(),
+        # (tweet id, url) pairs
+        "links": set(),
+        # (tweet id, user id) pairs
+        "mentions": set(),
+    }
+
+
+def add_to_batch(batch, tweet):
+    """
+    Add a tweet and all related information to a batch created by new_batch.
+    This performs the same steps as create_tweet_from_dict, but does not
+    touch the database. Retweeted tweets are added as well.
+
+    :param batch:
+    :type batch: dictionary from new_batch
+    :param tweet:
+    :type tweet: dictionary from a parsed tweet
+    :returns: the tweet's ID
+    """
+    retweet_id = None
+    if 'retweeted_status' in tweet:
+        retweet_id = add_to_batch(batch, tweet['retweeted_status'])
+    # The first username we see for an ID wins, just like with get_or_create
+    batch["users"].setdefault(tweet['user']['id'], tweet['user']['screen_name'])
+    entities = tweet["entities"]
+    for tag in deduplicate_lowercase([h["text"] for h in entities["hashtags"]]):
+        batch["hashtags"].add(tag)
+        batch["tags"].add((tweet['id'], tag))
+    for url in deduplicate([u["expanded_url"] for u in entities["urls"]]):
+        batch["urls"].add(url)
+        batch["links"].add((tweet['id'], url))
+    for mention in entities["user_mentions"]:
+        batch["users"].setdefault(mention["id"], mention["screen_name"])
+        batch["mentions"].add((tweet['id'], mention["id"]))
+    if tweet["lang"]:
+        batch["languages"].add(tweet["lang"])
+    reply_to_user = reply_to_tweet = None
+    if tweet["in_reply_to_user_id"]:
+        reply_to_user = tweet["in_reply_to_user_id"]
+        reply_to_tweet = tweet["in_reply_to_status_id"]
+        batch["users"].setdefault(reply_to_user, tweet["in_reply_to_screen_name"])
+    batch["tweets"].setdefault(tweet['id'], (
+        tweet['id'],
+        tweet['user']['id'],
+        tweet['text'],
+        # See create_tweet_from_dict on why we strip timezone information here
+        parser.parse(tweet['created_at']).strftime("%Y-%m-%d %H:%M:%S"),
+        tweet["lang"] or None,
+        reply_to_user,
+        reply_to_tweet,
+        retweet_id,
+        # Retweets and replies are counted once the batch is written
+        0,
+        0,
+        len(set(mention["id"] for mention in entities["user_mentions"])),
+    ))
+    return tweet['id']
+
+
+def write_batch(batch):
+    """
+    Write a batch of tweets created by new_batch/add_to_batch to the database
+    in one transaction. Tweets that are already stored are skipped along
+    with their hashtags, URLs and mentions.
+
+    :param batch:
+    :type batch: dictionary from new_batch
+    :returns: number of newly stored tweets
+    """
+    with atomic():
+        existing = existing_tweet_ids(batch["tweets"])
+        new_tweets = [row for tweet_id, row in batch["tweets"].items()
+                      if tweet_id not in existing]
+        new_ids = set(row[0] for row in new_tweets)
+        # Only send objects to the database that are not known to exist
+        users = [(k, v) for k, v in batch["users"].items()
+                 if k not in key_caches["users"]]
+        hashtags = [t for t in batch["hashtags"] if t not in key_caches["hashtags"]]
+        urls = [u for u in batch["urls"] if u not in key_caches["urls"]]
+        languages = [l for l in batch["languages"]
+                     if l not in key_caches["languages"]]
+        insert_or_ignore(User, ("id", "username", "username_lower"),
+                         ((k, v, lowercase_name(v)) for k, v in users))
+        insert_or_ignore(Hashtag, ("tag",), ((t,) for t in hashtags))
+        insert_or_ignore(URL, ("url",), ((u,) for u in urls))
+        insert_or_ignore(Language, ("language",), ((l,) for l in languages))
+        insert_or_ignore(Tweet, TWEET_FIELDS, new_tweets)
+        # Fill the intermediary tables of the many-to-many relationships
+        insert_or_ignore(Tweet.tags.get_through_model(), ("tweet", "hashtag"),
+                         (r for r in batch["tags"] if r[0] in new_ids))
+        insert_or_ignore(Tweet.urls.get_through_model(), ("tweet", "url"),
+                         (r for r in batch["links"] if r[0] in new_ids))
+        insert_or_ignore(Tweet.mentions.get_through_model(), ("tweet", "user"),
+                         (r for r in batch["mentions"] if r[0] in new_ids))
+        update_reply_counts(new_tweets, new_ids)
+        # Count the new tweets in the rollup table
+        tags = collections.defaultdict(list)
+        for tweet_id, tag in batch["tags"]:
+            if tweet_id in new_ids:
+                tags[tweet_id].append(tag)
+        mentions = collections.defaultdict(list)
+        for tweet_id, user_id in batch["mentions"]:
+            if tweet_id in new_ids:
+                mentions[tweet_id].append(user_id)
+        counts = {}
+        for row in new_tweets:
+            # Retweeted tweets are always part of the batch (see add_to_batch)
+            retweeted = batch["tweets"][row[7]][1] if row[7] else None
+            add_to_rollup(counts, row[3], row[1], tags[row[0]], mentions[row[0]], retweeted)
+        update_rollup(counts)
+        # The keys are cached once the transaction has been committed
+        remember_keys("users", [u[0] for u in users])
+        remember_keys("hashtags", hashtags)
+        remember_keys("urls", urls)
+        remember_keys("languages", languages)
+    return len(new_tweets)
+
+
+def update_reply_counts(new_tweets, new_ids):
+    """
+    Update retweet_count and reply_count of the tweets that newly
+    stored tweets retweet or reply to. Used by write_batch.
+
+    :param new_tweets:
+    :type new_tweets: list of tuples in the order of TWEET_FIELDS
+    :param new_ids:
+    :type new_ids: set of the IDs of the new tweets
+    """
+    tweet = Tweet._meta.db_table
+    retweets = collections.Counter(row[7] for row in new_tweets if row[7])
+    # Replies to new tweets are counted below, together with older replies
+    replies = collections.Counter(row[6] for row in new_tweets
+                                  if row[6] and row[6] not in new_ids)
+    cursor = db.get_cursor()
+    cursor.executemany('UPDATE "{0}" SET "retweet_count" = "retweet_count" + ? WHERE "id" = ?'.format(tweet),
+                       [(count, tweet_id) for tweet_id, count in retweets.items()])
+    cursor.executemany('UPDATE "{0}" SET "reply_count" = "reply_count" + ? WHERE "id" = ?'.format(tweet),
+                       [(count, tweet_id) for tweet_id, count in replies.items()])
+    # Replies may arrive before the tweet they reply to
+    cursor.executemany(
+        'UPDATE "{0}" SET "reply_count" = (SELECT COUNT(*) FROM "{0}" AS r '
+        'WHERE r."reply_to_tweet" = "{0}"."id") WHERE "id" = ?'.format(tweet),
+        [(tweet_id,) for tweet_id in new_ids])
+
+
+def backfill_counts():
+    """
+    Recompute retweet_count, reply_count and mention_count of all tweets.
+    This happens automatically when the columns are added to an existing
+    database. Run it yourself after deleting tweets.
+    """
+    tweet = Tweet._meta.db_table
+    with db.atomic():
+        db.execute_sql(
+            'UPDATE "{0}" SET '
+            '"retweet_count" = (SELECT COUNT(*) FROM "{0}" AS r WHERE r."retweet_id" = "{0}"."id"), '
+            '"reply_count" = (SELECT COUNT(*) FROM "{0}" AS r WHERE r."reply_to_tweet" = "{0}"."id"), '
+            '"mention_count" = (SELECT COUNT(*) FROM "{1}" AS x WHERE x."tweet_id" = "{0}"."id")'.format(
+                tweet, Tweet.mentions.get_through_model()._meta.db_table))
+
+
+def bulk_ingest(tweets, batch_size=1000):
+    """
+    Store a large number of tweets in the database, batch_size tweets at a time.
+    Much faster than calling create_tweet_from_dict for every tweet since users,
+    hashtags, URLs and languages are deduplicated in memory and written with
+    a few multi-row statements per batch. Tweets that are already present are skipped.
+
+    Example usage:
+        tweets = (json.loads(line) for line in open("tweets.json"))
+        database.bulk_ingest(tweets)
+
+    :param tweets:
+    :type tweets: iterable of dictionaries from parsed tweets
+    :param batch_size:
+    :type batch_size: int
+    :returns: number of newly stored tweets
+    """
+    stored = 0
+    batch = new_batch()
+    pending = 0
+    for tweet in tweets:
+        add_to_batch(batch, tweet)
+        pending += 1
+        if pending >= batch_size:
+            stored += write_batch(batch)
+            batch = new_batch()
+            pending = 0
+    if pending:
+        stored += write_batch(batch)
+    return stored
+
+
+def add_counts(model, key_fields, count_fields, counts):
+    """
+    Add numbers to the counter columns of a model, creating rows where necessary.
+    The key fields need to be covered by a unique index.
+
+    Example usage:
+        add_counts(StreamMinute, ("stream", "minute"), ("delivered", "limited", "deleted"),
+                   {("election", "2015-10-27 07:13:00"): (120, 4, 7)})
+
+    :param model:
+    :type model: database model
+    :param key_fields:
+    :type key_fields: list of field names identifying a row
+    :param count_fields:
+    :type count_fields: list of names of integer fields to add to
+    :param counts:
+    :type counts: dictionary of key tuple -> tuple of numbers to add
+    """
+    if not counts:
+        return
+    columns = [model._meta.fields[f].db_column for f in count_fields]
+    keys = [model._meta.fields[f].db_column for f in key_fields]
+    sql = 'UPDATE "{0}" SET {1} WHERE {2}'.format(
+        model._meta.db_table,
+        ", ".join('"{0}" = "{0}" + ?'.format(c) for c in columns),
+        " AND ".join('"{0}" = ?'.format(k) for k in keys))
+    zeros = (0,) * len(count_fields)
+    with db.atomic():
+        # First make sure all rows exist, then add to them
+        insert_or_ignore(model, tuple(key_fields) + tuple(count_fields),
+                         (tuple(key) + zeros for key in counts))
+        cursor = db.get_cursor()
+        cursor.executemany(sql, [tuple(values) + tuple(key) for key, values in counts.items()])
+
+
+#
+# Helper functions for pre-computed counts over time
+#
+
+# Counting tweets per hour or day with one query per interval gets slow for
+# large databases. Instead, the rollup table (see Rollup) is updated whenever
+# tweets are stored, so time series can be read with a single query.
+# Remove entries from this list to maintain fewer intervals (and use less space).
+ROLLUP_INTERVALS = ["minute", "hour", "day"]
+
+# Increase this whenever a new kind of count is added to the rollup table.
+# Tables filled by an earlier version lack the new counts, so they are only
+# used once setup() has rebuilt them. The version is stored in a row of its own.
+ROLLUP_VERSION = 2
+
+# Length of every interval and the part of a date string up to which it is kept
+INTERVALS = OrderedDict([
+    ("day", (datetime.timedelta(days=1), 10)),
+    ("hour", (datetime.timedelta(hours=1), 13)),
+    ("minute", (datetime.timedelta(minutes=1), 16)),
+])
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def truncate_date(date, interval):
+    """
+    Find the beginning of the interval a date falls into.
+
+    :param date:
+    :type date: str in the format used in the database ("2015-10-27 07:13:42")
+    :param interval:
+    :type interval: "minute", "hour" or "day"
+    :returns: str, for example "2015-10-27 07:00:00" for interval "hour"
+    """
+    date = str(date)
+    keep = INTERVALS[interval][1]
+    return date[:keep] + "0000-00-00 00:00:00"[keep:]
+
+
+def add_to_rollup(counts, date, user_id, tags=(), mentions=(), retweeted=None):
+    """
+    Count one tweet in a dictionary of rollup counts, to be stored with update_rollup.
+
+    :param counts:
+    :type counts: dictionary (interval, bucket, kind, key) -> count
+    :param date:
+    :type date: str, the tweet's date in the format used in the database
+    :param user_id:
+    :type user_id: int, the author's ID
+    :param tags:
+    :type tags: list of hashtags used in the tweet, without duplicates
+    :param mentions:
+    :type mentions: list of mentioned user IDs, without duplicates
+    :param retweeted:
+    :type retweeted: int, ID of the retweeted user if the tweet is a retweet
+    """
+    keys = [("tweets", ""), ("user", str(user_id))]
+    if retweeted is not None:
+        keys.append(("retweeted", str(retweeted)))
+    keys.extend(("hashtag", tag) for tag in set(tag.lower() for tag in tags))
+    keys.extend(("mention", str(user)) for user in mentions)
+    for interval in ROLLUP_INTERVALS:
+        bucket = truncate_date(date, interval)
+        for kind, key in keys:
+            entry = (interval, bucket, kind, key)
+            counts[entry] = counts.get(entry, 0) + 1
+
+
+def update_rollup(counts):
+    """
+    Add counts collected with add_to_rollup to the rollup table.
+    """
+    add_counts(Rollup, ("interval", "bucket", "kind", "key"), ("count",),
+               {entry: (count,) for entry, count in counts.items()})
+
+
+def rebuild_rollup():
+    """
+    Recompute the rollup table from all stored tweets.
+    setup() does this when the table is first created for a database
+    that already contains tweets. Run it yourself after deleting tweets.
+    """
+    tweet = Tweet._meta.db_table
+    tags = Tweet.tags.get_through_model()
+    mentions = Tweet.mentions.get_through_model()
+    # For every kind: key expression, tables and join condition
+    sources = [
+        ("tweets", "''", '"{0}" AS t'.format(tweet), "1"),
+        ("user", 'CAST(t."user_id" AS TEXT)', '"{0}" AS t'.format(tweet), "1"),
+        ("hashtag", 'x."hashtag_id"',
+         '"{0}" AS t, "{1}" AS x'.format(tweet, tags._meta.db_table), 'x."tweet_id" = t."id"'),
+        ("mention", 'CAST(x."user_id" AS TEXT)',
+         '"{0}" AS t, "{1}" AS x'.format(tweet, mentions._meta.db_table), 'x."tweet_id" = t."id"'),
+        ("retweeted", 'CAST(o."user_id" AS TEXT)',
+         '"{0}" AS t, "{0}" AS o'.format(tweet), 'o."id" = t."retweet_id"'),
+    ]
+    with db.atomic():
+        db.execute_sql('DELETE FROM "{0}"'.format(Rollup._meta.db_table))
+        for interval in ROLLUP_INTERVALS:
+            bucket = "SUBSTR(t.\"date\", 1, {0}) || '{1}'".format(
+                INTERVALS[interval][1], "0000-00-00 00:00:00"[INTERVALS[interval][1]:])
+            for kind, key, tables, condition in sources:
+                db.execute_sql(
+                    'INSERT INTO "{0}" ("interval", "bucket", "kind", "key", "count") '
+                    "SELECT '{1}', {2}, '{3}', {4}, COUNT(*) FROM {5} WHERE {6} GROUP BY 2, 4".format(
+                        Rollup._meta.db_table, interval, bucket, kind, key, tables, condition))
+        Rollup.create(interval="version", bucket=datetime.datetime(1970, 1, 1),
+                      kind="version", key="", count=ROLLUP_VERSION)
+
+
+def rollup_version():
+    """
+    Find the version of the rollup table, i.e. the ROLLUP_VERSION of the
+    module that filled it.
+
+    :returns: int, or None if the table was never filled by rebuild_rollup
+    """
+    row = (Rollup.select(Rollup.count)
+           .where(Rollup.kind == "version", Rollup.interval == "version", Rollup.key == "")
+           .tuples().first())
+    return row[0] if row else None
+
+
+def check_rollup():
+    """
+    Make sure the rollup table contains all kinds of counts.
+
+    :raises ValueError: if the table is outdated and needs to be rebuilt by setup()
+    """
+    if rollup_version() != ROLLUP_VERSION:
+        logging.warning("The rollup table is out of date, counting tweets instead. "
+                        "Run database.setup() once to rebuild it.")
+        raise ValueError("Rollup table has version {0}, expected {1}".format(
+            rollup_version(), ROLLUP_VERSION))
+
+
+def user_keys(usernames, ignore_case=True):
+    """
+    Find the rollup keys (user IDs) for usernames. As usernames are not
+    unique over time, a name can belong to several IDs.
+
+    :param usernames:
+    :type usernames: list of str
+    :param ignore_case:
+    :type ignore_case: bool
+    :returns: ordered dictionary username -> list of keys
+    """
+    keys = OrderedDict((name, []) for name in usernames)
+    # The index on lower case usernames finds candidates quickly, even
+    # if we are looking for the exact username
+    wanted = {name.lower(): name for name in usernames}
+    query = User.select(User.id, User.username, User.username_lower).where(
+        User.username_lower << list(wanted))
+    for user_id, username, username_lower in query.tuples():
+        if ignore_case:
+            keys[wanted[username_lower]].append(str(user_id))
+        elif username in keys:
+            keys[username].append(str(user_id))
+    return keys
+
+
+def intervals_between(interval="day", start_date=None, stop_date=None):
+    """
+    Split a time range into intervals, just like objects_by_interval:
+    the last interval ends at or before stop_date.
+
+    :param interval:
+    :type interval: "minute", "hour", "day" or a timedelta
+    :param start_date:
+    :type start_date: datetime object, defaults to the beginning of the example data
+    :param stop_date:
+    :type stop_date: datetime object, defaults to the end of the example data
+    :returns: list of (start, stop) tuples of UTC datetime objects
+    """
+    length = INTERVALS[interval][0] if interval in INTERVALS else interval
+    start_date = to_utc(start_date or MST.localize(datetime.datetime(2015, 10, 27, 0)))
+    stop_date = to_utc(stop_date or MST.localize(datetime.datetime(2015, 11, 2, 23, 59)))
+    intervals = []
+    interval_start = start_date
+    while interval_start + length <= stop_date:
+        intervals.append((interval_start, interval_start + length))
+        interval_start += length
+    return intervals
+
+
+def stored_interval(start, length):
+    """
+    Find the coarsest interval in the rollup table that intervals of the
+    given start and length can be assembled from.
+
+    :param start:
+    :type start: UTC datetime object
+    :param length:
+    :type length: timedelta
+    :returns: "minute", "hour" or "day"
+    """
+    epoch = utc.localize(datetime.datetime(1970, 1, 1))
+    for name, (size, keep) in INTERVALS.items():
+        if name in ROLLUP_INTERVALS and length % size == datetime.timedelta(0) \
+                and (start - epoch) % size == datetime.timedelta(0):
+            return name
+    raise ValueError("Intervals starting at {0} are not covered by the rollup intervals {1}".format(
+        start, ROLLUP_INTERVALS))
+
+
+def rollup_top_users(kind, start_date, stop_date, n=50):
+    """
+    Find the users with the highest counts in the rollup table
+    between two dates, along with their usernames, in one query.
+
+    :param kind:
+    :type kind: "user", "mention" or "retweeted" (see Rollup)
+    :param start_date:
+    :type start_date: datetime object
+    :param stop_date:
+    :type stop_date: datetime object
+    :param n:
+    :type n: int, number of users
+    :returns: list of tuples (user ID, username, count)
+    :raises ValueError: if the rollup table cannot answer the question
+    """
+    check_rollup()
+    start, stop = to_utc(start_date), to_utc(stop_date)
+    sql = ('SELECT CAST(r."key" AS INTEGER), u."username", SUM(r."count") AS total '
+           'FROM "{0}" AS r LEFT JOIN "{1}" AS u ON u."id" = CAST(r."key" AS INTEGER) '
+           'WHERE r."kind" = ? AND r."interval" = ? AND r."bucket" >= ? AND r."bucket" < ? '
+           'GROUP BY r."key" ORDER BY total DESC LIMIT ?').format(
+        Rollup._meta.db_table, User._meta.db_table)
+    return list(db.execute_sql(sql, (kind, stored_interval(start, stop - start),
+                                     start.strftime(DATE_FORMAT), stop.strftime(DATE_FORMAT), n)))
+
+
+def rollup_counts(kind, keys, interval="day", start_date=None, stop_date=None):
+    """
+    Read counts per interval from the rollup table with a single query.
+    The coarsest stored interval that fits the requested intervals is used,
+    for example hourly counts for days in a timezone that is not UTC.
+
+    Example usage:
+        intervals, counts = database.rollup_counts("hashtag", ["trump", "cruz"], "hour")
+        for i, (start, stop) in enumerate(intervals):
+            print(start, counts["trump"][i], counts["cruz"][i])
+
+    :param kind:
+    :type kind: "tweets", "user", "mention" or "hashtag" (see Rollup)
+    :param keys:
+    :type keys: list of keys, or dictionary name -> list of keys whose counts are added up
+    (see user_keys). Hashtags are matched ignoring case.
+    :param interval:
+    :type interval: "minute", "hour", "day" or a timedelta
+    :param start_date:
+    :type start_date: datetime object
+    :param stop_date:
+    :type stop_date: datetime object
+    :returns: tuple (list of intervals as in intervals_between, ordered dictionary name -> list of counts)
+    :raises ValueError: if the rollup table cannot answer the question
+    """
+    check_rollup()
+    if not isinstance(keys, dict):
+        keys = OrderedDict((key, [key]) for key in keys)
+    if kind == "hashtag":
+        keys = OrderedDict((name, [k.lower() for k in group]) for name, group in keys.items())
+    intervals = intervals_between(interval, start_date, stop_date)
+    counts = OrderedDict((name, [0] * len(intervals)) for name in keys)
+    if not intervals:
+        return intervals, counts
+    start, stop = intervals[0][0], intervals[-1][1]
+    length = intervals[0][1] - start
+    stored = stored_interval(start, length)
+    names = collections.defaultdict(list)
+    for name, group in keys.items():
+        for key in group:
+            names[key].append(name)
+    query = (Rollup.select(Rollup.key, Rollup.bucket, Rollup.count)
+             .where(Rollup.kind == kind, Rollup.interval == stored,
+                    Rollup.key << list(names),
+                    Rollup.bucket >= start.strftime(DATE_FORMAT),
+                    Rollup.bucket < stop.strftime(DATE_FORMAT)))
+    for key, bucket, count in query.tuples():
+        if not isinstance(bucket, datetime.datetime):
+            bucket = datetime.datetime.strptime(bucket, DATE_FORMAT)
+        position = (utc.localize(bucket) - start) // length
+        for name in names[key]:
+            counts[name][position] += count
+    return intervals, counts
+
+
+#
+# Helper functions for time series
+#
+
+# Kinds of things time_series can count
+METRICS = ("tweets", "user", "mention", "hashtag", "keyword")
+
+
+def epoch_seconds(dt):
+    """
+    Convert a timezone-aware datetime object into seconds since 1970-01-01 UTC.
+    """
+    return int((to_utc(dt) - utc.localize(datetime.datetime(1970, 1, 1))).total_seconds())
+
+
+def time_series(metric, terms=None, interval="day", start_date=None, stop_date=None, tz=None,
+                use_rollup=True, output="dict"):
+    """
+    Count tweets for several terms over time, all intervals and terms at once.
+    If possible, the counts are read from the rollup table (see rollup_counts).
+    Otherwise, the database computes them in a single query that groups tweets
+    by the number of the interval they fall into. Intervals without tweets are
+    filled with zeros, so every term has exactly one count per interval.
+
+    Example usage:
+        intervals, counts = database.time_series("keyword", ["cruz", "trump"], "hour")
+        database.write_time_series("keyword_counts.csv", intervals, counts, "hour")
+
+    :param metric:
+    :type metric: "tweets" (all tweets, no terms), "user" (tweets by usernames),
+    "mention" (tweets mentioning usernames), "hashtag" or "keyword" (tweets
+    containing the text). Usernames, hashtags and keywords are matched ignoring case.
+    :param terms:
+    :type terms: list of str, or dictionary name -> list of keys as in rollup_counts
+    :param interval:
+    :type interval: "minute", "hour", "day" or a timedelta
+    :param start_date:
+    :type start_date: datetime object
+    :param stop_date:
+    :type stop_date: datetime object
+    :param tz:
+    :type tz: timezone (from pytz) for naive start and stop dates. Without it, they are taken as UTC.
+    :param use_rollup:
+    :type use_rollup: bool, set to False to always count the tweets themselves
+    :param output:
+    :type output: "dict" for an ordered dictionary name -> list of counts,
+    "numpy" for an array with one row per interval and one column per term,
+    "pandas" for a DataFrame indexed by interval start
+    :returns: tuple (list of (start, stop) intervals in UTC, counts)
+    """
+    if metric not in METRICS:
+        raise ValueError("Unknown metric {0}, use one of {1}".format(metric, METRICS))
+    if tz is not None:
+        if start_date is not None and start_date.tzinfo is None:
+            start_date = tz.localize(start_date)
+        if stop_date is not None and stop_date.tzinfo is None:
+            stop_date = tz.localize(stop_date)
+    if metric == "tweets":
+        terms = {"total": [""]}
+    elif metric in ("user", "mention") and not isinstance(terms, dict):
+        # Tweets are linked to user IDs, so we look up the IDs of the usernames
+        terms = user_keys(terms)
+    elif not isinstance(terms, dict):
+        terms = OrderedDict((term, [term]) for term in terms)
+    intervals = counts = None
+    if use_rollup and metric != "keyword":
+        try:
+            intervals, counts = rollup_counts(metric, terms, interval, start_date, stop_date)
+        except ValueError as exc:
+            logging.info("Counting tweets instead of using the rollup table: {0}".format(exc))
+    if counts is None:
+        intervals, counts = grouped_counts(metric, terms, interval, start_date, stop_date)
+    return intervals, convert_counts(intervals, counts, output)
+
+
+def convert_counts(intervals, counts, output="dict"):
+    """
+    Convert counts per interval into another format. numpy and pandas
+    are only imported when needed, so they don't need to be installed otherwise.
+
+    :param counts:
+    :type counts: ordered dictionary name -> list of counts
+    :param output:
+    :type output: "dict" (no conversion), "numpy" for an array with one row per
+    interval and one column per name, "pandas" for a DataFrame indexed by interval start
+    """
+    if output == "numpy":
+        import numpy
+        return numpy.array([counts[name] for name in counts], dtype=numpy.int64).T
+    if output == "pandas":
+        import pandas
+        return pandas.DataFrame(counts, index=pandas.DatetimeIndex(
+            [interval_start for interval_start, interval_stop in intervals]))
+    return counts
+
+
+def bucket_sql(intervals):
+    """
+    SQL expression for the number of the interval a tweet (table alias t) falls into.
+
+    :param intervals:
+    :type intervals: list of (start, stop) tuples as returned by intervals_between
+    :returns: str
+    """
+    start = intervals[0][0]
+    length = int((intervals[0][1] - start).total_seconds())
+    return '(CAST(strftime(\'%s\', t."date") AS INTEGER) - {0}) / {1}'.format(
+        epoch_seconds(start), length)
+
+
+def grouped_counts(metric, terms, interval="day", start_date=None, stop_date=None):
+    """
+    Count tweets per interval and term with a single GROUP BY query.
+    Used by time_series, which also explains the parameters.
+
+    :param terms:
+    :type terms: dictionary name -> list of keys (user IDs, hashtags or keywords)
+    :returns: tuple (list of intervals, ordered dictionary name -> list of counts)
+    """
+    intervals = intervals_between(interval, start_date, stop_date)
+    counts = OrderedDict((name, [0] * len(intervals)) for name in terms)
+    if not intervals:
+        return intervals, counts
+    start, stop = intervals[0][0], intervals[-1][1]
+    tweet = Tweet._meta.db_table
+    bucket = bucket_sql(intervals)
+    parameters = [start.strftime(DATE_FORMAT), stop.strftime(DATE_FORMAT)]
+    names = collections.defaultdict(list)
+    for name, group in terms.items():
+        for key in group:
+            names[key.lower() if metric in ("hashtag", "keyword") else key].append(name)
+    keys = list(names)
+    placeholders = ", ".join(["?"] * len(keys))
+    if metric == "tweets":
+        sql = ("SELECT {0}, '', COUNT(*) FROM \"{1}\" AS t "
+               'WHERE t."date" >= ? AND t."date" < ? GROUP BY 1').format(bucket, tweet)
+    elif metric == "user":
+        sql = ('SELECT {0}, CAST(t."user_id" AS TEXT), COUNT(*) FROM "{1}" AS t '
+               'WHERE t."date" >= ? AND t."date" < ? AND t."user_id" IN ({2}) GROUP BY 1, 2').format(
+            bucket, tweet, placeholders)
+        parameters.extend(int(key) for key in keys)
+    elif metric == "mention":
+        sql = ('SELECT {0}, CAST(x."user_id" AS TEXT), COUNT(*) FROM "{1}" AS t '
+               'JOIN "{2}" AS x ON x."tweet_id" = t."id" '
+               'WHERE t."date" >= ? AND t."date" < ? AND x."user_id" IN ({3}) GROUP BY 1, 2').format(
+            bucket, tweet, Tweet.mentions.get_through_model()._meta.db_table, placeholders)
+        parameters.extend(int(key) for key in keys)
+    elif metric == "hashtag":
+        sql = ('SELECT {0}, x."hashtag_id", COUNT(*) FROM "{1}" AS t '
+               'JOIN "{2}" AS x ON x."tweet_id" = t."id" '
+               'WHERE t."date" >= ? AND t."date" < ? AND x."hashtag_id" IN ({3}) GROUP BY 1, 2').format(
+            bucket, tweet, Tweet.tags.get_through_model()._meta.db_table, placeholders)
+        parameters.extend(keys)
+    elif FTS_AVAILABLE:
+        # The full text index finds the tweets for every keyword, and
+        # the results for all keywords are combined into one query
+        sql = " UNION ALL ".join(
+            ('SELECT {0}, ?, COUNT(*) FROM "{1}" AS t '
+             'JOIN (SELECT rowid FROM "{2}" WHERE "{2}" MATCH ?) AS f ON f.rowid = t."id" '
+             'WHERE t."date" >= ? AND t."date" < ? GROUP BY 1').format(bucket, tweet, FTS_TABLE)
+            for key in keys)
+        parameters = [value for key in keys
+                      for value in [key, fts_phrase(key)] + parameters]
+    else:
+        # One pass over the tweets counts all keywords at once, one column each.
+        # keyword_match finds the same words as the full text index would.
+        register_keyword_match()
+        columns = ", ".join(['SUM(keyword_match(t."text", ?))'] * len(keys))
+        sql = ('SELECT {0}, {1} FROM "{2}" AS t '
+               'WHERE t."date" >= ? AND t."date" < ? GROUP BY 1').format(bucket, columns, tweet)
+        parameters = keys + parameters
+    if not keys:
+        return intervals, counts
+    for row in db.execute_sql(sql, parameters):
+        position = row[0]
+        if metric == "keyword" and not FTS_AVAILABLE:
+            found = zip(keys, row[1:])
+        else:
+            found = [(row[1], row[2])]
+        for key, count in found:
+            for name in names[key]:
+                counts[name][position] += count or 0
+    return intervals, counts
+
+
+def feature_conditions():
+    """
+    SQL conditions for the features a tweet (table alias t) can have.
+    Links are checked with EXISTS, so the database stops looking
+    at the first URL, mention or hashtag it finds.
+
+    :returns: dictionary feature name -> SQL condition
+    """
+    exists = 'EXISTS (SELECT 1 FROM "{0}" AS x WHERE x."tweet_id" = t."id")'
+    return {
+        "has_url": exists.format(Tweet.urls.get_through_model()._meta.db_table),
+        "has_mention": exists.format(Tweet.mentions.get_through_model()._meta.db_table),
+        "has_hashtag": exists.format(Tweet.tags.get_through_model()._meta.db_table),
+        "is_reply": 't."{0}" IS NOT NULL'.format(Tweet.reply_to_tweet.db_column),
+        "is_retweet": 't."{0}" IS NOT NULL'.format(Tweet.retweet.db_column),
+    }
+
+
+FEATURES = ("has_url", "has_mention", "has_hashtag", "is_reply", "is_retweet")
+
+
+def feature_counts(include=(), exclude=(), interval="day", start_date=None, stop_date=None,
+                   name="tweets", output="dict"):
+    """
+    Count tweets with (and without) certain features per interval in a single query.
+
+    Example usage - tweets without mentions, URLs or replies ("featureless" tweets):
+        intervals, counts = database.feature_counts(
+            exclude=["has_mention", "has_url", "is_reply"], name="featureless")
+
+    :param include:
+    :type include: list of features that tweets need to have, see FEATURES
+    :param exclude:
+    :type exclude: list of features that tweets must not have
+    :param interval:
+    :type interval: "minute", "hour", "day" or a timedelta
+    :param start_date:
+    :type start_date: datetime object
+    :param stop_date:
+    :type stop_date: datetime object
+    :param name:
+    :type name: str, name of the counts in the result
+    :param output:
+    :type output: "dict", "numpy" or "pandas" (see time_series)
+    :returns: tuple (list of intervals, counts)
+    """
+    conditions = feature_conditions()
+    for feature in list(include) + list(exclude):
+        if feature not in conditions:
+            raise ValueError("Unknown feature {0}, use one of {1}".format(feature, FEATURES))
+    intervals = intervals_between(interval, start_date, stop_date)
+    counts = OrderedDict([(name, [0] * len(intervals))])
+    if intervals:
+        where = ['t."date" >= ?', 't."date" < ?']
+        where.extend(conditions[feature] for feature in include)
+        where.extend("NOT " + conditions[feature] for feature in exclude)
+        sql = 'SELECT {0}, COUNT(*) FROM "{1}" AS t WHERE {2} GROUP BY 1'.format(
+            bucket_sql(intervals), Tweet._meta.db_table, " AND ".join(where))
+        parameters = [intervals[0][0].strftime(DATE_FORMAT), intervals[-1][1].strftime(DATE_FORMAT)]
+        for position, count in db.execute_sql(sql, parameters):
+            counts[name][position] = count
+    return intervals, convert_counts(intervals, counts, output)
+
+
+def keyword_counts(keywords, interval="day", start_date=None, stop_date=None, tz=None, output="dict"):
+    """
+    Count tweets containing keywords per interval, ignoring case.
+    Keywords match whole words, so "cruz" finds "#Cruz" and "Cruz's", but not
+    "@tedcruz". Add a "*" to match the beginning of words ("candida*").
+    Uses the full text index (see search_text) if available. Without it,
+    the same words are found by looking at every tweet (see keyword_match).
+    See time_series for the parameters.
+
+    :returns: tuple (list of intervals, counts)
+    """
+    return time_series("keyword", keywords, interval, start_date, stop_date, tz, output=output)
+
+
+def write_time_series(filename, intervals, counts, label="day", tz=MST):
+    """
+    Write counts per interval to a CSV file as expected by the R scripts
+    (such as time_series_single_series.R): one line per interval and one column per name.
+
+    :param filename:
+    :type filename: str
+    :param intervals:
+    :type intervals: list of (start, stop) tuples as returned by time_series
+    :param counts:
+    :type counts: ordered dictionary name -> list of counts, one per interval
+    :param label:
+    :type label: str, heading of the first column
+    :param tz:
+    :type tz: timezone (from pytz) for the timestamps. Defaults to Mountain
+    Standard Time which is the local timezone for the example data
+    """
+    with open(filename, "w") as f:
+        # Write header line
+        f.write("{0},".format(label))
+        f.write(",".join(counts))
+        f.write(",\n")
+        for i, (interval_start, interval_stop) in enumerate(intervals):
+            timestamp = tz.normalize(interval_start).strftime("%Y-%m-%d %H:%M:%S %z")
+            f.write("{0},".format(timestamp))
+            for name in counts:
+                f.write("{0},".format(counts[name][i]))
+            f.write("\n")
+
+
+def store_hydrated_page(requested_ids, tweets):
+    """
+    Store one page of hydrated tweets along with a checkpoint entry.
+    IDs that were requested but not returned are recorded as MissingTweet,
+    so that they are not requested again when hydration is restarted.
+    Everything happens in one transaction: If the program is interrupted,
+    the page is either stored completely or not at all.
+
+    :param requested_ids:
+    :type requested_ids: list of tweet IDs as int
+    :param tweets:
+    :type tweets: list of dictionaries from parsed tweets
+    :returns: HydrationPage database object
+    """
+    returned_ids = set(t['id'] for t in tweets)
+    missing_ids = [i for i in requested_ids if i not in returned_ids]
+    # Keys of the page's tweets are only cached if the whole page is committed
+    with atomic():
+        bulk_ingest(tweets)
+        page = HydrationPage.create(
+            first_id=min(requested_ids),
+            last_id=max(requested_ids),
+            requested=len(requested_ids),
+            returned=len(returned_ids),
+        )
+        insert_or_ignore(MissingTweet, ("id", "page"),
+                         ((i, page.id) for i in missing_ids))
+    return page
+
+
+def iter_ids(model, chunk_size=10000):
+    """
+    Stream the primary keys of a model in ascending order.
+    Uses a raw database cursor and fetches chunk_size rows at a time,
+    so that no model objects are created and memory use stays constant.
+
+    Example usage:
+        for tweet_id in database.iter_ids(database.Tweet):
+            print(tweet_id)
+
+    :param model:
+    :type model: database model
+    :param chunk_size:
+    :type chunk_size: int
+    :returns: generator yielding primary keys
+    """
+    cursor = db.execute_sql('SELECT "{0}" FROM "{1}" ORDER BY "{0}"'.format(
+        model._meta.primary_key.db_column, model._meta.db_table))
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row[0]
+
+
+def iter_rows(query, params=None, chunk_size=10000):
+    """
+    Stream the results of a query as named tuples instead of model objects.
+    Like iter_ids, this uses a raw database cursor and fetches chunk_size
+    rows at a time. Creating a model object (and possibly loading related
+    objects) for every row is by far the slowest part of iterating a large
+    query, so this is the way to go for millions of rows.
+    The fields of the tuples are named after the selected columns, so
+    select exactly the columns you need and give computed ones an alias.
+
+    Example usage:
+        query = Tweet.select(Tweet.id, Tweet.date).where(Tweet.retweet_count > 100)
+        for row in database.iter_rows(query):
+            print(row.id, row.date)
+
+    :param query:
+    :type query: peewee select query or str with SQL
+    :param params:
+    :type params: list of parameters for SQL given as str
+    :param chunk_size:
+    :type chunk_size: int
+    :returns: generator yielding named tuples
+    """
+    if isinstance(query, str):
+        sql, params = query, params or ()
+    else:
+        sql, params = query.sql()
+    cursor = db.execute_sql(sql, params)
+    # rename replaces column names that are not valid python names
+    Row = collections.namedtuple("Row", [column[0] for column in cursor.description], rename=True)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            yield Row._make(row)
+
+
+def ids_not_in_database(ids, include_missing=False, chunk_size=10000):
+    """
+    Find the tweet IDs that are not stored yet by letting the database compare them.
+    The IDs are loaded into a temporary table and then matched against the tweets
+    (and optionally against the IDs known to be missing) in a single query.
+    This so-called anti-join needs hardly any memory on the python side.
+
+    :param ids:
+    :type ids: iterable of tweet IDs as int
+    :param include_missing:
+    :type include_missing: bool, also return IDs recorded as MissingTweet
+    :returns: sorted array of tweet IDs
+    """
+    db.execute_sql('CREATE TEMP TABLE IF NOT EXISTS "wanted_ids" ("id" INTEGER PRIMARY KEY)')
+    db.execute_sql('DELETE FROM temp."wanted_ids"')
+    with db.atomic():
+        chunk = []
+        for tweet_id in ids:
+            chunk.append(tweet_id)
+            if len(chunk) >= SQLITE_MAX_VARIABLES:
+                db.execute_sql('INSERT OR IGNORE INTO temp."wanted_ids" VALUES {0}'.format(
+                    ", ".join(["(?)"] * len(chunk))), chunk)
+                chunk = []
+        if chunk:
+            db.execute_sql('INSERT OR IGNORE INTO temp."wanted_ids" VALUES {0}'.format(
+                ", ".join(["(?)"] * len(chunk))), chunk)
+    sql = ('SELECT w."id" FROM temp."wanted_ids" AS w WHERE NOT EXISTS '
+           '(SELECT 1 FROM "{0}" AS t WHERE t."id" = w."id")').format(Tweet._meta.db_table)
+    if not include_missing:
+        sql += (' AND NOT EXISTS (SELECT 1 FROM "{0}" AS m WHERE m."id" = w."id")'
+                .format(MissingTweet._meta.db_table))
+    cursor = db.execute_sql(sql + ' ORDER BY w."id"')
+    # Store the result compactly with 8 bytes per ID
+    result = array('q')
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        result.extend(row[0] for row in rows)
+    db.execute_sql('DROP TABLE temp."wanted_ids"')
+    return result
+
 #
 # Helper functions to get summary statistics over the given database
 #
@@ -420,36 +1752,84 @@ def hashtag_counts(start_date, stop_date):
     return hashtags
 
 
-def retweet_counts(start_date, stop_date, n=50):
+def mention_count_rows(start_date, stop_date, chunk_size=10000):
+    """
+    Like mention_counts, but streams named tuples (id, username, count)
+    instead of user objects (see iter_rows).
     """
-    Find most retweeted users.
-    Instead of performing a rather complex SQL query, we do this in more
-    readable python code. It may take a few minutes to complete.
+    mentions = Tweet.mentions.get_through_model()
+    count = peewee.fn.Count(mentions.id)
+    query = (User.select(User.id, User.username, count.alias("count"))
+             .join(mentions, on=(mentions.user == User.id))
+             .join(Tweet, on=(mentions.tweet == Tweet.id))
+             .where(Tweet.date >= to_utc(start_date), Tweet.date < to_utc(stop_date))
+             .group_by(User.id)
+             .order_by(count.desc()))
+    return iter_rows(query, chunk_size=chunk_size)
+
 
-    It's possible to pass in a premade query that will be used as the
-    baseline for retweet counts (for example in order to limit
-    date ranges).
+def url_count_rows(start_date, stop_date, chunk_size=10000):
     """
-    from collections import Counter
-    rt = Tweet.alias()
-    rtu = User.alias()
-    baseline = (Tweet.select().
-                where(Tweet.date >= to_utc(start_date),
-                      Tweet.date < to_utc(stop_date))
-                )
-    query = (baseline.select(Tweet.id, rt.id, rtu.id)
-             .join(rt, on=(Tweet.retweet == rt.id))
-             .join(rtu, on=(rt.user == rtu.id))
-             )
-    c = Counter(
-        (tweet.retweet.user.id for tweet in query)
-    )
+    Like url_counts, but streams named tuples (url, count)
+    instead of URL objects (see iter_rows).
+    """
+    urlmentions = Tweet.urls.get_through_model()
+    count = peewee.fn.Count(urlmentions.id)
+    query = (urlmentions.select(urlmentions.url.alias("url"), count.alias("count"))
+             .join(Tweet, on=(urlmentions.tweet == Tweet.id))
+             .where(Tweet.date >= to_utc(start_date), Tweet.date < to_utc(stop_date))
+             .group_by(urlmentions.url)
+             .order_by(count.desc()))
+    return iter_rows(query, chunk_size=chunk_size)
+
+
+def hashtag_count_rows(start_date, stop_date, chunk_size=10000):
+    """
+    Like hashtag_counts, but streams named tuples (hashtag, count)
+    instead of hashtag objects (see iter_rows).
+    """
+    hashtagmentions = Tweet.tags.get_through_model()
+    count = peewee.fn.Count(hashtagmentions.id)
+    query = (hashtagmentions.select(hashtagmentions.hashtag.alias("hashtag"), count.alias("count"))
+             .join(Tweet, on=(hashtagmentions.tweet == Tweet.id))
+             .where(Tweet.date >= to_utc(start_date), Tweet.date < to_utc(stop_date))
+             .group_by(hashtagmentions.hashtag)
+             .order_by(count.desc()))
+    return iter_rows(query, chunk_size=chunk_size)
+
+
+def retweet_counts(start_date, stop_date, n=50, use_rollup=True):
+    """
+    Find most retweeted users, i.e. the authors of the tweets that were
+    retweeted most often between start_date and stop_date.
+    If the dates fit the intervals of the rollup table, the pre-computed
+    counts are added up. Otherwise the database counts the retweets,
+    also in a single query.
+
+    :param use_rollup:
+    :type use_rollup: bool, set to False to always count the retweets themselves
+    :returns: ordered dictionary username -> number of retweets, most retweeted first
+    """
+    rows = None
+    if use_rollup:
+        try:
+            rows = rollup_top_users("retweeted", start_date, stop_date, n)
+        except ValueError as exc:
+            logging.info("Counting retweets instead of using the rollup table: {0}".format(exc))
+    if rows is None:
+        tweet = Tweet._meta.db_table
+        sql = ('SELECT o."user_id", u."username", COUNT(*) AS total FROM "{0}" AS t '
+               'JOIN "{0}" AS o ON o."id" = t."retweet_id" '
+               'LEFT JOIN "{1}" AS u ON u."id" = o."user_id" '
+               'WHERE t."date" >= ? AND t."date" < ? '
+               'GROUP BY o."user_id" ORDER BY total DESC LIMIT ?').format(tweet, User._meta.db_table)
+        rows = db.execute_sql(sql, (to_utc(start_date).strftime(DATE_FORMAT),
+                                    to_utc(stop_date).strftime(DATE_FORMAT), n))
     # We use an ordered dict for the results so that the top results
     # appear first
-    from collections import OrderedDict
     results = OrderedDict()
-    for k, v in c.most_common(n):
-        results[User.get(id=k).username] = v
+    for user_id, username, count in rows:
+        results[username] = count
     return results
 
 
@@ -457,6 +1837,146 @@ def retweet_counts(start_date, stop_date, n=50):
 # Helper functions for querying data
 #
 
+
+def fts_phrase(text):
+    """
+    Turn text into a phrase for the full text index, so that characters
+    like "-" or ":" are not interpreted as search operators.
+    A "*" at the end is kept to search for words beginning with the text.
+    """
+    prefix = text.endswith("*")
+    return '"{0}"{1}'.format(text.rstrip("*").replace('"', '""'), "*" if prefix else "")
+
+
+# Words as the full text index sees them: letters, numbers and underscores
+KEYWORD_WORD = re.compile(r"\w+")
+
+
+def keyword_words(text):
+    """
+    Split text into words the same way as the full text index: in lower case
+    and without accents, so "#Débat" becomes the word "debat".
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return KEYWORD_WORD.findall("".join(c for c in text if not unicodedata.combining(c)))
+
+
+def keyword_match(text, keyword):
+    """
+    Check whether text contains a keyword, matching whole words just like
+    the full text index does (see fts_phrase). Databases without the index
+    use this function instead, so keyword searches find the same tweets
+    either way - they just take longer.
+
+    :param text:
+    :type text: str, text of a tweet
+    :param keyword:
+    :type keyword: str, one or several words, optionally with a "*" at the end
+    :returns: 1 if the words of the keyword appear next to each other in text, otherwise 0
+    """
+    if text is None:
+        return 0
+    prefix = keyword.endswith("*")
+    wanted = keyword_words(keyword.rstrip("*"))
+    if not wanted:
+        return 0
+    words = keyword_words(text)
+    last = len(wanted) - 1
+    for i in range(len(words) - last):
+        if words[i:i + last] != wanted[:last]:
+            continue
+        if words[i + last] == wanted[last] or (prefix and words[i + last].startswith(wanted[last])):
+            return 1
+    return 0
+
+
+def register_keyword_match():
+    """
+    Make keyword_match available in SQL queries of the current thread's
+    database connection, as keyword_match("text", keyword).
+    """
+    db.get_conn().create_function("keyword_match", 2, keyword_match)
+
+
+def search_text(text, start_date=None, stop_date=None, raw=False):
+    """
+    Find tweets containing text, ignoring case. Text matches whole words
+    (see keyword_counts). Uses the full text index if available.
+    Otherwise, tweets are searched one by one for the words.
+
+    Example usage:
+        for tweet in database.search_text("debate"):
+            print(tweet.text)
+
+    :param text:
+    :type text: str, one or several words that need to appear next to each other
+    :param start_date:
+    :type start_date: datetime object (optional)
+    :param stop_date:
+    :type stop_date: datetime object (optional)
+    :param raw:
+    :type raw: bool, pass text to the full text index as a query of its own
+    (such as "trump AND NOT cruz", see https://www.sqlite.org/fts5.html#full_text_query_syntax).
+    Without the index, text is searched for as words instead.
+    :returns: query for tweets, ordered by ID
+    """
+    if FTS_AVAILABLE:
+        # peewee gives the tweet table an alias of its own, so the
+        # condition is built from the field instead of the table name
+        query = Tweet.select().where(Tweet.id << peewee.SQL(
+            '(SELECT rowid FROM "{0}" WHERE "{0}" MATCH ?)'.format(FTS_TABLE),
+            text if raw else fts_phrase(text)))
+    else:
+        if raw:
+            logging.warning("Queries need the full text index, searching for {0} as words instead".format(text))
+        register_keyword_match()
+        query = Tweet.select().where(peewee.fn.keyword_match(Tweet.text, text) == 1)
+    if start_date:
+        query = query.where(Tweet.date >= to_utc(start_date).strftime(DATE_FORMAT))
+    if stop_date:
+        query = query.where(Tweet.date < to_utc(stop_date).strftime(DATE_FORMAT))
+    return query.order_by(Tweet.id)
+
+
+def most_retweeted(n=50):
+    """
+    Find the most retweeted tweets, using the index on retweet_count.
+
+    Example usage:
+        for tweet in database.most_retweeted(10):
+            print(tweet.retweet_count, tweet.text)
+
+    :returns: query for tweets, most retweeted first
+    """
+    return (Tweet.select()
+            .where(Tweet.retweet_count > 0)
+            .order_by(Tweet.retweet_count.desc())
+            .limit(n))
+
+
+def find_users(*usernames):
+    """
+    Find users by their usernames, ignoring case. Remember that
+    several users can share a username over time.
+
+    Example usage:
+        for user in database.find_users("realDonaldTrump", "tedcruz"):
+            print(user.id, user.username)
+
+    :returns: query for users
+    """
+    return User.select().where(User.username_lower << [name.lower() for name in usernames])
+
+
+def find_hashtags(*tags):
+    """
+    Find hashtags, ignoring case.
+
+    :returns: query for hashtags
+    """
+    return Hashtag.select().where(Hashtag.tag << [tag.lower() for tag in tags])
+
+
 def tweetcount_per_user():
     """
     This function executes a query that:
@@ -480,6 +2000,22 @@ def tweetcount_per_user():
     return query
 
 
+def tweetcount_per_user_rows(chunk_size=10000):
+    """
+    Like tweetcount_per_user, but streams named tuples (id, username, count)
+    instead of user objects (see iter_rows):
+    for user in database.tweetcount_per_user_rows():
+        print("{0}: {1}".format(user.username, user.count))
+    """
+    tweet_ct = peewee.fn.Count(Tweet.id)
+    query = (User
+             .select(User.id, User.username, tweet_ct.alias("count"))
+             .join(Tweet, on=(Tweet.user == User.id))
+             .group_by(User.id)
+             .order_by(tweet_ct.desc(), User.username))
+    return iter_rows(query, chunk_size=chunk_size)
+
+
 def first_tweet():
     """
     Find the first Tweet by date
@@ -512,6 +2048,7 @@ def to_utc(dt):
 def objects_by_interval(Obj, date_attr_name="date", interval="day", start_date=None, stop_date=None):
     """
     General helper function that returns objects by date intervals, mainly useful for counting.
+    To count many intervals, time_series is much faster, as it needs only one query.
     WARNING: If used as-is with SQLite, all date/times in data and queries are UTC-based!
     If you want to use local time for queries, take note that it will be converted correctly
     ONLY if you supply the correct timezone information. In general, as long as you only
@@ -571,8 +2108,179 @@ def objects_by_interval(Obj, date_attr_name="date", interval="day", start_date=N
 
 # Set up database tables. This needs to run at least once before using the db.
 try:
+    # safe=True only creates tables that are missing, so newly added
+    # tables also appear in existing databases
     db.create_tables([Hashtag, URL, User, Language, Tweet, Tweet.tags.get_through_model(
-    ), Tweet.urls.get_through_model(), Tweet.mentions.get_through_model(), ])
+    ), Tweet.urls.get_through_model(), Tweet.mentions.get_through_model(),
+        HydrationPage, MissingTweet, StreamMinute, DeletedTweet, Rollup, ], safe=True)
 except Exception as exc:
     logging.debug(
         "Database setup failed, probably already present: {0}".format(exc))
+
+
+def migrate_schema():
+    """
+    Bring databases created with earlier versions of this module up to date.
+    Tweets gain counts of their retweets, replies and mentions. Usernames gain
+    a lower case copy with an index, and hashtags, which were previously
+    stored as written, are converted to lower case.
+    Called by setup().
+    """
+    from playhouse.migrate import SqliteMigrator, migrate
+    columns = [column.name for column in db.get_columns(Tweet._meta.db_table)]
+    if "retweet_count" not in columns:
+        logging.warning("Adding retweet, reply and mention counts to tweets, this may take a while")
+        with db.atomic():
+            # SQLite can add columns with a default value without copying the table
+            for column in ("retweet_count", "reply_count", "mention_count"):
+                db.execute_sql('ALTER TABLE "{0}" ADD COLUMN "{1}" INTEGER NOT NULL DEFAULT 0'.format(
+                    Tweet._meta.db_table, column))
+            migrate(SqliteMigrator(db).add_index(Tweet._meta.db_table, ("retweet_count",), False))
+            backfill_counts()
+    columns = [column.name for column in db.get_columns(User._meta.db_table)]
+    if "username_lower" in columns:
+        return
+    logging.warning("Updating the database structure, this may take a while")
+    migrator = SqliteMigrator(db)
+    with db.atomic():
+        migrate(
+            migrator.add_column(User._meta.db_table, "username_lower", peewee.CharField(null=True)),
+            migrator.add_index(User._meta.db_table, ("username_lower",), False),
+        )
+        # Usernames only consist of latin letters, digits and underscores,
+        # so the database can convert them itself
+        db.execute_sql('UPDATE "{0}" SET "username_lower" = LOWER("username")'.format(
+            User._meta.db_table))
+        # Hashtags can contain any letter, so we convert them in python.
+        # Tags that only differ in case are merged into one.
+        through = Tweet.tags.get_through_model()._meta.db_table
+        renamed = [(tag.lower(), tag) for (tag,) in Hashtag.select(Hashtag.tag).tuples()
+                   if tag != tag.lower()]
+        insert_or_ignore(Hashtag, ("tag",), set((new,) for new, old in renamed))
+        cursor = db.get_cursor()
+        # Tweets that already link to the lower case tag keep their link,
+        # the remaining links to the old tags are deleted afterwards
+        cursor.executemany('UPDATE OR IGNORE "{0}" SET "hashtag_id" = ? WHERE "hashtag_id" = ?'.format(
+            through), renamed)
+        cursor.executemany('DELETE FROM "{0}" WHERE "hashtag_id" = ?'.format(through),
+                           [(old,) for new, old in renamed])
+        cursor.executemany('DELETE FROM "{0}" WHERE "tag" = ?'.format(Hashtag._meta.db_table),
+                           [(old,) for new, old in renamed])
+
+
+# Full text index for tweets. Tokens consist of letters, numbers and underscores,
+# so "#Debate" and "debate" both become the word "debate", and usernames
+# like "@real_donald" stay in one piece.
+FTS_TABLE = "tweet_fts"
+
+
+def fulltext_index_exists():
+    """
+    Check whether setup_fulltext_search has created the full text index.
+    Only looks at the list of tables, so it is cheap enough to run on import.
+    """
+    return db.execute_sql("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone() is not None
+
+
+FTS_AVAILABLE = fulltext_index_exists()
+
+
+def setup_fulltext_search():
+    """
+    Create the full text index for tweet texts (using SQLite's FTS5 extension),
+    along with triggers that keep it up to date whenever tweets are stored or deleted.
+    If the index is new, it is filled with all tweets stored so far.
+    Sets FTS_AVAILABLE to False if the extension is missing. Called by setup().
+    """
+    global FTS_AVAILABLE
+    tweet = Tweet._meta.db_table
+    exists = fulltext_index_exists()
+    try:
+        with db.atomic():
+            db.execute_sql(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS "{0}" USING fts5('
+                '"text", content="{1}", content_rowid="id", tokenize="unicode61 tokenchars \'_\'")'.format(
+                    FTS_TABLE, tweet))
+            db.execute_sql(
+                'CREATE TRIGGER IF NOT EXISTS "{0}_insert" AFTER INSERT ON "{1}" BEGIN '
+                'INSERT INTO "{0}" (rowid, "text") VALUES (new."id", new."text"); END'.format(FTS_TABLE, tweet))
+            db.execute_sql(
+                'CREATE TRIGGER IF NOT EXISTS "{0}_delete" AFTER DELETE ON "{1}" BEGIN '
+                'INSERT INTO "{0}" ("{0}", rowid, "text") VALUES (\'delete\', old."id", old."text"); END'.format(
+                    FTS_TABLE, tweet))
+            # Saving a tweet rewrites all its columns, but the index only
+            # needs to change if the text did
+            db.execute_sql(
+                'CREATE TRIGGER IF NOT EXISTS "{0}_update" AFTER UPDATE OF "text" ON "{1}" '
+                'WHEN old."text" IS NOT new."text" BEGIN '
+                'INSERT INTO "{0}" ("{0}", rowid, "text") VALUES (\'delete\', old."id", old."text"); '
+                'INSERT INTO "{0}" (rowid, "text") VALUES (new."id", new."text"); END'.format(FTS_TABLE, tweet))
+            if not exists:
+                db.execute_sql('INSERT INTO "{0}" ("{0}") VALUES (\'rebuild\')'.format(FTS_TABLE))
+    except peewee.OperationalError as exc:
+        logging.warning("Full text search is not available, keyword searches will be slow: {0}".format(exc))
+        FTS_AVAILABLE = False
+        return
+    FTS_AVAILABLE = True
+
+
+def setup():
+    """
+    Bring an existing database up to date with this module. Run this once
+    after updating the module, before loading or analysing data
+    (see examples.setup_database): databases created with earlier versions
+    lack some columns, so storing tweets fails until they are added.
+    It only does work if something is missing, so running it again is cheap.
+    It is deliberately not run when the module is imported: several
+    processes importing the module at once (see ingest.py) would
+    otherwise all try to change the same database file.
+    """
+    migrate_schema()
+    setup_fulltext_search()
+    # Rollup tables that are empty or were filled by earlier versions of
+    # this module (see ROLLUP_VERSION) need to be filled once
+    if rollup_version() != ROLLUP_VERSION:
+        logging.warning("Filling the rollup table with counts of existing tweets, this may take a while")
+        rebuild_rollup()
+
+
+def test():
+    """
+    Check keyword searches on a few example tweets, both with the full text
+    index (if available) and without it. The tweets are stored in a transaction
+    that is rolled back at the end, so the database is left unchanged.
+    """
+    global FTS_AVAILABLE
+    setup()
+    examples = {
+        -1: "Ted Cruz's answer in the #Debate",
+        -2: "@tedcruz at the debate tonight",
+        -3: "Candidates on stage",
+    }
+    expected = {"cruz": [-1], "debate": [-2, -1], "candida*": [-3], "the debate": [-2, -1]}
+    date = utc.localize(datetime.datetime(2000, 1, 1))
+    modes = [True, False] if FTS_AVAILABLE else [False]
+    index_available = FTS_AVAILABLE
+    with db.atomic() as transaction:
+        user = User.create(id=-1, username="example", username_lower="example")
+        for tweet_id, text in examples.items():
+            Tweet.create(id=tweet_id, user=user, text=text, date=date.strftime(DATE_FORMAT))
+        try:
+            for FTS_AVAILABLE in modes:
+                for keyword, ids in expected.items():
+                    found = [tweet.id for tweet in search_text(keyword, date)]
+                    assert found == ids, "search_text({0!r}) found {1}, expected {2} (full text index: {3})".format(
+                        keyword, found, ids, FTS_AVAILABLE)
+                    intervals, counts = keyword_counts([keyword], "day", date, date + datetime.timedelta(days=1))
+                    assert counts[keyword] == [len(ids)], \
+                        "keyword_counts({0!r}) found {1}, expected {2} (full text index: {3})".format(
+                            keyword, counts[keyword], len(ids), FTS_AVAILABLE)
+                logging.info("Keyword searches work (full text index: {0})".format(FTS_AVAILABLE))
+        finally:
+            FTS_AVAILABLE = index_available
+            transaction.rollback()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    test()
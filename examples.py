@@ -15,7 +15,15 @@ Requirements:
 
 import rest
 import streaming
+import async_streaming
+import twitter_auth
+import capture
+import columnar
 import database
+import stream_coverage
+import idlists
+import ingest
+import jsoncodec
 import logging
 import json
 import datetime
@@ -30,31 +38,44 @@ MST = timezone("MST")
 #
 
 
-def hydrate(idlist_file="data/example_dataset_tweet_ids.txt"):
+def setup_database():
+    """
+    Bring the database up to date after updating this package.
+    Run this once before loading or analysing data, see database.setup.
+    """
+    database.setup()
+    logging.warning("Database is up to date")
+
+
+def hydrate(idlist_file="data/example_dataset_tweet_ids.txt", retry_missing=False, method="array", pool=None):
     """
     This function reads a file with tweet IDs and then loads them
     through the API into the database. Prepare to wait quite a bit,
     depending on the size of the dataset.
+
+    Progress is saved after every page of 100 tweets. If the function is
+    interrupted, just call it again and it continues where it stopped.
+    IDs that twitter did not return (deleted or protected tweets) are
+    remembered and skipped unless retry_missing is True.
+
+    For very large ID lists, the method used to compare the file with
+    the database matters: "set" is simple but needs lots of memory,
+    "array" and "sql" are much more frugal (see idlists.py).
+
+    If you have several sets of credentials, pass a rest.CredentialPool
+    as pool to fetch pages with all of them in parallel.
     """
-    ids_to_fetch = set()
-    for line in open(idlist_file, "r"):
-        # Remove newline character through .strip()
-        # Convert to int since that's what the database uses
-        ids_to_fetch.add(int(line.strip()))
-    # Find a list of Tweets that we already have
-    ids_in_db = set(t.id for t in database.Tweet.select(database.Tweet.id))
-    # Sets have an efficient .difference() method that returns IDs only present
-    # in the first set, but not in the second.
-    ids_to_fetch = ids_to_fetch.difference(ids_in_db)
+    ids_to_fetch = idlists.ids_to_hydrate(
+        idlist_file, method=method, retry_missing=retry_missing)
     logging.warning(
         "\nLoaded a list of {0} tweet IDs to hydrate".format(len(ids_to_fetch)))
 
     # Set up a progressbar
     bar = Bar('Fetching tweets', max=len(ids_to_fetch), suffix='%(eta)ds')
-    for page in rest.fetch_tweet_list(ids_to_fetch):
-        bar.next(len(page))
-        for tweet in page:
-            database.create_tweet_from_dict(tweet)
+    for requested, page in rest.fetch_tweet_pages(ids_to_fetch, pool=pool):
+        bar.next(len(requested))
+        # Store the whole page at once along with a checkpoint
+        database.store_hydrated_page(requested, page)
     bar.finish()
     logging.warning("Done hydrating!")
 
@@ -63,10 +84,12 @@ def dehydrate(filename="data/dehydrated_tweet_ids.txt"):
     """
     This function writes the Tweet IDs contained in the current database to
     a file that allows re-hydration with the above method.
+    IDs are streamed from the database in chunks, so this works for
+    databases of any size.
     """
     with open(filename, "w") as f:
-        for tweet in database.Tweet.select(database.Tweet.id):
-            f.write("{0}\n".format(tweet.id))
+        for tweet_id in database.iter_ids(database.Tweet):
+            f.write("{0}\n".format(tweet_id))
 
 
 #
@@ -95,14 +118,27 @@ def print_notice(notice):
 #
 
 
-def import_json(fi):
+def import_json(fi, workers=None):
     """
     Load json data from a file into the database.
+    The file may be compressed with gzip, bzip2 or xz.
+    If workers is given, tweets are parsed by that many processes in parallel
+    (see ingest.py), which is a lot faster for large files.
+
+    :returns: number of new tweets stored
     """
     logging.warning("Loading tweets from json file {0}".format(fi))
-    for line in open(fi, "rb"):
-        data = json.loads(line.decode('utf-8'))
-        database.create_tweet_from_dict(data)
+    if workers:
+        # import_file brings the database up to date itself
+        return ingest.import_file(fi, workers=workers)["stored"]
+    database.setup()
+    with ingest.open_tweet_file(fi) as f:
+        tweets = (jsoncodec.loads(line) for line in f)
+        # bulk_ingest consumes the generator in batches, so we never hold
+        # the whole file in memory
+        stored = database.bulk_ingest(tweets)
+    logging.warning("Stored {0} new tweets".format(stored))
+    return stored
 
 
 def print_user_archive():
@@ -163,24 +199,75 @@ def track_keywords():
 
 def save_track_keywords():
     """
-    Track two keywords with a tracking stream and save machting tweets.
+    Track two keywords with a tracking stream and save matching tweets.
+    Lines are written exactly as received into compressed files in the
+    directory keywords_example, starting a new file every hour (see capture.py).
+    Unlike a file of decoded tweets, the files also contain twitter's notices
+    (such as deletes and limits); ingest.import_file skips them when importing.
     To stop the stream, press ctrl-c or kill the python process.
     """
-    # Set up file to write to
-    outfile = open("keywords_example.json", "w")
-
-    def save_tweet(tweet):
-        json.dump(tweet, outfile)
-        # Insert a newline after one tweet
-        outfile.write("\n")
+    # Set up the files to write to
+    writer = capture.SegmentWriter("keywords_example", prefix="keywords")
     keywords = ["politics", "election"]
     try:
         stream = streaming.stream(
-            on_tweet=save_tweet, on_notification=print_notice, track=keywords)
+            on_raw=writer, on_notification=print_notice, track=keywords)
     except (KeyboardInterrupt, SystemExit):
         logging.error("User stopped program, exiting!")
-        outfile.flush()
-        outfile.close()
+        writer.close()
+
+
+def save_track_keywords_to_database():
+    """
+    Track two keywords with a tracking stream and store matching tweets in the database.
+    Writing to the database can occasionally be slow, so we let a separate thread
+    do it. Lines that arrive while the database is busy wait in a buffer, and
+    if that fills up, in a temporary file on disk.
+    To stop the stream, press ctrl-c or kill the python process.
+    """
+    buffer = streaming.LineBuffer(size=10000, overflow="spill")
+    keywords = ["politics", "election"]
+    try:
+        streaming.stream(
+            on_tweet=database.create_tweet_from_dict, on_notification=print_notice,
+            track=keywords, buffer=buffer)
+    except (KeyboardInterrupt, SystemExit):
+        logging.error("User stopped program, exiting! Buffer: {0}".format(buffer.stats()))
+
+
+def save_track_keywords_with_coverage():
+    """
+    Track two keywords like save_track_keywords, but also keep count of how many
+    tweets twitter left out (limit notices) and which tweets were deleted.
+    The numbers are written to the database every minute; to print them, use:
+    for row in stream_coverage.coverage_report("keywords"): print(row)
+    To stop the stream, press ctrl-c or kill the python process.
+    """
+    writer = capture.SegmentWriter("keywords_example", prefix="keywords")
+    accountant = stream_coverage.CoverageAccountant("keywords")
+    keywords = ["politics", "election"]
+    try:
+        streaming.stream(
+            on_raw=streaming.chain(writer, accountant.on_raw),
+            on_limit=accountant.on_limit, on_delete=accountant.on_delete,
+            track=keywords)
+    except (KeyboardInterrupt, SystemExit):
+        logging.error("User stopped program, exiting! Delivered {0:.1%} of matching tweets".format(
+            accountant.coverage()))
+        writer.close()
+        accountant.flush()
+
+
+def track_keywords_in_parallel():
+    """
+    Track two sets of keywords at the same time in one program, each with
+    its own keys. Requires keys.yaml to contain (at least) two sets of keys.
+    To stop the streams, press ctrl-c or kill the python process.
+    """
+    keys = twitter_auth.load_keys()
+    async_streaming.run(
+        async_streaming.stream(keys=keys[0], on_tweet=print_tweet, track=["politics"]),
+        async_streaming.stream(keys=keys[1], on_tweet=print_tweet, track=["election"]))
 
 
 def follow_users():
@@ -202,184 +289,72 @@ def follow_users():
 def save_follow_users():
     """
     Follow several users, saving their tweets (and retweets) as they arrive.
+    Lines are written exactly as received into compressed files in the
+    directory user_example (see capture.py), notices included.
     To stop the stream, press ctrl-c or kill the python process.
     """
-    outfile = open("user_example.json", "w")
-
-    def save_tweet(tweet):
-        json.dump(tweet, outfile)
-        # Insert a newline after one tweet
-        outfile.write("\n")
+    writer = capture.SegmentWriter("user_example", prefix="users")
     users = ["807095", "2467791"]
-    stream = streaming.stream(
-        on_tweet=save_tweet, on_notification=print_notice, follow=users)
+    try:
+        stream = streaming.stream(
+            on_raw=writer, on_notification=print_notice, follow=users)
+    except (KeyboardInterrupt, SystemExit):
+        logging.error("User stopped program, exiting!")
+        writer.close()
 
 
 def export_hashtag_counts(interval="day", hashtags=["Bush", "Carson", "Christie", "Cruz", "Fiorina", "Huckabee", "Kasich", "Paul", "Rubio", "Trump"]):
     """
-    Create daily counts for given Hashtags. A bit slow. An easy speedup is to convert the list of hashtags to Hashtag database objects and query for them.
-    """
-    # Create output file
-    with open("hashtag_counts.csv", "w") as f:
-        # Write header line
-        f.write("{0},".format(interval))
-        f.write(",".join(hashtags))
-        f.write(",\n")
-        # Prepare interator over intervals
-        # htm is an intermediary model for many-to-many-relationships
-        # In this case Tweet -> htm -> Hashtag
-        htm = database.Tweet.tags.get_through_model()
-        intervals = database.objects_by_interval(
-            database.Tweet, interval=interval, start_date=None, stop_date=None)
-        for (interval_start, interval_stop), query in intervals:
-            # Convert the timestamp to Mountain Standard Time which is
-            # the local timezone for the example data
-            timestamp = MST.normalize(interval_start).strftime(
-                "%Y-%m-%d %H:%M:%S %z")
-            f.write("{0},".format(timestamp))
-            for tag in hashtags:
-                # Match ignoring case
-                count = query.join(htm).join(database.Hashtag).where(
-                    peewee.fn.Lower(database.Hashtag.tag) == tag.lower()).count()
-                f.write("{0},".format(count))
-            f.write("\n")
+    Create daily counts for given Hashtags (ignoring case).
+    The counts are read from the pre-computed rollup table (see database.time_series).
+    """
+    intervals, counts = database.time_series("hashtag", hashtags, interval=interval)
+    database.write_time_series("hashtag_counts.csv", intervals, counts, interval)
 
 
 def export_mention_counts(interval="day", usernames=["jebbush", "realbencarson", "chrischristie", "tedcruz", "carlyfiorina", "govmikehuckabee", "johnkasich", "randpaul", "marcorubio", "realdonaldtrump"]):
     """
-    Create daily counts for mentions of given Users.
-    """
-    # Create output file
-    with open("mention_counts.csv", "w") as f:
-        # Write header line
-        f.write("{0},".format(interval))
-        f.write(",".join(usernames))
-        f.write(",\n")
-        # Prepare interator over intervals
-        # htm is an intermediary model for many-to-many-relationships
-        # In this case Tweet -> htm -> Hashtag
-        mtm = database.Tweet.mentions.get_through_model()
-        intervals = database.objects_by_interval(
-            database.Tweet, interval=interval, start_date=None, stop_date=None)
-        for (interval_start, interval_stop), query in intervals:
-            # Convert the timestamp to Mountain Standard Time which is
-            # the local timezone for the example data
-            timestamp = MST.normalize(interval_start).strftime(
-                "%Y-%m-%d %H:%M:%S %z")
-            f.write("{0},".format(timestamp))
-            for user in usernames:
-                # Match ignoring case
-                count = query.join(mtm).join(database.User).where(
-                    peewee.fn.Lower(database.User.username) == user.lower()).count()
-                f.write("{0},".format(count))
-            f.write("\n")
+    Create daily counts for mentions of given Users (ignoring case).
+    """
+    intervals, counts = database.time_series("mention", usernames, interval=interval)
+    database.write_time_series("mention_counts.csv", intervals, counts, interval)
 
 
 def export_keyword_counts(interval="day", keywords=["Bush", "Carson", "Christie", "Cruz", "Fiorina", "Huckabee", "Kasich", "Paul", "Rubio", "Trump"]):
     """
-    Create daily counts for given Keywords.
-    """
-    # Create output file
-    with open("keyword_counts.csv", "w") as f:
-        # Write header line
-        f.write("{0},".format(interval))
-        f.write(",".join(keywords))
-        f.write(",\n")
-        # Prepare interator over intervals
-        intervals = database.objects_by_interval(
-            database.Tweet, interval=interval, start_date=None, stop_date=None)
-        for (interval_start, interval_stop), query in intervals:
-            # Convert the timestamp to Mountain Standard Time which is
-            # the local timezone for the example data
-            timestamp = MST.normalize(interval_start).strftime(
-                "%Y-%m-%d %H:%M:%S %z")
-            f.write("{0},".format(timestamp))
-            for word in keywords:
-                # Match ignoring case
-                kwcount = query.where(
-                    peewee.fn.Lower(database.Tweet.text).contains(word.lower())).count()
-                f.write("{0},".format(kwcount))
-            f.write("\n")
+    Create daily counts for given Keywords (ignoring case).
+    The tweets containing the keywords are found through the full text index
+    (see database.keyword_counts).
+    """
+    intervals, counts = database.keyword_counts(keywords, interval=interval)
+    database.write_time_series("keyword_counts.csv", intervals, counts, interval)
 
 
 def export_user_counts(interval="day", usernames=["JebBush", "RealBenCarson", "ChrisChristie", "tedcruz", "CarlyFiorina", "GovMikeHuckabee", "JohnKasich", "RandPaul", "marcorubio", "realDonaldTrump"]):
     """
     Create daily counts for given Users.
     """
-    # Create output file
-    with open("user_counts.csv", "w") as f:
-        # Write header line
-        f.write("{0},".format(interval))
-        f.write(",".join(usernames))
-        f.write(",\n")
-        # Prepare interator over intervals
-        intervals = database.objects_by_interval(
-            database.Tweet, interval=interval, start_date=None, stop_date=None)
-        for (interval_start, interval_stop), query in intervals:
-            # Convert the timestamp to Mountain Standard Time which is
-            # the local timezone for the example data
-            timestamp = MST.normalize(interval_start).strftime(
-                "%Y-%m-%d %H:%M:%S %z")
-            f.write("{0},".format(timestamp))
-            for username in usernames:
-                # Match precise username
-                ucount = query.join(database.User).where(
-                    database.User.username == username).count()
-                f.write("{0},".format(ucount))
-            f.write("\n")
+    # Match precise username
+    keys = database.user_keys(usernames, ignore_case=False)
+    intervals, counts = database.time_series("user", keys, interval=interval)
+    database.write_time_series("user_counts.csv", intervals, counts, interval)
 
 
 def export_total_counts(interval="day"):
     """
     Create hourly counts for Tweets
     """
-    # Create output file
-    with open("total_counts.csv", "w") as f:
-        # Write header line
-        f.write("{0},".format(interval))
-        f.write("total,")
-        f.write("\n")
-        # Prepare interator over intervals
-        intervals = database.objects_by_interval(
-            database.Tweet, interval=interval, start_date=None, stop_date=None)
-        for (interval_start, interval_stop), query in intervals:
-            # Convert the timestamp to Mountain Standard Time which is
-            # the local timezone for the example data
-            timestamp = MST.normalize(interval_start).strftime(
-                "%Y-%m-%d %H:%M:%S %z")
-            f.write("{0},".format(timestamp))
-            f.write("{0},".format(query.count()))
-            f.write("\n")
+    intervals, counts = database.time_series("tweets", interval=interval)
+    database.write_time_series("total_counts.csv", intervals, counts, interval)
 
 
 def export_featureless_counts(interval="day"):
     """
-    Create hourly counts for Tweets without mentions or URLs.
-    Complex queries on many-to-many-relationships are very
-    contrived with peewee. For the sake of simplicity, this
-    function instead
-    """
-    # Create output file
-    with open("featureless_counts.csv", "w") as f:
-        # Write header line
-        f.write("{0},".format(interval))
-        f.write("featureless,")
-        f.write("\n")
-        # Prepare interator over intervals
-        intervals = database.objects_by_interval(
-            database.Tweet, interval=interval, start_date=None, stop_date=None)
-        for (interval_start, interval_stop), query in intervals:
-            # Convert the timestamp to Mountain Standard Time which is
-            # the local timezone for the example data
-            timestamp = MST.normalize(interval_start).strftime(
-                "%Y-%m-%d %H:%M:%S %z")
-            f.write("{0},".format(timestamp))
-            featureless_count = 0
-            for t in query:
-                if bool(t.mentions.is_null() and t.urls.is_null() and t.reply_to_tweet is None):
-                    featureless_count += 1
-            f.write("{0},".format(featureless_count))
-            f.write("\n")
+    Create hourly counts for Tweets without mentions or URLs that are not replies.
+    """
+    intervals, counts = database.feature_counts(
+        exclude=["has_mention", "has_url", "is_reply"], interval=interval, name="featureless")
+    database.write_time_series("featureless_counts.csv", intervals, counts, interval)
 
 
 def export_mention_totals(n=50):
@@ -439,21 +414,13 @@ def export_retweet_totals(n=50):
 def top_retweets(n=50):
     """
     Find the most retweeted tweets and display them.
-    For readability's sake, this is not done through SQL
+    Every tweet knows how often it was retweeted (retweet_count),
+    so this only needs to read the top of an index.
     """
-    rt_counts = {}
-    # all retweets
-    retweets = database.Tweet.select(database.Tweet.retweet).where(
-        database.Tweet.retweet.is_null(False)).group_by(database.Tweet.retweet)
-    for tweet in retweets:
-        rt_counts[tweet.retweet.id] = tweet.retweet.retweets.count()
-    from collections import Counter
-    c = Counter(rt_counts)
-
     from collections import OrderedDict
     results = OrderedDict()
-    for k, v in c.most_common(n):
-        results[database.Tweet.get(id=k).text] = v
+    for tweet in database.most_retweeted(n):
+        results[tweet.text] = tweet.retweet_count
     return results
 
 
@@ -489,19 +456,18 @@ def export_retweet_text(n=50):
     """
     Find the most retweeted tweets and export them to a CSV file
     """
-
-    rt_counts = {}
-    # all retweets
-    retweets = database.Tweet.select(database.Tweet.retweet).where(
-        database.Tweet.retweet.is_null(False)).group_by(database.Tweet.retweet)
-    for tweet in retweets:
-        rt_counts[tweet.retweet.id] = tweet.retweet.retweets.count()
-    from collections import Counter
-    c = Counter(rt_counts)
-
     with open("retweet_texts.csv", "w") as f:
         f.write("tweet text, count\n")
-        for k, v in c.most_common(n):
-            tweet_text = database.Tweet.get(id=k).text
+        for tweet in database.most_retweeted(n):
             f.write("{0},{1}\n".format(
-                tweet_text.replace("\n", "<newline>"), v))
+                tweet.text.replace("\n", "<newline>"), tweet.retweet_count))
+
+
+def export_parquet():
+    """
+    Export all tweets, users and their links to Parquet files in the
+    directory "corpus", split by day. See columnar.py for reading them.
+    """
+    counts = columnar.export_corpus("corpus")
+    for name, count in counts.items():
+        logging.warning("Exported {0} rows of {1}".format(count, name))
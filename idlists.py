@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 Pascal Jürgens and Andreas Jungherr
+# See License.txt
+
+"""
+Handling Very Large Lists of IDs
+--------------------------------
+Helpers for comparing lists of tweet IDs with the contents of the database
+
+Requirements:
+    - depends on database module database.py
+    - optionally uses the library numpy, if installed
+
+Why not just use sets?
+======================
+Python sets are the most readable way to compare two collections of IDs, and for the example dataset they work perfectly well. However, every integer stored in a set takes up more than 70 bytes of memory. Datasets with 100 million tweet IDs would need tens of gigabytes just to find out which tweets are still missing.
+
+This module offers two alternatives:
+
+- "array": IDs are kept in a sorted `array`_ of 64 bit integers, which needs exactly 8 bytes per ID. Two sorted lists can be compared by walking through both of them at the same time. If numpy is installed, the comparison is performed by numpy's vectorised functions instead.
+- "sql": IDs are loaded into a temporary table, and the database itself finds the ones that are not present yet (see database.ids_not_in_database). This needs the least memory of all, but requires some free disk space.
+
+.. _`array`: https://docs.python.org/3/library/array.html
+"""
+
+import heapq
+import logging
+from array import array
+
+import database
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Available methods for ids_to_hydrate
+METHODS = ("set", "array", "sql")
+
+
+def iter_id_file(filename):
+    """
+    Read a file with one ID per line.
+
+    :returns: generator yielding IDs as int
+    """
+    with open(filename, "r") as f:
+        for line in f:
+            # Remove newline character through .strip()
+            line = line.strip()
+            if line:
+                yield int(line)
+
+
+def unique_sorted(ids):
+    """
+    Remove duplicates from sorted IDs.
+
+    :param ids:
+    :type ids: sorted iterable of IDs as int
+    :returns: array of IDs
+    """
+    result = array('q')
+    last = None
+    for i in ids:
+        if i != last:
+            result.append(i)
+            last = i
+    return result
+
+
+def read_id_array(filename, chunk_size=1000000):
+    """
+    Read a file with one ID per line into a sorted array without duplicates.
+    Without numpy, the file is sorted in chunks of chunk_size IDs
+    which are then merged, so memory use stays close to 8 bytes per ID.
+
+    :param filename:
+    :type filename: str
+    :returns: sorted array of IDs
+    """
+    if numpy is not None:
+        ids = array('q', iter_id_file(filename))
+        return array('q', numpy.unique(numpy.frombuffer(ids, dtype=numpy.int64)).tobytes())
+    runs = []
+    chunk = []
+    for i in iter_id_file(filename):
+        chunk.append(i)
+        if len(chunk) >= chunk_size:
+            runs.append(array('q', sorted(chunk)))
+            chunk = []
+    if chunk:
+        runs.append(array('q', sorted(chunk)))
+    return unique_sorted(heapq.merge(*runs))
+
+
+def sorted_difference(ids, *excluded):
+    """
+    Find the IDs that do not appear in any of the excluded collections.
+    All inputs need to be sorted in ascending order. The excluded IDs
+    are only iterated once, so they can be streamed from the database.
+
+    :param ids:
+    :type ids: sorted array of IDs
+    :param excluded:
+    :type excluded: sorted iterables of IDs
+    :returns: sorted array of IDs
+    """
+    if numpy is not None:
+        result = numpy.frombuffer(ids, dtype=numpy.int64)
+        for other in excluded:
+            other = numpy.fromiter(other, dtype=numpy.int64)
+            result = numpy.setdiff1d(result, other, assume_unique=True)
+        return array('q', result.tobytes())
+    exclude = heapq.merge(*excluded)
+    current = next(exclude, None)
+    result = array('q')
+    for i in ids:
+        # Advance through the excluded IDs until we reach the current ID
+        while current is not None and current < i:
+            current = next(exclude, None)
+        if current != i:
+            result.append(i)
+    return result
+
+
+def ids_to_hydrate(filename, method="array", retry_missing=False):
+    """
+    Find the tweet IDs from a file that are not stored in the database yet.
+    IDs that twitter previously did not return (see database.MissingTweet)
+    are left out unless retry_missing is True.
+
+    :param filename:
+    :type filename: str
+    :param method:
+    :type method: "set", "array" or "sql" (see module documentation)
+    :param retry_missing:
+    :type retry_missing: bool
+    :returns: sorted list or array of tweet IDs
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown method {0}, use one of {1}".format(method, METHODS))
+    logging.warning("Comparing tweet IDs to the database using method {0}".format(method))
+    if method == "sql":
+        return database.ids_not_in_database(iter_id_file(filename), include_missing=retry_missing)
+    if method == "set":
+        ids = set(iter_id_file(filename))
+        ids.difference_update(database.iter_ids(database.Tweet))
+        if not retry_missing:
+            ids.difference_update(database.iter_ids(database.MissingTweet))
+        return sorted(ids)
+    excluded = [database.iter_ids(database.Tweet)]
+    if not retry_missing:
+        excluded.append(database.iter_ids(database.MissingTweet))
+    return sorted_difference(read_id_array(filename), *excluded)
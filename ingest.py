@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 Pascal Jürgens and Andreas Jungherr
+# See License.txt
+
+"""
+Importing Large Tweet Files
+---------------------------
+Loads files with one json-encoded tweet per line into the database,
+using several processes at once.
+
+Requirements:
+    - depends on database module database.py
+
+How the pipeline works
+======================
+Importing a file consists of three steps: Reading lines from disk, turning each line into database rows (decoding json, parsing dates, extracting hashtags etc.) and writing the rows to the database. The middle step is by far the most expensive one, but a single python process can only ever use one processor core. We therefore split the work among several processes that are connected by queues:
+
+1. The main process reads the (possibly compressed) file and hands out chunks of lines.
+2. Several parser processes turn each chunk into a batch of plain rows (see database.new_batch).
+3. A single writer process stores the batches. SQLite only allows one writer at a time, so adding more writers would not help.
+
+The queues between the steps have a maximum size. If the writer cannot keep up, the parsers have to wait until there is room in the queue, and in turn the reader waits for the parsers. This so-called *backpressure* keeps memory usage constant, no matter how large the file is.
+
+Waiting for a queue is dangerous if the process on the other end has crashed: it would wait forever. Therefore no process waits longer than a second at a time. In between, the main process checks whether all other processes are still running and stops the import if one of them failed. The other processes in turn give up once the main process tells them to (or has stopped itself).
+
+The workers only import the database module, which does not change the database file. Migrations and other setup steps (see database.setup) are run once by the main process before any worker is started.
+
+Compressed files (gzip, bzip2 and xz) are recognized by their first bytes and decompressed on the fly, so there is no need to unpack archives before importing them.
+"""
+
+import bz2
+import gzip
+import logging
+import lzma
+import multiprocessing
+import queue
+import time
+
+import database
+import jsoncodec
+
+# Files are recognized by their first bytes, the so-called magic number
+COMPRESSION_FORMATS = [
+    (b"\x1f\x8b", gzip.open),
+    (b"BZh", bz2.open),
+    (b"\xfd7zXZ\x00", lzma.open),
+]
+
+
+def open_tweet_file(filename):
+    """
+    Open a file for reading in binary mode, decompressing it on the fly
+    if it is compressed with gzip, bzip2 or xz.
+
+    :param filename:
+    :type filename: str
+    :returns: file object yielding lines as bytes
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(6)
+    for prefix, opener in COMPRESSION_FORMATS:
+        if magic.startswith(prefix):
+            return opener(filename, "rb")
+    return open(filename, "rb")
+
+
+def read_chunks(f, chunk_size):
+    """
+    Group the lines of a file into lists of chunk_size lines.
+
+    :returns: generator yielding lists of lines
+    """
+    chunk = []
+    for line in f:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_lines(lines):
+    """
+    Turn a list of json-encoded tweets into a batch of database rows.
+    Lines that cannot be parsed are logged and skipped, notices are skipped silently.
+
+    :param lines:
+    :type lines: list of bytes
+    :returns: tuple (batch, number of tweets, number of errors)
+    """
+    batch = database.new_batch()
+    tweets = 0
+    errors = 0
+    for line in lines:
+        # Skip blank lines
+        if not line.strip():
+            continue
+        try:
+            tweet = jsoncodec.loads(line)
+            # Raw captures (see capture.py) also contain notices such as deletes
+            if "text" not in tweet:
+                continue
+            database.add_to_batch(batch, tweet)
+            tweets += 1
+        except (ValueError, KeyError, TypeError) as exc:
+            logging.error("Skipping invalid line: {0}".format(exc))
+            errors += 1
+    return batch, tweets, errors
+
+
+class Stopped(Exception):
+
+    """
+    Raised in worker processes when the import has been stopped.
+    """
+
+
+def should_stop(stop):
+    """
+    Check whether a worker process should give up: either the main process
+    asked for it by setting the stop event, or the main process is gone.
+    """
+    return stop.is_set() or not multiprocessing.parent_process().is_alive()
+
+
+def get(q, stop):
+    """
+    Take an item from a queue in a worker process, giving up if the import is stopped.
+    """
+    while True:
+        try:
+            return q.get(timeout=1)
+        except queue.Empty:
+            if should_stop(stop):
+                raise Stopped()
+
+
+def put(q, item, stop):
+    """
+    Put an item into a queue in a worker process, giving up if the import is stopped.
+    """
+    while True:
+        try:
+            q.put(item, timeout=1)
+            return
+        except queue.Full:
+            if should_stop(stop):
+                raise Stopped()
+
+
+def parser_process(line_queue, batch_queue, stop):
+    """
+    Parser loop: take chunks of lines from line_queue and put batches into batch_queue.
+    A None value in line_queue tells the process to stop.
+    """
+    try:
+        while True:
+            lines = get(line_queue, stop)
+            if lines is None:
+                put(batch_queue, None, stop)
+                return
+            put(batch_queue, parse_lines(lines), stop)
+    except Stopped:
+        return
+
+
+def writer_process(batch_queue, result_queue, parsers, report_every, stop):
+    """
+    Writer loop: store batches from batch_queue until all parsers are done,
+    logging the speed every report_every seconds. Totals are put into result_queue.
+    Gives up if the import is stopped, for example because a parser crashed
+    before it could report that it is done.
+    """
+    totals = {"tweets": 0, "stored": 0, "errors": 0}
+    finished_parsers = 0
+    started = last_report = time.time()
+    while finished_parsers < parsers:
+        try:
+            item = get(batch_queue, stop)
+        except Stopped:
+            logging.error("Writer stopped before all parsers were done")
+            return
+        if item is None:
+            finished_parsers += 1
+            continue
+        batch, tweets, errors = item
+        totals["stored"] += database.write_batch(batch)
+        totals["tweets"] += tweets
+        totals["errors"] += errors
+        now = time.time()
+        if now - last_report >= report_every:
+            logging.warning("Processed {0} tweets ({1:.0f} tweets/sec)".format(
+                totals["tweets"], totals["tweets"] / (now - started)))
+            last_report = now
+    totals["seconds"] = time.time() - started
+    result_queue.put(totals)
+
+
+def check_processes(processes):
+    """
+    Make sure no worker process of an import has failed.
+    Workers that are done exit normally (with exit code 0).
+
+    :raises RuntimeError: if a process crashed
+    """
+    for process in processes:
+        if process.exitcode not in (None, 0):
+            raise RuntimeError("Process {0} stopped unexpectedly (exit code {1}), see the log for errors".format(
+                process.name, process.exitcode))
+
+
+def feed(q, item, parsers, writer):
+    """
+    Put an item into a queue in the main process. While the queue is full,
+    check every second that the workers are still running.
+    """
+    while True:
+        try:
+            q.put(item, timeout=1)
+            return
+        except queue.Full:
+            check_processes(parsers)
+            # The writer only finishes after all lines have been handed out
+            if not writer.is_alive():
+                raise RuntimeError("The writer process stopped unexpectedly, see the log for errors")
+
+
+def import_file(filename, workers=None, chunk_size=1000, queue_size=8, report_every=10):
+    """
+    Import a file with one json-encoded tweet per line into the database,
+    parsing tweets in several processes at once. Tweets that are already
+    stored are skipped.
+
+    Example usage:
+        ingest.import_file("data/archive.json.gz", workers=4)
+
+    :param filename:
+    :type filename: str, path to a plain, gzip, bzip2 or xz compressed file
+    :param workers:
+    :type workers: int, number of parser processes, defaults to the number of cores
+    :param chunk_size:
+    :type chunk_size: int, number of lines handed to a parser at once
+    :param queue_size:
+    :type queue_size: int, maximum number of chunks waiting in each queue
+    :param report_every:
+    :type report_every: seconds between progress messages
+    :returns: dictionary with counts of tweets, stored tweets, errors and the duration in seconds
+    :raises RuntimeError: if a worker process crashed
+    """
+    workers = workers or multiprocessing.cpu_count()
+    # Run migrations once, before the workers open the database
+    database.setup()
+    # "spawn" starts fresh python processes. Unlike "fork", the processes do not
+    # inherit our database connection, which SQLite does not allow sharing.
+    context = multiprocessing.get_context("spawn")
+    line_queue = context.Queue(maxsize=queue_size)
+    batch_queue = context.Queue(maxsize=queue_size)
+    result_queue = context.Queue()
+    stop = context.Event()
+    parsers = [context.Process(target=parser_process, args=(line_queue, batch_queue, stop))
+               for _ in range(workers)]
+    writer = context.Process(target=writer_process,
+                             args=(batch_queue, result_queue, workers, report_every, stop))
+    for process in parsers + [writer]:
+        process.start()
+    try:
+        with open_tweet_file(filename) as f:
+            for chunk in read_chunks(f, chunk_size):
+                # Waits while the queue is full
+                feed(line_queue, chunk, parsers, writer)
+        # Tell every parser to stop
+        for _ in parsers:
+            feed(line_queue, None, parsers, writer)
+        totals = None
+        while totals is None:
+            try:
+                totals = result_queue.get(timeout=1)
+            except queue.Empty:
+                # A writer that exited normally has put its totals into the queue already
+                check_processes(parsers + [writer])
+    except (KeyboardInterrupt, SystemExit, RuntimeError):
+        logging.error("Import stopped, exiting!")
+        stop.set()
+        for process in parsers + [writer]:
+            process.terminate()
+            process.join()
+        raise
+    for process in parsers + [writer]:
+        process.join()
+    logging.warning("Imported {0} new tweets from {1} lines in {2:.0f} seconds ({3:.0f} tweets/sec), {4} errors".format(
+        totals["stored"], totals["tweets"], totals["seconds"],
+        totals["tweets"] / max(totals["seconds"], 1e-9), totals["errors"]))
+    return totals
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 Pascal Jürgens and Andreas Jungherr
+# See License.txt
+
+"""
+Fast JSON Decoding
+------------------
+Decodes and encodes json with the fastest library available
+
+Requirements:
+    - optionally uses one of the libraries orjson, pysimdjson or ujson, if installed
+
+Why a separate module?
+======================
+Every tweet we receive from twitter arrives as json, a text format that needs to be decoded before python can work with it. The json module in python's standard library is reliable, but not particularly fast. When following the sample stream or importing large archives, decoding json easily becomes the most time-consuming part of a program.
+
+There are several faster json libraries, which need to be installed separately (for example with `pip3 install orjson`). This module uses the fastest one that is installed and falls back to the standard library otherwise. All other modules use the functions loads and dumps from here, so installing one of the libraries speeds up streaming, REST calls and imports at once. To find out which library is used, have a look at the variable backend. To choose a specific library, call use("ujson"), for example.
+
+All libraries accept bytes directly, so there is no need to .decode() lines received from twitter first.
+"""
+
+import json
+import logging
+
+
+def stdlib_backend():
+    return json.loads, json.dumps
+
+
+def orjson_backend():
+    import orjson
+
+    def dumps(obj):
+        # orjson produces bytes, but we promise strings just like json.dumps
+        return orjson.dumps(obj).decode('utf-8')
+    return orjson.loads, dumps
+
+
+def simdjson_backend():
+    import simdjson
+    # pysimdjson only speeds up decoding, encoding is left to the standard library
+    return simdjson.loads, json.dumps
+
+
+def ujson_backend():
+    import ujson
+    return ujson.loads, ujson.dumps
+
+
+BACKENDS = {
+    "orjson": orjson_backend,
+    "simdjson": simdjson_backend,
+    "ujson": ujson_backend,
+    "json": stdlib_backend,
+}
+
+# Libraries are tried in this order, fastest first
+PREFERENCE = ["orjson", "simdjson", "ujson", "json"]
+
+# Name of the library in use, set by use()
+backend = None
+loads = None
+dumps = None
+
+
+def use(name=None):
+    """
+    Select the json library to use. Without a name, the fastest
+    installed library is chosen.
+
+    :param name:
+    :type name: str, one of "orjson", "simdjson", "ujson" or "json"
+    :returns: name of the selected library
+    """
+    global backend, loads, dumps
+    if name and name not in BACKENDS:
+        raise ValueError("Unknown json library {0}, use one of {1}".format(name, PREFERENCE))
+    for candidate in [name] if name else PREFERENCE:
+        try:
+            loads, dumps = BACKENDS[candidate]()
+        except ImportError:
+            # If a specific library was requested, we fail loudly
+            if name:
+                raise
+            continue
+        backend = candidate
+        logging.debug("Using {0} for json decoding".format(backend))
+        return backend
+
+
+use()
@@ -92,6 +92,8 @@ def write_gml(nodes, edges, outfile="network.gml"):
     Requires pre-assembled data in the form of:
     nodes = [{"id": 2, "label": "node 2"},]
     edges = [{"source": 1, "target": 2},]
+    Edges can carry a weight (or any other attribute) as additional key:
+    edges = [{"source": 1, "target": 2, "weight": 5},]
 
     This function, along with the helper write_gml_element above,
     is essentially an implementation of the example writer from
@@ -111,105 +113,167 @@ def write_gml(nodes, edges, outfile="network.gml"):
 
 
 
-def write_graphml_element(graph, attributes, name, data={}):
+def write_graphml_element(f, attributes, name, data={}):
     """
-    Add an element to a graphml graph.
-    Elements should be in the format:
-    {
-    "name": "elementname",
-    "element": {"attribute": "value", ...}
-    }
+    Write one element of a graphml graph, such as a node or an edge, to an open file.
+    Attributes and data are dictionaries of key -> value, for example:
+    attributes = {"id": "n0"}
+    data = {"label": "node 1"}
+    Elements are written one at a time, so graphs do not need to fit into memory.
     """
-    e = ET.SubElement(graph, name)
+    e = ET.Element(name)
     for k, v in attributes.items():
         e.set(str(k), str(v))
     for k, v in data.items():
-        data = ET.SubElement(e, 'data')
-        data.set('key', str(k))
-        data.text = str(v)
+        d = ET.SubElement(e, 'data')
+        d.set('key', str(k))
+        d.text = str(v)
+    f.write(ET.tostring(e, encoding="unicode"))
+    f.write("\n")
 
 
-def write_graphml_file(nodes, edges, filename="network.graphml"):
+def write_graphml_file(nodes, edges, filename="network.graphml", weighted=False):
     """
     Create a GraphML file from network components:
     nodes and edges.
+    Nodes are a dictionary of user ID -> label, edges an iterable of
+    (source user ID, target user ID) tuples. If weighted is True,
+    edges are (source, target, weight) tuples instead and the weight
+    is stored as edge attribute "weight".
+    Edges are written as they come, so they can be a generator
+    that reads them from the database (see link_edges).
 
     Note that this is only a tiny writer function and does not implement
     the GraphML format in full! There is no guarantee this will work
     See http://graphml.graphdrawing.org/specification.html
     for the GraphML specification and http://graphml.graphdrawing.org/primer/graphml-primer.html
     for an introduction.
+
+    :returns: number of edges written
     """
-    # Setup the graphml header defining the format
-    root = ET.Element("graphml")
-    root.set("xmlns", "http://graphml.graphdrawing.org/xmlns")
-    root.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-    root.set(" xsi:schemaLocation", "http://graphml.graphdrawing.org/xmln;")
-    # Set graph attributes.
-    # We assume we have IDs for everything (required),
-    # labels for nodes and all edges are directed
-    label_def = ET.SubElement(root, "key")
-    label_def.set("attr.name", "label")
-    label_def.set("attr.type", "string")
-    label_def.set("for", "node")
-    label_def.set("id", "label")
-
-    user_id_def = ET.SubElement(root, "key")
-    user_id_def.set("attr.name", "user_id")
-    user_id_def.set("attr.type", "string")
-    user_id_def.set("for", "node")
-    user_id_def.set("id", "user_id")
-
-    graph = ET.SubElement(root, "graph")
-    graph.set("id", "G")
-    graph.set("edgedefault", "directed")
-    # Setup end
-    # Write nodes
-    node_id_map = {}
-    for i, node in enumerate(nodes.items()):
-        # Store the new ID given to the node so we can reference it later
-        # in the edges
-        node_id_map[node[0]] = "n{0}".format(i)
-        attributes = {'name': 'node',
-                      'id': "n{0}".format(i),
-                      }
-        data = {
-            'user_id': node[0],
-            'label': node[1],
-        }
-        write_graphml_element(
-            graph=graph, attributes=attributes, data=data, name="node")
-    for j, edge in enumerate(edges):
-        attributes = {'name': 'edge',
-                      'id': "e{0}".format(j),
-                      'source': node_id_map[edge[0]],
-                      'target': node_id_map[edge[1]],
-                      }
-        write_graphml_element(
-            graph=graph, attributes=attributes, name="edge")
-    # Write file
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding='utf-8', xml_declaration=True)
-
-
-def retweet_links():
+    with open(filename, "w", encoding="utf-8") as f:
+        # Setup the graphml header defining the format
+        f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+                'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+        # Set graph attributes.
+        # We assume we have IDs for everything (required),
+        # labels for nodes and all edges are directed
+        write_graphml_element(f, {"attr.name": "label", "attr.type": "string",
+                                  "for": "node", "id": "label"}, "key")
+        write_graphml_element(f, {"attr.name": "user_id", "attr.type": "string",
+                                  "for": "node", "id": "user_id"}, "key")
+        if weighted:
+            write_graphml_element(f, {"attr.name": "weight", "attr.type": "int",
+                                      "for": "edge", "id": "weight"}, "key")
+        f.write('<graph id="G" edgedefault="directed">\n')
+        # Setup end
+        # Write nodes
+        node_id_map = {}
+        for i, node in enumerate(nodes.items()):
+            # Store the new ID given to the node so we can reference it later
+            # in the edges
+            node_id_map[node[0]] = "n{0}".format(i)
+            attributes = {'name': 'node',
+                          'id': "n{0}".format(i),
+                          }
+            data = {
+                'user_id': node[0],
+                'label': node[1],
+            }
+            write_graphml_element(f, attributes=attributes, data=data, name="node")
+        count = 0
+        for j, edge in enumerate(edges):
+            attributes = {'name': 'edge',
+                          'id': "e{0}".format(j),
+                          'source': node_id_map[edge[0]],
+                          'target': node_id_map[edge[1]],
+                          }
+            data = {'weight': edge[2]} if weighted else {}
+            write_graphml_element(f, attributes=attributes, data=data, name="edge")
+            count += 1
+        f.write("</graph>\n</graphml>\n")
+    return count
+
+
+def link_nodes(rows):
     """
-    Find all links defined by replies (directed messages starting with an user name: @pascal ....
-    From our models, this looks like: User -> Tweet -> is reply to: User
-    This function is not maximally efficient but readable.
+    Collect the users from rows of (source_id, source_name, target_id, target_name, weight)
+    as the nodes expected by write_graphml_file. Only the users are kept in memory,
+    not the links between them.
+
+    :param rows:
+    :type rows: iterable of named tuples as returned by database.iter_rows
+    :returns: tuple (dictionary user ID -> username, number of rows)
     """
     nodes = {}
-    edges = []
-    # The following query finds all reply links, disregarding their frequency.
+    count = 0
+    for row in rows:
+        nodes[row.source_id] = row.source_name
+        nodes[row.target_id] = row.target_name
+        count += 1
+    return nodes, count
+
+
+def link_edges(rows):
+    """
+    Turn rows of (source_id, source_name, target_id, target_name, weight)
+    into the weighted edges expected by write_graphml_file, one at a time.
+
+    :param rows:
+    :type rows: iterable of named tuples as returned by database.iter_rows
+    :returns: generator yielding tuples (source, target, weight)
+    """
+    for row in rows:
+        yield row.source_id, row.target_id, row.weight
+
+
+def write_links(query, filename, name="links"):
+    """
+    Write the links found by a query with the columns source_id, source_name,
+    target_id, target_name and weight to a GraphML file.
+    GraphML lists all nodes before the edges, so the query runs twice: once
+    to collect the users, and once more to stream the edges into the file.
+    Memory use thus grows with the number of users, not with the number of links.
+
+    :param query:
+    :type query: peewee query, see retweet_links
+    :param filename:
+    :type filename: str
+    :param name:
+    :type name: str, what the links are called in log messages
+    """
+    nodes, count = link_nodes(database.iter_rows(query))
+    logging.info("Found {0} {1} between {2} users".format(count, name, len(nodes)))
+    write_graphml_file(nodes=nodes, edges=link_edges(database.iter_rows(query)),
+                       filename=filename, weighted=True)
+
+
+def retweet_links(filename="retweets.graphml"):
+    """
+    Find all links defined by retweets: User -> Tweet -> is retweet of: Tweet -> User
+    Every retweeting user -> original author pair becomes one edge,
+    weighted by the number of retweets.
+    """
+    # The following query finds all retweet links along with their frequency.
     # It works like this:
     # Define aliases for the secondary meanings of Tweet and User, namely
-    # Tweet as the origintal Tweet of a Retweet and User as the original author
+    # Tweet as the original Tweet of a Retweet and User as the original author
     rt = database.Tweet.alias()
     rtu = database.User.alias()
-    # Construct the query by starting with select. We use round brackets to
-    # allow the query to span multiple lines with comments
+    # Construct the query by starting with select. We name exactly the columns we need,
+    # so the database hands us plain values and no Tweet or User objects are created
+    # (accessing retweet.user.username on objects would cost an extra query per row).
+    # We use round brackets to allow the query to span multiple lines with comments
     retweets = (
-        database.Tweet.select().
+        database.Tweet.select(
+            database.User.id.alias("source_id"),
+            database.User.username.alias("source_name"),
+            rtu.id.alias("target_id"),
+            rtu.username.alias("target_name"),
+            peewee.fn.Count(database.Tweet.id).alias("weight")).
         # Join in the User of the Retweet by linking the ID field
         join(database.User, on=(database.Tweet.user == database.User.id)).
         # Switch the context back to Tweet, since we want to add more joins
@@ -220,46 +284,35 @@ def retweet_links():
         switch(rt).
         # Join in the User of the original Tweet using the alias
         join(rtu, on=(rt.user == rtu.id)).
-        # Switch the context back to our original Tweet
-        switch(database.Tweet).
-        # Group, ie deduplicate lines that share the same (retweeting user -> original author) pair
-        group_by(database.User, rtu)
+        # Group, ie count lines that share the same (retweeting user -> original author) pair
+        group_by(database.User.id, rtu.id)
         )
-    for retweet in retweets:
-        nodes[retweet.user.id] = retweet.user.username
-        nodes[retweet.retweet.user.id] = retweet.retweet.user.username
-        edges.append((retweet.user.id, retweet.retweet.user.id))
-    write_graphml_file(nodes=nodes, edges=edges, filename="retweets.graphml")
+    write_links(retweets, filename, "retweet links")
 
 
-def reply_links():
+def reply_links(filename="replies.graphml"):
     """
     Find all links defined by replies (directed messages starting with an user name: @pascal ....
     From our models, this looks like: User -> Tweet -> is reply to: User
-
+    Every author -> adressee pair becomes one edge, weighted by the number of replies.
     """
-    # Set up container variables for writing the network file
-    nodes = {}
-    edges = []
-    # The following query finds all reply links, disregarding their frequency.
+    # The following query finds all reply links along with their frequency.
     # First, it defines an alias for the user that was replied to in order to distinguish it from the tweet's author.
     # Then, it joins both the author and adressee User objects. Finally, it groups by both users, yielding
-    # only one entry per tweet author -> adressee pair.
+    # only one entry per tweet author -> adressee pair. As in retweet_links, we select plain columns only.
     reply_user = database.User.alias()
     replies = (
-        database.Tweet.select().
+        database.Tweet.select(
+            database.User.id.alias("source_id"),
+            database.User.username.alias("source_name"),
+            reply_user.id.alias("target_id"),
+            reply_user.username.alias("target_name"),
+            peewee.fn.Count(database.Tweet.id).alias("weight")).
         where(database.Tweet.reply_to_user.is_null(False)).
         join(database.User, on=(database.Tweet.user == database.User.id)).
         switch(database.Tweet).
         join(reply_user, on=(database.Tweet.reply_to_user == reply_user.id)).
         switch(database.Tweet).
-        group_by(database.User, reply_user)
+        group_by(database.User.id, reply_user.id)
         )
-    print(replies.count())
-    for i, reply in enumerate(replies):
-        nodes[reply.user.id] = reply.user.username
-        nodes[reply.reply_to_user.id] = reply.reply_to_user.username
-        edges.append(
-            (reply.user.id, reply.reply_to_user.id)
-            )
-    write_graphml_file(nodes=nodes, edges=edges, filename="replies.graphml")
+    write_links(replies, filename, "reply links")
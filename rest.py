@@ -28,19 +28,21 @@ Implementation Details
 
 The technical implementation in this module fits somewhere between an average twitter tutorial and a *production-grade* data collection setup. Its foremost goal is to provide a clean and legible but solid blueprint. In contrast to most tutorials, it handles rate limits and errors gracefully. That is not to say the way we fetch data is the most efficient. We purposefully omitted some optimizations which would greatly increase the codebase and decrease its legibility. Here are some hints for potential improvements:
 
-- Global rate limit: Currently, there is a global rate limit counter; we pause our access as soon as twitter tells us we have only four requests left. By doing this, we ignore the distinct (independent!) rate limits for different types of requests. For example, if you exhausted your rate limit for crawling an user's tweet archive, you can still perform requests for her friend list. If you implement a separate rate limit counter for every possible api endpoint, you can parallelize fetching multiple types of data.
-- Only one user, one thread: All modules in this repository rely on the same user credentials defined in the single keyfile. It is possible to have several copies of the code fetch different sets of data with two or more different twitter accounts.
+- Rate limits per endpoint: Twitter enforces distinct (independent!) rate limits for different types of requests. For example, if you exhausted your rate limit for searching tweets, you can still look up users. We therefore keep a separate RateLimiter for every api endpoint. Instead of firing requests as fast as possible until the limit is exhausted and then idling until the end of the 15 minute window, each limiter spreads the remaining calls evenly over the rest of the window.
+- Only one user, one thread: By default, all modules in this repository rely on the same user credentials defined in the single keyfile. If you have several sets of credentials, a CredentialPool (see below) fetches lists of tweets or users with all of them in parallel, each with its own rate limit.
 
 .. `developer pages`_: https://dev.twitter.com/rest/
 """
 
 from requests.exceptions import ReadTimeout, ConnectTimeout
+import requests
 import twitter_auth
 
 import itertools
-import json
+import jsoncodec
+import queue
+import threading
 import time
-import datetime
 import logging
 
 # --------------
@@ -48,14 +50,179 @@ import logging
 # --------------
 
 
+class RateLimiter(object):
+
+    """
+    Rate limit for a single API endpoint that can be shared between threads.
+    Twitter reports the number of remaining calls and the time the current
+    window ends in the headers x-rate-limit-remaining and x-rate-limit-reset.
+    The limiter spaces requests evenly over the rest of the window: with 90 calls
+    left and 450 seconds until the reset, it waits five seconds between calls.
+    This is a variant of the so-called *token bucket* algorithm.
+    """
+
+    def __init__(self, reserve=1, penalty=60):
+        """
+        :param reserve:
+        :type reserve: int, number of calls per window we never use (safety margin)
+        :param penalty:
+        :type penalty: int, seconds to wait after a "too many requests" response
+        that does not tell us when the window ends (doubled for every further one)
+        """
+        self.reserve = reserve
+        self.penalty = penalty
+        # Number of "too many requests" responses in a row
+        self.strikes = 0
+        # Until twitter tells us otherwise, we assume calls are available
+        self.calls = None
+        # Unix timestamp of the end of the current window
+        self.reset = 0
+        # Unix timestamp before which no further call should start
+        self.next_call = 0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """
+        :returns: number of remaining calls in the current window, None if unknown
+        """
+        with self._lock:
+            if self.calls is None or time.time() >= self.reset:
+                return None
+            return self.calls
+
+    def reserve_call(self):
+        """
+        Reserve a call and find out how long to wait before performing it.
+
+        :returns: delay in seconds
+        """
+        with self._lock:
+            now = time.time()
+            # No information yet, or a new window started since the last call
+            if self.calls is None or now >= self.reset:
+                return 0
+            if self.calls <= self.reserve:
+                # Budget exhausted, wait for the next window
+                return self.reset - now
+            start = max(now, self.next_call)
+            self.next_call = start + (self.reset - start) / (self.calls - self.reserve)
+            # Count the call right away, so other threads see the reduced budget
+            self.calls -= 1
+            return start - now
+
+    def acquire(self):
+        """
+        Wait until the next call may be performed.
+
+        :returns: waiting time in seconds
+        """
+        delay = self.reserve_call()
+        if delay > 60:
+            logging.error(
+                "Rate limit wait triggered, sleeping for {0:.0f} seconds".format(delay))
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def update(self, headers, status_code=200):
+        """
+        Update remaining calls and window end from the headers of a response.
+        """
+        if status_code != 429:
+            with self._lock:
+                self.strikes = 0
+        if 'x-rate-limit-remaining' not in headers or 'x-rate-limit-reset' not in headers:
+            return
+        try:
+            calls = int(headers['x-rate-limit-remaining'])
+            reset = int(headers['x-rate-limit-reset'])
+        except ValueError:
+            logging.warning("Ignoring invalid rate limit headers: {0}, {1}".format(
+                headers['x-rate-limit-remaining'], headers['x-rate-limit-reset']))
+            return
+        with self._lock:
+            if reset > self.reset or self.calls is None:
+                # A new window
+                self.reset = reset
+                self.calls = calls
+            else:
+                # Responses of parallel requests may arrive out of order,
+                # so we keep the lowest count we have seen
+                self.calls = min(self.calls, calls)
+
+    def exhausted(self):
+        """
+        Mark the budget as used up after twitter answered "too many requests",
+        so that the next call waits. If we know when the current window ends,
+        we wait until then. Otherwise (the response had no usable headers),
+        we wait penalty seconds, twice as long for every further such response,
+        but never longer than a whole 15 minute window.
+
+        :returns: delay in seconds before the next call
+        """
+        with self._lock:
+            now = time.time()
+            self.strikes += 1
+            if self.calls is None or now >= self.reset:
+                self.reset = now + min(self.penalty * 2 ** (self.strikes - 1), 900)
+            self.calls = 0
+            return self.reset - now
+
+
+class RateLimits(object):
+
+    """
+    Collection of RateLimiter objects, one per API endpoint (URL).
+    Limiters are created when an endpoint is used for the first time.
+    """
+
+    def __init__(self):
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, url):
+        with self._lock:
+            if url not in self._limiters:
+                self._limiters[url] = RateLimiter()
+            return self._limiters[url]
+
+    def remaining(self, url):
+        """
+        :returns: remaining calls for the endpoint, None if unknown
+        """
+        return self[url].remaining()
+
+    def status(self):
+        """
+        :returns: dictionary of endpoint -> remaining calls (None if unknown)
+        """
+        with self._lock:
+            limiters = list(self._limiters.items())
+        return {url: limiter.remaining() for url, limiter in limiters}
+
+
+class Credential(object):
+
+    """
+    One set of API credentials along with its own rate limits.
+    Twitter counts requests per set of credentials, so each of them
+    needs to keep track of its remaining calls separately.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.rate_limits = RateLimits()
+
+
 # Get an authentication object from our authentication module
 auth = twitter_auth.authorize()
 
-# Set an initial value as the current rate limit.
-# This variable will be set to a realistic value once we perform the first request.
-# It is defined outside of any functions so the entore code in this module has access to it.
-# Changing values from within a function require a "global" statement!
-rate_limit = {'calls': 180, 'expires': datetime.datetime.utcnow()}
+# The credential used by default for all requests
+default_credential = Credential(auth)
+
+# The rate limits of the default credential.
+# Use rate_limits.status() to see the remaining calls per endpoint.
+rate_limits = default_credential.rate_limits
 
 # API URLs
 
@@ -80,25 +247,6 @@ def grouper(iterable, n, fillvalue=None):
     return itertools.zip_longest(fillvalue=fillvalue, *args)
 
 
-def wait_for_limit():
-    """
-    Helper function that waits until the rate limit is reset
-
-    :side effects: Sleeps until rate_limit["expires"] datetime is reached
-    """
-    # Get the current UTC time
-    now = datetime.datetime.utcnow()
-    # Calculate timespan from now to reset
-    # Somewhat unusual syntax: the bracket forces computation of the
-    # time delta, and total_seconds is called on that.
-    time_to_reset = (rate_limit['expires'] - now).total_seconds()
-    # Sleep (wait) until this time has passed
-    logging.error(
-        "Rate limit wait triggered, sleeping for {0} seconds".format(time_to_reset))
-    time.sleep(time_to_reset)
-    return time_to_reset
-
-
 def lengthen_text(obj):
     """
     Recursively go through objects and replace 'text' fields
@@ -120,27 +268,49 @@ def lengthen_text(obj):
     return obj
 
 
+class LongTextResponse(requests.Response):
+
+    """
+    Response object whose json content has already been decoded and patched
+    by swap_long_text. Calling .json() returns the patched data right away
+    instead of decoding the response body a second time.
+    The raw .content (and thus .text) is only encoded from the patched data
+    if somebody actually asks for it.
+    """
+
+    def json(self, **kwargs):
+        return self.data
+
+    @property
+    def content(self):
+        if not self._content_patched:
+            self._content = bytes(jsoncodec.dumps(self.data), encoding='utf-8')
+            self._content_patched = True
+        return self._content
+
+
 def swap_long_text(requesting_func):
     """
     Helper decorator to swap text fields.
     Twitter returns the full 280 characters in their own field named 'full_text'.
     People already have their tools set up to work with the old 'text' field, so
     we place the full text there.
-    
-    Replacing the patched content is a bit messy, since we need to decode json,
-    patch it, encode it and place it back into the response object as bytes.
+
+    Decoding json is rather expensive for large responses, so we do it only once:
+    The patched data is stored in the response object and returned by its .json() method.
 
     :parameters: a function that returns a response object with json
-    :returns: a response object whose entries have had the 'text' field replaced
+    :returns: a LongTextResponse object whose entries have had the 'text' field replaced
     by 'full_text' if available.
     """
 
     def wrapper(*args, **kwargs):
         response = requesting_func(*args, **kwargs)
-        response_json = json.loads(response.text)
-        patched_data = lengthen_text(response_json)
-        # Monkey patching since .text and .content are read-only
-        response._content = bytes(json.dumps(patched_data), encoding='utf-8')
+        patched_data = lengthen_text(jsoncodec.loads(response.content))
+        # Turn the response into a LongTextResponse which knows about the patched data
+        response.__class__ = LongTextResponse
+        response.data = patched_data
+        response._content_patched = False
         return response
     return wrapper
 
@@ -157,44 +327,151 @@ def throttled_call(*args, **kwargs):
     """
     Helper function for complying with rate limits.
 
-    :parameters: Same as requests.get
+    :parameters: Same as requests.get, plus an optional keyword argument
+    'credential' with the Credential to use (defaults to default_credential)
     :returns: requests response object
-    :side effects: updates global rate_limit count and expires values
+    :side effects: updates the credential's rate limit for the requested endpoint
     """
-    # Declare rate_limit as global so we can write to it
-    global rate_limit
+    credential = kwargs.pop('credential', None) or default_credential
+    url = args[0] if args else kwargs['url']
+    limiter = credential.rate_limits[url]
 
     # Add tweet_mode keyword to tell twitter we DO want the full 280 character tweet text
     # This can be disabled via the keyword argument 'NO_LONG_TEXT'
     # Returned tweets carry the full length text in a field named 'full_text'
-    if not kwargs.get('NO_LONG_TEXT'):
+    if not kwargs.pop('NO_LONG_TEXT', False):
         kwargs.get('params', {})['tweet_mode'] = 'extended'
 
     # Try as long as we need to succeed
     while True:
-        # Take a break if there are less than 4 calls in the current rate limit timeslot
-        now = datetime.datetime.utcnow()
-        if rate_limit['calls'] < 5 and rate_limit['expires'] > now:
-            wait_for_limit()
+        # Wait for our turn within the rate limit of this endpoint
+        limiter.acquire()
         try:
-            result = auth.get(*args, **kwargs)
-            # Update remaining calls and expiry date with the new number from twitter
-            rate_limit['calls'] = int(
-                result.headers.get('x-rate-limit-remaining', 0))
-            if 'x-rate-limit-reset' in result.headers:
-                rate_limit['expires'] = datetime.datetime.utcfromtimestamp(
-                    int(result.headers['x-rate-limit-reset']))
+            result = credential.session.get(*args, **kwargs)
+            # Update remaining calls and window end with the new numbers from twitter
+            limiter.update(result.headers, result.status_code)
+            # 429 means "too many requests": we tell the limiter that the budget
+            # is exhausted, so it waits before the next attempt
+            if result.status_code == 429:
+                delay = limiter.exhausted()
+                logging.error("Rate limit exceeded for {0}, retrying in {1:.0f} seconds!".format(url, delay))
+                continue
             return result
         # Catch these two errors and continue
         # It is generally a good idea to only catch errors that you anticipate
         # Unknown Exceptions should be allowed to occur so you learn about them!
         except (ReadTimeout, ConnectTimeout):
             logging.error("There was a network timeout, retrying!")
-        finally:
-            # Wait for one second, regardless of our success.
-            # Waiting one second between requests is a generally accepted sane default
+            # Give the network a moment before retrying
             time.sleep(1)
 
+
+class CredentialPool(object):
+
+    """
+    Several sets of credentials that fetch data in parallel.
+    Each credential gets its own worker thread. All workers take pages of
+    IDs from a shared queue. A worker whose credential runs into its rate
+    limit holds on to its current page until the limit is reset, while the
+    other workers carry on with the remaining pages.
+    Throughput thus grows with the number of credentials.
+
+    Example usage:
+        pool = rest.CredentialPool()
+        for page in rest.fetch_tweet_list(ids, pool=pool):
+            ...
+    """
+
+    def __init__(self, sessions=None):
+        """
+        :param sessions:
+        :type sessions: list of OAuth1Session, defaults to twitter_auth.authorize_all()
+        """
+        sessions = sessions or twitter_auth.authorize_all()
+        self.credentials = [Credential(s) for s in sessions]
+
+    def calls_remaining(self, url):
+        """
+        :returns: sum of known remaining calls for an endpoint over all credentials
+        """
+        return sum(c.rate_limits.remaining(url) or 0 for c in self.credentials)
+
+    def map(self, function, pages):
+        """
+        Call function(credential, page) for every page, using all credentials in parallel.
+        Results are yielded as soon as they are ready, so their order may differ
+        from the order of the pages.
+
+        :param function:
+        :type function: function taking a Credential and a page
+        :param pages:
+        :type pages: iterable
+        :returns: generator yielding tuples (page, result of function)
+        """
+        # Marker that tells workers to stop
+        stop = object()
+        # A bounded queue ensures we do not read all pages into memory at once
+        tasks = queue.Queue(maxsize=2 * len(self.credentials))
+        results = queue.Queue()
+        # Set when the consumer stops early or an error ends the generator,
+        # so that the threads stop instead of fetching pages nobody reads.
+        # Queues are used with timeouts to check it every second.
+        shutdown = threading.Event()
+
+        def put_task(item):
+            while not shutdown.is_set():
+                try:
+                    tasks.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def feed():
+            try:
+                for page in pages:
+                    if not put_task(page):
+                        return
+            except Exception as exc:
+                results.put(exc)
+                return
+            for _ in self.credentials:
+                put_task(stop)
+
+        def work(credential):
+            while not shutdown.is_set():
+                try:
+                    page = tasks.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if page is stop:
+                    results.put(stop)
+                    return
+                try:
+                    results.put((page, function(credential, page)))
+                except Exception as exc:
+                    # Hand errors to the consuming thread so they are not lost
+                    results.put(exc)
+
+        threads = [threading.Thread(target=feed)]
+        threads += [threading.Thread(target=work, args=(c,)) for c in self.credentials]
+        for thread in threads:
+            # Daemon threads do not keep the program running on ctrl-c
+            thread.daemon = True
+            thread.start()
+        running = len(self.credentials)
+        try:
+            while running:
+                result = results.get()
+                if result is stop:
+                    running -= 1
+                elif isinstance(result, Exception):
+                    raise result
+                else:
+                    yield result
+        finally:
+            shutdown.set()
+
 # -----------------------
 # DATA FETCHING FUNCTIONS
 # -----------------------
@@ -214,8 +491,8 @@ def search_tweets(query, **kwargs):
     # Set the query parameter
     kwargs['q'] = query
     result = throttled_call(SEARCH_URL, params=kwargs)
-    # Decode JSON
-    response_data = json.loads(result.text)
+    # Get the decoded JSON
+    response_data = result.json()
     return (result, response_data['statuses'], response_data['search_metadata'])
 
 
@@ -237,8 +514,8 @@ def fetch_user_tweets(user, **kwargs):
     elif isinstance(user, str):
         kwargs['screen_name'] = user
     result = throttled_call(USER_TIMELINE_URL, params=kwargs)
-    # Decode JSON
-    return (result, json.loads(result.text))
+    # Get the decoded JSON
+    return (result, result.json())
 
 
 def fetch_user_archive(user, **kwargs):
@@ -273,12 +550,12 @@ def fetch_user_archive(user, **kwargs):
         # Calculate the new max_id to use in the next request
         max_id = min((int(t['id']) for t in tweets)) - 1
         logging.info("Fetched {0} tweets for {1} - {2} calls remaining".format(
-            len(tweets), user, rate_limit['calls']))
+            len(tweets), user, rate_limits.remaining(USER_TIMELINE_URL)))
         # Return fetched tweets
         yield tweets
 
 
-def fetch_tweets(ids, **kwargs):
+def fetch_tweets(ids, credential=None, **kwargs):
     """
     Fetch tweets from a list of IDs.
     Optional parameters are passed on to the requests library
@@ -286,6 +563,8 @@ def fetch_tweets(ids, **kwargs):
 
     :param ids:
     :type ids: tweet_id as str, int or list
+    :param credential:
+    :type credential: Credential, defaults to default_credential
     :returns: tuple (result object, list of tweets)
     """
     # This call allows fetching 100 tweets at most
@@ -296,29 +575,66 @@ def fetch_tweets(ids, **kwargs):
     elif isinstance(ids, (list, tuple)):
         kwargs["id"] = ",".join([str(i) for i in ids])
     # Call API
-    result = throttled_call(TWEETS_URL, params=kwargs)
-    # Decode JSON
-    return (result, json.loads(result.text))
+    result = throttled_call(TWEETS_URL, params=kwargs, credential=credential)
+    # Get the decoded JSON
+    return (result, result.json())
 
 
-def fetch_tweet_list(ids, **kwargs):
+def id_pages(ids):
+    """
+    Split IDs into lists of (at most) 100 that can be retrieved in one call.
+
+    :returns: generator yielding lists of IDs
+    """
+    for page in grouper(ids, 100):
+        # The last page is padded with None values by grouper
+        yield [i for i in page if i is not None]
+
+
+def fetch_tweet_pages(ids, pool=None, **kwargs):
+    """
+    Fetch an arbitrarily large number of tweets by ID, keeping track
+    of which IDs were requested for every page. Tweets that are deleted
+    or protected are simply missing from the results, so comparing the
+    requested IDs with the returned ones reveals which tweets are unavailable.
+
+    :param ids:
+    :type ids: tweet_id as str, int or list
+    :param pool:
+    :type pool: CredentialPool for fetching pages in parallel (optional).
+    Pages are then yielded in the order they complete.
+    :returns: generator object yielding tuples (list of requested IDs, list of tweets)
+    """
+    if pool:
+        def fetch_page(credential, page):
+            return fetch_tweets(page, credential=credential, **kwargs)
+        for page, (result, tweets) in pool.map(fetch_page, id_pages(ids)):
+            logging.info(
+                "Fetched {0} tweets from list - {1} calls remaining".format(len(tweets), pool.calls_remaining(TWEETS_URL)))
+            yield page, tweets
+        return
+    for page in id_pages(ids):
+        result, tweets = fetch_tweets(page, **kwargs)
+        logging.info(
+            "Fetched {0} tweets from list - {1} calls remaining".format(len(tweets), rate_limits.remaining(TWEETS_URL)))
+        yield page, tweets
+
+
+def fetch_tweet_list(ids, pool=None, **kwargs):
     """
     Fetch an arbitrarily large number of tweets by ID
 
     :param ids:
     :type ids: tweet_id as str, int or list
+    :param pool:
+    :type pool: CredentialPool for fetching pages in parallel (optional)
     :returns: generator object yielding lists of tweets
     """
-    # Split given tweet IDs into blocks of 100 that can
-    # be retrieved in one call
-    for page in grouper(ids, 100):
-        result, tweets = fetch_tweets(page)
-        logging.info(
-            "Fetched {0} tweets from list - {1} calls remaining".format(len(tweets), rate_limit['calls']))
+    for page, tweets in fetch_tweet_pages(ids, pool=pool, **kwargs):
         yield tweets
 
 
-def fetch_users(ids=None, screen_names=None, **kwargs):
+def fetch_users(ids=None, screen_names=None, credential=None, **kwargs):
     """
     Fetch users from a list of IDs or screen_names (max 100 at a time).
     Optional parameters are passed on to the requests library
@@ -328,6 +644,8 @@ def fetch_users(ids=None, screen_names=None, **kwargs):
     :type ids: user_id as str, int or list
     :param screen_names:
     :type screen_names: screen_name as str, int or list
+    :param credential:
+    :type credential: Credential, defaults to default_credential
     :returns: tuple (result object, list of users)
     """
     # This call allows fetching 100 users at most
@@ -342,26 +660,36 @@ def fetch_users(ids=None, screen_names=None, **kwargs):
     elif isinstance(screen_names, (list, tuple)):
         kwargs["screen_name"] = ",".join([str(s) for s in screen_names])
     # Call API
-    result = throttled_call(USERS_URL, params=kwargs)
-    # Decode JSON
-    return (result, json.loads(result.text))
+    result = throttled_call(USERS_URL, params=kwargs, credential=credential)
+    # Get the decoded JSON
+    return (result, result.json())
 
 
-def fetch_user_list_by_id(ids=None, **kwargs):
+def fetch_user_list_by_id(ids=None, pool=None, **kwargs):
     """
     Fetch an arbitrarily large number of users by ID
 
     :param ids:
     :type ids: user_id as str, int or list
+    :param pool:
+    :type pool: CredentialPool for fetching pages in parallel (optional).
+    Pages are then yielded in the order they complete.
     :returns: generator object yielding lists of tweets
     """
+    if pool:
+        def fetch_page(credential, page):
+            return fetch_users(ids=page, credential=credential)
+        for page, (result, users) in pool.map(fetch_page, id_pages(ids)):
+            logging.info(
+                "Fetched {0} users from ID list - {1} calls remaining".format(len(users), pool.calls_remaining(USERS_URL)))
+            yield users
+        return
     # Split given tweet IDs into blocks of 100 that can
     # be retrieved in one call
-    pages = grouper(ids, 100)
-    for page in pages:
+    for page in id_pages(ids):
         result, users = fetch_users(ids=page)
         logging.info(
-            "Fetched {0} users from ID list - {1} calls remaining".format(len(users), rate_limit['calls']))
+            "Fetched {0} users from ID list - {1} calls remaining".format(len(users), rate_limits.remaining(USERS_URL)))
         yield users
 
 
@@ -379,5 +707,5 @@ def fetch_user_list_by_screen_name(screen_names=None, **kwargs):
     for page in pages:
         result, users = fetch_users(screen_names=page)
         logging.info(
-            "Fetched {0} users from list - {1} calls remaining".format(len(users), rate_limit['calls']))
+            "Fetched {0} users from list - {1} calls remaining".format(len(users), rate_limits.remaining(USERS_URL)))
         yield users
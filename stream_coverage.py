@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 Pascal Jürgens and Andreas Jungherr
+# See License.txt
+
+"""
+Keeping Track of Stream Coverage
+--------------------------------
+Accounts for limit and delete notices while streaming and stores the results in the database
+
+Requirements:
+    - depends on database module database.py and streaming module streaming.py
+
+How complete is my data?
+========================
+As explained in streaming.py, twitter's free streams do not guarantee to deliver all matching tweets. If a tracking stream matches more tweets than twitter is willing to hand out, we receive *limit notices* instead, which contain the number of tweets that were left out since the connection was opened. Similarly, *delete notices* tell us which tweets were deleted by their authors - something that researchers are asked to respect.
+
+Collecting these numbers while streaming is much easier than digging them out of gigabytes of log files afterwards. The CoverageAccountant below keeps running totals and per-minute counts of delivered tweets, undelivered (limited) tweets and delete notices, and periodically writes them to the database (tables StreamMinute and DeletedTweet) alongside the tweets themselves.
+
+Example usage:
+    accountant = stream_coverage.CoverageAccountant("election")
+    writer = capture.SegmentWriter("captures", prefix="election")
+    streaming.stream(on_raw=streaming.chain(writer, accountant.on_raw),
+                     on_limit=accountant.on_limit, on_delete=accountant.on_delete,
+                     track=["election"])
+"""
+
+import collections
+import datetime
+import logging
+import threading
+import time
+from array import array
+
+import database
+import streaming
+
+
+def minute_of(timestamp_ms=None):
+    """
+    Turn a timestamp in milliseconds (as used by twitter) into the
+    beginning of its minute in the database's date format (UTC).
+    Without timestamp, the current minute is used.
+    """
+    seconds = timestamp_ms / 1000.0 if timestamp_ms else time.time()
+    return datetime.datetime.utcfromtimestamp(seconds - seconds % 60).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class CoverageAccountant(object):
+
+    """
+    Counts delivered tweets, limit notices and delete notices of one stream.
+    Its methods can be used as callbacks for streaming.stream. All numbers are
+    kept in memory and written to the database every flush_every seconds
+    (and when calling flush()). Safe to use from several threads.
+    """
+
+    def __init__(self, name, flush_every=60):
+        """
+        :param name:
+        :type name: str, name of the stream under which results are stored
+        :param flush_every:
+        :type flush_every: seconds between writes to the database
+        """
+        self.name = name
+        self.flush_every = flush_every
+        # Running totals since the accountant was created
+        self.totals = collections.Counter()
+        # minute -> [delivered, limited, deleted], not yet written to the database
+        self.minutes = collections.defaultdict(lambda: [0, 0, 0])
+        # Deleted tweet IDs, user IDs and timestamps, stored compactly as 64 bit integers
+        self.deleted_ids = array('q')
+        self.deleted_users = array('q')
+        self.deleted_timestamps = array('q')
+        # Limit notices count undelivered tweets since the connection was opened,
+        # so we need to remember the last value to compute the difference
+        self.last_track = 0
+        self.last_flush = time.time()
+        self._lock = threading.Lock()
+
+    def on_tweet(self, tweet=None):
+        """
+        Count a delivered tweet. Use as on_tweet callback or call from your own.
+        """
+        self._count(minute_of(), 0)
+
+    def on_raw(self, line):
+        """
+        Count a delivered tweet if the raw line contains one. Use as on_raw callback.
+        """
+        if streaming.classify_line(line) == "tweet":
+            self._count(minute_of(), 0)
+
+    def on_limit(self, track, timestamp_ms=None):
+        """
+        Account for a limit notice. Use as on_limit callback.
+        """
+        with self._lock:
+            # A smaller number than before means the stream reconnected
+            limited = track - self.last_track if track >= self.last_track else track
+            self.last_track = track
+        self._count(minute_of(timestamp_ms), 1, limited)
+
+    def on_delete(self, tweet_id, user_id=None, timestamp_ms=None):
+        """
+        Account for a delete notice. Use as on_delete callback.
+        """
+        with self._lock:
+            self.deleted_ids.append(tweet_id)
+            self.deleted_users.append(user_id or 0)
+            self.deleted_timestamps.append(timestamp_ms or int(time.time() * 1000))
+        self._count(minute_of(timestamp_ms), 2)
+
+    def _count(self, minute, position, amount=1):
+        names = ("delivered", "limited", "deleted")
+        with self._lock:
+            self.minutes[minute][position] += amount
+            self.totals[names[position]] += amount
+            due = time.time() - self.last_flush >= self.flush_every
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all counts collected so far to the database in one transaction.
+        """
+        with self._lock:
+            minutes, self.minutes = self.minutes, collections.defaultdict(lambda: [0, 0, 0])
+            deleted = list(zip(self.deleted_ids, self.deleted_users, self.deleted_timestamps))
+            self.deleted_ids = array('q')
+            self.deleted_users = array('q')
+            self.deleted_timestamps = array('q')
+            self.last_flush = time.time()
+        with database.db.atomic():
+            database.add_counts(
+                database.StreamMinute, ("stream", "minute"), ("delivered", "limited", "deleted"),
+                {(self.name, minute): tuple(values) for minute, values in minutes.items()})
+            database.insert_or_ignore(
+                database.DeletedTweet, ("id", "user_id", "date"),
+                ((tweet_id, user_id or None, minute_of(timestamp))
+                 for tweet_id, user_id, timestamp in deleted))
+        logging.info("Coverage of {0}: {1}".format(self.name, dict(self.totals)))
+
+    def coverage(self):
+        """
+        :returns: share of matching tweets that were delivered so far (between 0 and 1)
+        """
+        with self._lock:
+            matching = self.totals["delivered"] + self.totals["limited"]
+            return self.totals["delivered"] / float(matching) if matching else 1.0
+
+
+def coverage_report(name, start_date=None, stop_date=None):
+    """
+    Read the stored per-minute statistics of a stream from the database.
+
+    :param name:
+    :type name: str, name of the stream
+    :param start_date:
+    :type start_date: datetime object (optional)
+    :param stop_date:
+    :type stop_date: datetime object (optional)
+    :returns: list of tuples (minute, delivered, limited, deleted, share of delivered tweets)
+    """
+    m = database.StreamMinute
+    query = (m.select(m.minute, m.delivered, m.limited, m.deleted)
+             .where(m.stream == name)
+             .order_by(m.minute))
+    if start_date:
+        query = query.where(m.minute >= database.to_utc(start_date))
+    if stop_date:
+        query = query.where(m.minute < database.to_utc(stop_date))
+    report = []
+    for minute, delivered, limited, deleted in query.tuples():
+        matching = delivered + limited
+        report.append((minute, delivered, limited, deleted,
+                       delivered / float(matching) if matching else 1.0))
+    return report
@@ -36,6 +36,8 @@ In this module, you will find a function for setting up either a random sample o
 
 **It is absolutely vital that the code processing tweets does so quickly.** While the callback functions do their work, the main function is paused and cannot process incoming data. If your code takes too long, twitter will disconnect the stream and - if that happens too often - disable your API access altogether. So make sure you only perform the absolute minimum work while streaming. Post-processing is best handled after the data collection.
 
+If your callbacks are occasionally slow (for example because they write to a database), you can decouple reading and processing by passing a LineBuffer to the stream function. Incoming lines are then placed in the buffer and handled by separate *consumer* threads, while the main thread keeps reading from twitter. The buffer has a maximum size; what happens once it is full is up to you: Either reading waits (block), the oldest lines are thrown away (drop-oldest) or lines are written to a file on disk and processed later (spill).
+
 
 .. _`failure explanation`: https://dev.twitter.com/streaming/overview/messages-types#disconnect_messages
 ..  _`error status code`: https://dev.twitter.com/streaming/overview/connecting
@@ -44,17 +46,34 @@ In this module, you will find a function for setting up either a random sample o
 """
 
 import twitter_auth
-import json
+import requests
+import jsoncodec
+import collections
 import datetime
+import random
+import re
+import tempfile
+import threading
 import time
 import logging
 
 
-auth = twitter_auth.authorize()
+# The authorization object is only created when a stream is opened
+# (see authorized), so importing this module does not need a keyfile
+auth = None
+
 
-# We use these global variables to store information about errors
-last_error_date = None
-last_error_wait = 0
+def authorized():
+    """
+    Return the authorization object for streaming requests,
+    creating it from the keyfile on first use.
+
+    :returns: OAuth1Session
+    """
+    global auth
+    if auth is None:
+        auth = twitter_auth.authorize()
+    return auth
 
 
 # Stream URLs
@@ -64,6 +83,32 @@ FILTER_URL = "https://stream.twitter.com/1.1/statuses/filter.json"
 # Set basic defaults: Warn about slow processing and don't filter "low quality" content
 DEFAULT_PARAMETERS = {'stall_warnings': 'true', 'filter_level': 'none'}
 
+# Messages other than tweets are json objects with one well-known key, and
+# tweets start with their creation date. So the first few bytes of a line tell
+# us what kind of message it is, without decoding the entire line.
+MESSAGE_TYPES = [
+    (b'{"created_at"', "tweet"),
+    (b'{"delete"', "delete"),
+    (b'{"limit"', "limit"),
+    (b'{"warning"', "warning"),
+    (b'{"disconnect"', "disconnect"),
+    (b'{"scrub_geo"', "scrub_geo"),
+    (b'{"status_withheld"', "status_withheld"),
+    (b'{"user_withheld"', "user_withheld"),
+]
+
+# Patterns for extracting numbers from delete and limit notices, such as:
+# {"delete":{"status":{"id":1234,"id_str":"1234","user_id":3,"user_id_str":"3"},"timestamp_ms":"1443095140794"}}
+# {"limit":{"track":16,"timestamp_ms":"1443095140794"}}
+DELETE_PATTERN = re.compile(br'"id":(\d+).*?"user_id":(\d+)')
+TRACK_PATTERN = re.compile(br'"track":(\d+)')
+# {"disconnect":{"code":4,"stream_name":"...","reason":"..."}}
+CODE_PATTERN = re.compile(br'"code":(\d+)')
+TIMESTAMP_PATTERN = re.compile(br'"timestamp_ms":"(\d+)"')
+
+# Number of lines received per message type, across all streams
+line_counts = collections.Counter()
+
 
 class IrrecoverableStreamException(Exception):
 
@@ -73,61 +118,441 @@ class IrrecoverableStreamException(Exception):
     pass
 
 
-def backoff(errorcode=None):
+class Backoff(object):
+
     """
-    Helper function for waiting on errors.
-    Follows recommendations from twitter developer documentation:
+    Keeps track of errors on one connection and computes how long to wait
+    before reconnecting. Follows recommendations from twitter developer documentation:
     https://dev.twitter.com/streaming/overview/connecting
 
+    There are three schedules, each with its own waiting time:
+    - "rate_limit" (http status 420 or 429): start with 60 seconds and double on every error
+    - "http" (other http errors such as 503, and disconnect messages about a
+      duplicate stream): start with 5 seconds, double up to 320 seconds
+    - "network" (connection problems, stalls, other disconnect messages): start with
+      a quarter of a second and add another quarter on every error, up to 16 seconds
+
+    Some errors cannot be fixed by reconnecting, such as invalid keys (http status 401)
+    or revoked keys (disconnect code 6). They raise IrrecoverableStreamException.
+
+    Being accepted by twitter (http status 200) is not enough to count as
+    success: a stream that is accepted and then drops right away would
+    otherwise be retried every quarter of a second forever. So call connected()
+    once a connection is accepted and received() for every line that arrives
+    (keep-alive blank lines included). Once the connection has lasted
+    healthy_after seconds, waiting times start over, so that the next error
+    is handled quickly again. A small random amount (the jitter) is added to every
+    waiting time, so that several streams that fail at once do not reconnect
+    at the very same moment.
+
+    The object does not wait itself - streaming.stream uses time.sleep with the
+    result, while async_streaming.stream uses asyncio.sleep.
+    """
+
+    # schedule: (first waiting time, how to compute the next one, maximum)
+    SCHEDULES = {
+        "rate_limit": (60, lambda wait: wait * 2, None),
+        "http": (5, lambda wait: wait * 2, 320),
+        "network": (0.25, lambda wait: wait + 0.25, 16),
+    }
+
+    # Errors that cannot be fixed by reconnecting
+    IRRECOVERABLE = (401, 403, 404, 406, 413, 416)
+    # Disconnect messages (see parse_disconnect) that cannot be fixed by
+    # reconnecting: the keys were revoked (6) or the user was logged out (7)
+    IRRECOVERABLE_DISCONNECTS = (6, 7)
+    # Disconnect messages that are treated like http errors: another
+    # connection with the same keys is open (2) and reconnecting
+    # quickly would only make the two streams push each other out
+    HTTP_DISCONNECTS = (2,)
+
+    def __init__(self, jitter=0.1, reset_after=1800, healthy_after=60):
+        """
+        :param jitter:
+        :type jitter: float, maximum share of the waiting time added at random
+        :param reset_after:
+        :type reset_after: seconds without error after which waiting times start over
+        :param healthy_after:
+        :type healthy_after: seconds a connection has to deliver lines before
+        waiting times start over
+        """
+        self.jitter = jitter
+        self.reset_after = reset_after
+        self.healthy_after = healthy_after
+        self.last_error = None
+        self.connected_at = None
+        self.waits = {}
+
+    def schedule(self, errorcode=None):
+        """
+        Find the schedule for an error.
+
+        :param errorcode:
+        :type errorcode: int, http status or code from a disconnect message.
+        None for network errors.
+        :returns: "rate_limit", "http" or "network"
+        """
+        if errorcode in (420, 429):
+            return "rate_limit"
+        if errorcode in self.IRRECOVERABLE:
+            logging.error(u"Connection HTTP error {0}".format(errorcode))
+            raise IrrecoverableStreamException
+        if errorcode in self.IRRECOVERABLE_DISCONNECTS:
+            logging.error(u"Disconnected with code {0}, reconnecting will not help".format(errorcode))
+            raise IrrecoverableStreamException
+        # Disconnect messages carry small numbers instead of http status codes
+        if errorcode in self.HTTP_DISCONNECTS or (errorcode is not None and errorcode >= 400):
+            return "http"
+        return "network"
+
+    def delay(self, errorcode=None):
+        """
+        Register an error and compute how long to wait before reconnecting.
+
+        :param errorcode:
+        :type errorcode: int, http status or code from a disconnect message.
+        None for network errors.
+        :returns: waiting time in seconds
+        :returns type: float
+        """
+        kind = self.schedule(errorcode)
+        now = time.time()
+        # Whatever happened, the connection is gone
+        self.connected_at = None
+        # If the last error was a long time ago, start over
+        if self.last_error is not None and now - self.last_error >= self.reset_after:
+            self.waits = {}
+        self.last_error = now
+        first, step, maximum = self.SCHEDULES[kind]
+        wait = step(self.waits[kind]) if kind in self.waits else first
+        if maximum is not None:
+            wait = min(wait, maximum)
+        self.waits[kind] = wait
+        # Jitter only ever adds time, so we never wait less than twitter asks us to
+        sleep = wait * (1 + random.uniform(0, self.jitter))
+        logging.error("Waiting for {0:.2f} seconds on error {1}".format(sleep, errorcode))
+        return sleep
+
+    def reset(self):
+        """
+        Forget about past errors. Called by received once a connection is healthy.
+        """
+        self.waits = {}
+        self.last_error = None
+
+    def connected(self):
+        """
+        Note that twitter accepted a connection. Waiting times are only
+        reset once lines keep arriving for a while (see received).
+        """
+        self.connected_at = time.time()
+
+    def received(self):
+        """
+        Note that a line arrived on the connection. Resets the waiting
+        times once the connection has lasted healthy_after seconds.
+        Cheap enough to call for every line.
+        """
+        if self.waits and self.connected_at is not None \
+                and time.time() - self.connected_at >= self.healthy_after:
+            self.reset()
+
+
+# Shared by the functions below, which are kept for compatibility.
+# Streams use one Backoff object per connection.
+default_backoff = Backoff()
+
+
+def backoff_delay(errorcode=None):
+    """
+    Helper function for computing how long to wait on errors, without waiting.
+    See Backoff for the details.
+
     :param errorcode:
     :type errorcode: int
     :returns: sleep time in seconds
-    :returns type: int
+    :returns type: float
     """
-    global last_error_date
-    global last_error_wait
+    return default_backoff.delay(errorcode)
 
-    now = datetime.datetime.utcnow()
-    # Somewhat unusual syntax: the bracket forces computation of the
-    # time delta, and total_seconds is called on that
-    if last_error_date:
-        time_since_error = (now - last_error_date).total_seconds()
-    else:
-        time_since_error = 1800  # The exact amount doesn't matter
-        # since we only check whether there was an error in the last
-        # half hour below
-    last_error_date = now
-
-    # If the last error was more than 30 minutes ago, reset the wait duration to one minute
-    base_sleep = last_error_wait if time_since_error < 1800 else 1
-
-    # Rate limiting error
-    if errorcode == 420:
-        # Use a minimum of 60 seconds or double the previous amount of backoff
-        sleep = max(base_sleep, 30) * 2
-
-    # Technical error on twitter's side
-    elif errorcode in [503]:
-        # Use a minimum of 5 seconds or double the previous amount of backoff
-        sleep = max(base_sleep, 2.5) * 2
-        # Limit backoff to a maximum of 320 seconds
-        sleep = min(sleep, 320)
-
-    # Irrecoverable errors, cannot continue
-    elif errorcode in [401, 403, 404, 406, 413, 416]:
-        logging.error(u"Connection HTTP error {0}".format(errorcode))
-        raise IrrecoverableStreamException
-    # We don't handle any other errors
-    else:
-        raise ValueError
 
-    last_error_wait = sleep
-    logging.error("Waiting for {0} seconds on error {1}".format(sleep, errorcode))
+def backoff(errorcode=None):
+    """
+    Helper function for waiting on errors. Sleeps for the time
+    computed by backoff_delay.
+
+    :param errorcode:
+    :type errorcode: int
+    :returns: sleep time in seconds
+    :returns type: float
+    """
+    sleep = backoff_delay(errorcode)
     time.sleep(sleep)
     return sleep
 
 
-def stream(on_tweet=None, on_notification=None, track=None, follow=None):
+class LineBuffer(object):
+
+    """
+    Bounded buffer between the thread reading lines from twitter and
+    the threads processing them. Safe to use from several threads.
+
+    What happens if the buffer is full depends on the overflow policy:
+    - "block": the reading thread waits until there is room again
+    - "drop-oldest": the oldest line is discarded to make room (see .dropped)
+    - "spill": lines are written to a temporary file and read back once
+      the consumers catch up, so nothing is lost and memory use stays bounded
+
+    Call stats() at any time to see how the buffer is doing.
+    """
+
+    POLICIES = ("block", "drop-oldest", "spill")
+
+    def __init__(self, size=10000, overflow="block", spill_file=None):
+        """
+        :param size:
+        :type size: int, maximum number of lines kept in memory
+        :param overflow:
+        :type overflow: str, one of "block", "drop-oldest" or "spill"
+        :param spill_file:
+        :type spill_file: file object opened in binary read/write mode, defaults to a temporary file
+        """
+        if overflow not in self.POLICIES:
+            raise ValueError("Unknown overflow policy {0}, use one of {1}".format(overflow, self.POLICIES))
+        self.size = size
+        self.overflow = overflow
+        self.lines = collections.deque()
+        self.condition = threading.Condition()
+        self.spill_file = spill_file
+        if overflow == "spill" and spill_file is None:
+            self.spill_file = tempfile.TemporaryFile()
+        # Number of lines waiting in the spill file and position of the next one
+        self.spill_pending = 0
+        self.spill_position = 0
+        # Metrics
+        self.received = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.max_depth = 0
+
+    def put(self, line):
+        """
+        Add a line to the buffer, applying the overflow policy if it is full.
+        """
+        with self.condition:
+            self.received += 1
+            # Once we started spilling, later lines go to disk as well to keep their order
+            if self.spill_pending or (self.overflow == "spill" and len(self.lines) >= self.size):
+                self.spill_file.seek(0, 2)
+                self.spill_file.write(line + b"\n")
+                self.spill_pending += 1
+                self.spilled += 1
+                self.max_depth = max(self.max_depth, self.depth())
+                self.condition.notify()
+                return
+            if len(self.lines) >= self.size:
+                if self.overflow == "drop-oldest":
+                    self.lines.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self.lines) >= self.size:
+                        self.condition.wait()
+            self.lines.append(line)
+            self.max_depth = max(self.max_depth, self.depth())
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Take the oldest line from the buffer, waiting for one if necessary.
+
+        :param timeout:
+        :type timeout: seconds to wait at most, None waits forever
+        :returns: line as bytes, or None if the timeout passed
+        """
+        with self.condition:
+            while not self.lines:
+                if self.spill_pending:
+                    self._read_spilled()
+                elif not self.condition.wait(timeout):
+                    return None
+            line = self.lines.popleft()
+            # Wake up a reader waiting for room
+            self.condition.notify_all()
+            return line
+
+    def _read_spilled(self):
+        """
+        Move lines from the spill file back into memory. Must hold the condition lock.
+        """
+        self.spill_file.seek(self.spill_position)
+        while self.spill_pending and len(self.lines) < self.size:
+            self.lines.append(self.spill_file.readline().rstrip(b"\n"))
+            self.spill_pending -= 1
+        self.spill_position = self.spill_file.tell()
+        if not self.spill_pending:
+            # Everything has been read back, start over with an empty file
+            self.spill_file.seek(0)
+            self.spill_file.truncate()
+            self.spill_position = 0
+
+    def depth(self):
+        """
+        :returns: number of lines waiting to be processed
+        """
+        return len(self.lines) + self.spill_pending
+
+    def stats(self):
+        """
+        :returns: dictionary with current depth and counts of received, dropped and spilled lines
+        """
+        with self.condition:
+            return {
+                "depth": self.depth(),
+                "max_depth": self.max_depth,
+                "received": self.received,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+            }
+
+
+def classify_line(line):
+    """
+    Find out what kind of message a line contains by looking at its first bytes.
+
+    :param line:
+    :type line: bytes
+    :returns: "tweet", "delete", "limit", "warning", "disconnect", "scrub_geo",
+    "status_withheld", "user_withheld" or "other" if the line looks unfamiliar
+    """
+    for prefix, kind in MESSAGE_TYPES:
+        if line.startswith(prefix):
+            return kind
+    return "other"
+
+
+def parse_delete(line):
+    """
+    Extract the IDs from a delete notice without decoding it.
+
+    :returns: tuple (tweet ID, user ID, timestamp in milliseconds) as ints
+    """
+    ids = DELETE_PATTERN.search(line)
+    timestamp = TIMESTAMP_PATTERN.search(line)
+    return (int(ids.group(1)), int(ids.group(2)),
+            int(timestamp.group(1)) if timestamp else None)
+
+
+def parse_limit(line):
+    """
+    Extract the number of undelivered tweets from a limit notice without decoding it.
+
+    :returns: tuple (number of undelivered tweets, timestamp in milliseconds) as ints
+    """
+    track = TRACK_PATTERN.search(line)
+    timestamp = TIMESTAMP_PATTERN.search(line)
+    return (int(track.group(1)), int(timestamp.group(1)) if timestamp else None)
+
+
+def parse_disconnect(line):
+    """
+    Extract the code from a disconnect notice without decoding it.
+    The codes are listed in twitter's documentation, for example 4 for a stall.
+
+    :returns: code as int, None if the notice has none
+    """
+    code = CODE_PATTERN.search(line)
+    return int(code.group(1)) if code else None
+
+
+def chain(*callbacks):
+    """
+    Combine several callbacks into one, for example to write raw lines to disk
+    and count them at the same time: on_raw=chain(writer, accountant.on_raw)
+    """
+    def combined(*args):
+        for callback in callbacks:
+            callback(*args)
+    return combined
+
+
+def dispatch(data, on_tweet=None, on_notification=None):
+    """
+    Hand a decoded message from the stream to the matching callback.
+
+    :returns: the result of the callback, None if there was none
+    """
+    # A tweet
+    if "text" in data:
+        if on_tweet:
+            return on_tweet(data)
+    # A non-tweet message
+    elif data and on_notification:
+        return on_notification(data)
+    return None
+
+
+def handle_line(line, on_tweet=None, on_notification=None, on_raw=None, on_delete=None,
+                on_limit=None, buffer=None):
+    """
+    Hand one non-blank line from the stream to the callbacks (see stream for
+    their meaning). Used by both stream and async_streaming.stream, so that
+    every message is treated the same way, no matter how it was received.
+    Disconnect notices are not handed to any callback except on_raw: the
+    caller needs to close the connection and reconnect.
+
+    :param buffer:
+    :type buffer: LineBuffer (optional), receives lines that need decoding instead
+    of decoding them right away
+    :returns: tuple (kind of message as in classify_line, list of the results of
+    the callbacks). Callbacks that are coroutines return awaitable results,
+    which async_streaming awaits.
+    """
+    results = []
+    if on_raw:
+        results.append(on_raw(line))
+    kind = classify_line(line)
+    line_counts[kind] += 1
+    # Twitter tells us it's disconnecting the stream
+    if kind == "disconnect":
+        logging.error("Disconnected: {0}".format(line))
+        return kind, results
+    if kind == "delete" and on_delete:
+        results.append(on_delete(*parse_delete(line)))
+    elif kind == "limit" and on_limit:
+        results.append(on_limit(*parse_limit(line)))
+    # Skip decoding if nobody is interested in the result
+    if kind == "tweet":
+        interested = on_tweet
+    elif kind == "other":
+        interested = on_tweet or on_notification
+    else:
+        interested = on_notification
+    if not interested:
+        return kind, results
+    # Hand the line to the consumers
+    if buffer is not None:
+        buffer.put(line)
+        return kind, results
+    # Lines are decoded straight from bytes
+    results.append(dispatch(jsoncodec.loads(line), on_tweet, on_notification))
+    return kind, results
+
+
+def consume(buffer, on_tweet=None, on_notification=None):
+    """
+    Consumer loop: take lines from the buffer, decode them and call the callbacks.
+    Runs forever, so it is meant to be started in a separate thread.
+    """
+    while True:
+        line = buffer.get()
+        try:
+            dispatch(jsoncodec.loads(line), on_tweet, on_notification)
+        except Exception as e:
+            logging.error("Error! Encountered Exception {0} but continuing in order not to drop stream,".format(e))
+
+
+def stream(on_tweet=None, on_notification=None, track=None, follow=None, buffer=None, consumers=1,
+           on_raw=None, on_delete=None, on_limit=None):
     """
     Connect to sample stream.
     Handles connecting, json parsing, error handling and disconnecting.
@@ -149,9 +574,28 @@ def stream(on_tweet=None, on_notification=None, track=None, follow=None):
     :type track: list of tracking strings
     :param follow:
     :type follow: list of user IDs to track
+    :param buffer:
+    :type buffer: LineBuffer (optional). If given, callbacks are called from separate
+    consumer threads so that slow callbacks do not hold up reading from twitter.
+    :param consumers:
+    :type consumers: int, number of consumer threads when using a buffer.
+    If your callbacks write to the database, stick to one.
+    :param on_raw:
+    :type on_raw: function receiving every non-blank line as bytes, before decoding.
+    Use it with capture.SegmentWriter to save the stream.
+    :param on_delete:
+    :type on_delete: function receiving (tweet ID, user ID, timestamp_ms) of delete notices
+    :param on_limit:
+    :type on_limit: function receiving (undelivered tweets, timestamp_ms) of limit notices
+
+    Lines are only decoded if a callback wants to see the result: tweets if there is
+    an on_tweet callback, other messages if there is an on_notification callback.
+    on_delete and on_limit receive numbers that are picked from the raw line, which
+    is much faster than decoding it. The number of lines per message type is counted
+    in the module variable line_counts.
     """
-    # Use default values
-    parameters = DEFAULT_PARAMETERS
+    # Use default values (copied, so we don't change the defaults themselves)
+    parameters = dict(DEFAULT_PARAMETERS)
     url = FILTER_URL
     # Do we track phrases?
     if track:
@@ -162,30 +606,43 @@ def stream(on_tweet=None, on_notification=None, track=None, follow=None):
     # Else, it's a sample stream
     else:
         url = SAMPLE_URL
+    if buffer is not None:
+        for _ in range(consumers):
+            consumer = threading.Thread(target=consume, args=(buffer, on_tweet, on_notification))
+            # Daemon threads do not keep the program running on ctrl-c
+            consumer.daemon = True
+            consumer.start()
+    # Errors on this connection are counted separately from other streams
+    delays = Backoff()
     while True:
-        stream = auth.post(url, data=parameters, stream=True)
+        try:
+            stream = authorized().post(url, data=parameters, stream=True)
+        except requests.exceptions.RequestException as e:
+            logging.error("Error! Could not connect: {0}".format(e))
+            time.sleep(delays.delay())
+            continue
         if stream.status_code != 200:
             stream.close()
-            backoff(int(stream.status_code))
+            time.sleep(delays.delay(int(stream.status_code)))
+            continue
+        delays.connected()
+        disconnect_code = None
         try:
             for line in stream.iter_lines():
+                # Keep-alive blank lines show that the connection is healthy, too
+                delays.received()
                 # Skip blank lines
-                if line:
-                    try:
-                        data = json.loads(line.decode())
-                        # Twitter tells us it's disconnecting the stream
-                        if 'disconnect' in data:
-                            stream.close()
-                            backoff(data['disconnect'].get('code', 1))
-                        # A tweet
-                        elif "text" in data:
-                            if on_tweet:
-                                on_tweet(data)
-                        # A non-tweet message
-                        elif data and on_notification:
-                            on_notification(data)
-                    except Exception as e:
-                        logging.error("Error! Encountered Exception {0} but continuing in order not to drop stream,".format(e))
+                if not line:
+                    continue
+                try:
+                    kind, results = handle_line(line, on_tweet, on_notification, on_raw,
+                                                on_delete, on_limit, buffer)
+                except Exception as e:
+                    logging.error("Error! Encountered Exception {0} but continuing in order not to drop stream,".format(e))
+                    continue
+                if kind == "disconnect":
+                    disconnect_code = parse_disconnect(line)
+                    break
         # Stop if users press ctrl-c
         except (KeyboardInterrupt, SystemExit):
             logging.error("User stopped program, exiting!")
@@ -193,6 +650,9 @@ def stream(on_tweet=None, on_notification=None, track=None, follow=None):
             raise
         except Exception as e:
             logging.error("Error! Encountered Exception {0} but continuing in order not to drop stream,".format(e))
+        # The stream ended, so we wait a moment before reconnecting
+        stream.close()
+        time.sleep(delays.delay(disconnect_code))
 
 
 
@@ -203,7 +663,7 @@ def test():
     :returns: tweetcount (int)
     """
 
-    r = auth.post(FILTER_URL, data={"track": "if"}, stream=True)
+    r = authorized().post(FILTER_URL, data={"track": "if"}, stream=True)
     logging.debug("Connection status code: {0}".format(r.status_code))
     if r.status_code != 200:
         logging.debug("ERROR, closing connection. ", r)
@@ -216,8 +676,8 @@ def test():
             logging.debug("Finished, exiting. Got {0} tweets over ~10 seconds".format(tweetcount))
             return tweetcount
         if e:
-            # The line from twitter is a bytestring, so we decode it to uicode
-            js = json.loads(e.decode())
+            # The line from twitter is a bytestring, which our json decoder handles directly
+            js = jsoncodec.loads(e)
             # It's only a tweet if it has a "text" field
             if "text" in js:
                 tweetcount += 1
@@ -47,14 +47,15 @@ def find_keyfile(directory="."):
                 yield os.path.join(root, filename)
 
 
-def authorize(filepath=None):
+def load_keys(filepath=None):
     """
-    Create an authorization object for use with the requests
-    library. Takes the path to a yaml-encoded file containing twitter API keys.
+    Load one or several sets of twitter API keys from a yaml-encoded file.
+    The file may either contain a single set of keys (see keys.yaml.template)
+    or a list of such sets, one per application.
 
     :param filepath:
     :type filepath: str
-    :returns: OAuth1Session
+    :returns: list of dictionaries with keys
     """
     # Try to find the file if no path was given
     # find_keyfile returns a generator and .next() gives the first match
@@ -64,14 +65,53 @@ def authorize(filepath=None):
         raise Exception("No Keyfile found - please place keys.yaml with your tokens in the project directory or pass a custom filepath to the authorize() function")
     # Load credentials from keyfile
     with open(filepath, 'r') as f:
-        keys = yaml.load(f)
-
-    # Create authentication object
-    auth_object = OAuth1Session(client_key=keys["client_key"],
-                                client_secret=keys["client_secret"],
-                                resource_owner_key=keys["resource_owner_key"],
-                                resource_owner_secret=keys["resource_owner_secret"])
-    return auth_object
+        keys = yaml.safe_load(f)
+    if isinstance(keys, dict):
+        keys = [keys]
+    return keys
+
+
+def session_from_keys(keys):
+    """
+    Create an authorization object from a dictionary of keys.
+
+    :returns: OAuth1Session
+    """
+    return OAuth1Session(client_key=keys["client_key"],
+                         client_secret=keys["client_secret"],
+                         resource_owner_key=keys["resource_owner_key"],
+                         resource_owner_secret=keys["resource_owner_secret"])
+
+
+def authorize(filepath=None):
+    """
+    Create an authorization object for use with the requests
+    library. Takes the path to a yaml-encoded file containing twitter API keys.
+    If the file contains several sets of keys, the first one is used.
+
+    :param filepath:
+    :type filepath: str
+    :returns: OAuth1Session
+    """
+    return session_from_keys(load_keys(filepath)[0])
+
+
+def authorize_all(filepaths=None):
+    """
+    Create authorization objects for all keys in the given keyfiles.
+    Without filepaths, all files named keys.yaml in the current directory
+    and its subdirectories are used.
+
+    :param filepaths:
+    :type filepaths: list of str
+    :returns: list of OAuth1Session
+    """
+    filepaths = filepaths or list(find_keyfile())
+    if not filepaths:
+        raise Exception("No Keyfile found - please place keys.yaml with your tokens in the project directory or pass custom filepaths to the authorize_all() function")
+    return [session_from_keys(keys)
+            for filepath in filepaths
+            for keys in load_keys(filepath)]
 
 
 def test():